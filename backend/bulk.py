@@ -0,0 +1,297 @@
+# backend/bulk.py
+"""
+Bulk import and export of people, tasks and chats.
+
+Import reads CSV or JSONL one row at a time and works in chunks of
+MOEX_BULK_CHUNK rows. Each chunk's secret words are hashed in parallel on
+the hashing pool, then the chunk is written in one transaction. People are
+upserted: a row whose email or handle already exists updates that person
+(blank fields are left alone, and a secret_word re-keys them and ends their
+sessions). Any other row inserts a new person. Each row runs under its own SAVEPOINT, so a bad row is
+reported with its line number and the rest of the batch still lands.
+
+Rows may carry "tasks", added for that person in the same transaction: in
+JSONL a list of titles or {title, due_date, status} objects, in CSV a
+"|"-separated list of titles.
+
+Export streams JSONL by keyset pages of MOEX_BULK_CHUNK rows; whole tables
+are never held in memory. Each line is a table row plus "_table". Secret
+salts and hashes are never exported.
+
+    python -m backend.bulk import people.csv
+    python -m backend.bulk export --tables people,tasks --out dump.jsonl
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import sqlite3
+import sys
+from typing import IO, Iterable, Iterator, List, Tuple
+
+from backend import db, hashing
+
+log = logging.getLogger(__name__)
+
+CHUNK = int(os.getenv("MOEX_BULK_CHUNK", "500"))
+MAX_ERRORS = 200  # reported per import; the count is always exact
+
+PEOPLE_FIELDS = ("name", "email", "handle", "tags", "persona", "is_enabled")
+TASK_STATUSES = ("pending", "in_progress", "blocked", "done", "cancelled")
+
+EXPORT_SQL = {
+    "people": "SELECT id, name, handle, email, tags, persona, is_enabled, created_at FROM people",
+    "tasks": "SELECT * FROM tasks",
+    "chats": "SELECT * FROM chats",
+}
+
+
+class RowError(ValueError):
+    pass
+
+
+# -------- Reading --------
+def read_rows(stream: IO[str], fmt: str) -> Iterator[Tuple[int, object]]:
+    """(line number, dict) per input row; a (line, RowError) for unparseable lines."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, {k.strip().lower(): v for k, v in row.items() if k}
+        return
+    for n, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield n, RowError(f"invalid JSON: {e}")
+            continue
+        yield n, row if isinstance(row, dict) else RowError("expected a JSON object")
+
+
+def guess_format(name: str = "", content_type: str = "") -> str:
+    if name.lower().endswith(".csv") or "csv" in content_type:
+        return "csv"
+    return "jsonl"
+
+
+def _clean(row: dict) -> dict:
+    if row.get("_table", "people") != "people":
+        raise RowError("not a people row")
+    out = {}
+    for k in PEOPLE_FIELDS + ("secret_word",):
+        v = row.get(k)
+        if v is not None and not isinstance(v, (str, int, float)):
+            raise RowError(f"{k} must be a string")  # lists/objects would only fail in SQLite
+        if k == "secret_word" and v is not None:
+            v = str(v)
+        if isinstance(v, str):
+            v = v.strip() or None
+        if v is not None:
+            out[k] = v
+    if "email" in out and "@" not in str(out["email"]):
+        raise RowError("invalid email")
+    if "is_enabled" in out:
+        out["is_enabled"] = int(str(out["is_enabled"]).lower() in ("1", "true", "yes"))
+    if "email" not in out and "handle" not in out and "name" not in out:
+        raise RowError("row has no name, email or handle")
+    tasks = row.get("tasks") or []
+    if isinstance(tasks, str):  # CSV: "title one|title two"
+        tasks = [t for t in tasks.split("|") if t.strip()]
+    if not isinstance(tasks, list):
+        raise RowError("tasks must be a list")
+    out["tasks"] = [_clean_task(t) for t in tasks]
+    return out
+
+
+def _clean_task(t) -> dict:
+    if isinstance(t, str):
+        t = {"title": t}
+    if not isinstance(t, dict) or not isinstance(t.get("title"), str) or not t["title"].strip():
+        raise RowError("task needs a title")
+    status = t.get("status") or "pending"
+    if not isinstance(status, str) or status not in TASK_STATUSES:
+        raise RowError(f"unknown task status {status!r}")
+    due = t.get("due_date") or None
+    if due is not None and not isinstance(due, str):
+        raise RowError("task due_date must be a string")
+    return {"title": t["title"].strip(), "due_date": due, "status": status}
+
+
+# -------- Import --------
+class PeopleImporter:
+    def __init__(self, chunk: int = CHUNK):
+        self.chunk = chunk
+        self.inserted = 0
+        self.updated = 0
+        self.tasks = 0
+        self.failed = 0
+        self.errors: List[dict] = []
+        self.touched: List[int] = []  # updated person ids, for cache invalidation
+
+    def _error(self, line: int, err: Exception):
+        self.failed += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({"line": line, "error": str(err)})
+
+    def run(self, rows: Iterable[Tuple[int, object]]) -> dict:
+        batch = []
+        for line, row in rows:
+            if isinstance(row, Exception):
+                self._error(line, row)
+                continue
+            try:
+                batch.append((line, _clean(row)))
+            except (RowError, TypeError) as e:
+                self._error(line, e)
+                continue
+            if len(batch) >= self.chunk:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+        return self.report()
+
+    def _write(self, batch: List[Tuple[int, dict]]):
+        words = [r["secret_word"] for _, r in batch if "secret_word" in r]
+        hashes = iter(hashing.hash_many(words)) if words else iter(())
+        with db.connection() as conn:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                for line, row in batch:
+                    keyed = next(hashes) if "secret_word" in row else None
+                    conn.execute("SAVEPOINT row")
+                    try:
+                        self._upsert(conn, row, keyed)
+                    except (sqlite3.Error, RowError) as e:
+                        conn.execute("ROLLBACK TO row")
+                        self._error(line, e)
+                    conn.execute("RELEASE row")
+        log.info("bulk import: %d inserted, %d updated, %d failed so far",
+                 self.inserted, self.updated, self.failed)
+
+    def _upsert(self, conn: sqlite3.Connection, row: dict, keyed):
+        matches = {
+            r[0] for r in conn.execute(
+                "SELECT id FROM people WHERE email=? OR handle=?",
+                (row.get("email"), row.get("handle")),
+            )
+        }
+        if len(matches) > 1:
+            raise RowError("email and handle belong to different people")
+        fields = {k: row[k] for k in PEOPLE_FIELDS if k in row}
+        if keyed:
+            fields.update(secret_salt=keyed[0], secret_hash=keyed[1], secret_iters=keyed[2])
+        existing = next(iter(matches), None)
+        if existing is not None:
+            person_id = existing
+            if fields:
+                cols = ", ".join(f"{k}=?" for k in fields)
+                conn.execute(f"UPDATE people SET {cols} WHERE id=?", (*fields.values(), person_id))
+            if keyed:
+                # a new secret word: sessions issued for the old one are no longer trusted
+                conn.execute("DELETE FROM sessions WHERE person_id=?", (person_id,))
+        else:
+            if "name" not in fields or not keyed:
+                raise RowError("new people need a name and a secret_word")
+            fields.setdefault("is_enabled", 1)
+            cols = ", ".join(fields)
+            cur = conn.execute(
+                f"INSERT INTO people({cols}) VALUES ({','.join('?' * len(fields))})", tuple(fields.values()))
+            person_id = cur.lastrowid
+        for t in row["tasks"]:
+            conn.execute(
+                "INSERT INTO tasks(person_id, title, due_date, status) VALUES (?,?,?,?)",
+                (person_id, t["title"], t["due_date"], t["status"]),
+            )
+        # counted only once nothing in the row can fail
+        if existing is not None:
+            self.updated += 1
+            self.touched.append(person_id)
+        else:
+            self.inserted += 1
+        self.tasks += len(row["tasks"])
+
+    def report(self) -> dict:
+        return {
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "tasks": self.tasks,
+            "failed": self.failed,
+            "errors": self.errors,
+        }
+
+
+def import_people(stream: IO[str], fmt: str = "jsonl", chunk: int = CHUNK) -> PeopleImporter:
+    importer = PeopleImporter(chunk)
+    importer.run(read_rows(stream, fmt))
+    return importer
+
+
+def import_binary(fileobj: IO[bytes], fmt: str = "jsonl", chunk: int = CHUNK) -> PeopleImporter:
+    # utf-8-sig: spreadsheets like to prepend a BOM to CSV exports
+    return import_people(io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline=""), fmt, chunk)
+
+
+# -------- Export --------
+def iter_table(table: str, chunk: int = CHUNK) -> Iterator[dict]:
+    """Rows of one table in id order, one keyset page in memory at a time."""
+    sql = f"{EXPORT_SQL[table]} WHERE id > ? ORDER BY id LIMIT ?"
+    last = 0
+    while True:
+        rows = db.all(sql, (last, chunk))
+        for r in rows:
+            if isinstance(r.get("is_enabled"), int):
+                r["is_enabled"] = bool(r["is_enabled"])
+            yield {"_table": table, **r}
+        if len(rows) < chunk:
+            return
+        last = rows[-1]["id"]
+
+
+def export_lines(tables: Iterable[str], chunk: int = CHUNK) -> Iterator[str]:
+    for table in tables:
+        for r in iter_table(table, chunk):
+            yield json.dumps(r, ensure_ascii=False) + "\n"
+
+
+def parse_tables(spec: str) -> List[str]:
+    tables = [t.strip() for t in spec.split(",") if t.strip()]
+    unknown = [t for t in tables if t not in EXPORT_SQL]
+    if unknown:
+        raise ValueError(f"unknown tables: {', '.join(unknown)}")
+    return tables
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    ap = argparse.ArgumentParser(description="MoeX bulk import/export")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    imp = sub.add_parser("import", help="upsert people from CSV or JSONL ('-' = stdin)")
+    imp.add_argument("path")
+    imp.add_argument("--format", choices=["csv", "jsonl"])
+    imp.add_argument("--chunk", type=int, default=CHUNK)
+    exp = sub.add_parser("export", help="write tables as JSONL")
+    exp.add_argument("--tables", default="people,tasks,chats")
+    exp.add_argument("--out", default="-")
+    exp.add_argument("--chunk", type=int, default=CHUNK)
+    args = ap.parse_args()
+    db.init_db()
+    if args.cmd == "import":
+        fmt = args.format or guess_format(args.path)
+        try:
+            if args.path == "-":
+                result = import_binary(sys.stdin.buffer, fmt, args.chunk)
+            else:
+                with open(args.path, "rb") as f:
+                    result = import_binary(f, fmt, args.chunk)
+        finally:
+            hashing.shutdown()
+        print(json.dumps(result.report(), indent=2))
+        sys.exit(1 if result.failed else 0)
+    else:
+        out = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8")
+        with out:
+            out.writelines(export_lines(parse_tables(args.tables), args.chunk))
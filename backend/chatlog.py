@@ -0,0 +1,173 @@
+# backend/chatlog.py
+"""
+Write-behind logger for the chats table.
+
+Requests drop (person_id, role, text) onto an in-memory queue and move on; a
+background thread drains it and writes each batch with one executemany in a
+single transaction, so N messages cost one commit instead of N. Batches are
+flushed when they reach `batch_size` or after `flush_interval` seconds.
+
+When the queue is full (or the writer isn't running) submit() returns False
+and the caller writes synchronously — that's the backpressure.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+from backend import db
+
+log = logging.getLogger(__name__)
+
+INSERT_SQL = "INSERT INTO chats(person_id, role, text, ts) VALUES(?,?,?,?)"
+
+
+def utc_ts() -> str:
+    # same shape as the column default datetime('now')
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+
+
+class ChatLogWriter:
+    def __init__(
+        self,
+        batch_size: int = 200,
+        flush_interval: float = 0.05,
+        max_queue: int = 10_000,
+        retries: int = 3,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self._q: "queue.Queue[tuple]" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.rejected = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.batch_seconds_total = 0.0
+        self.batch_seconds_max = 0.0
+        # called with each batch once it is committed (e.g. to tell other workers)
+        self.on_written: Optional[Callable[[list], None]] = None
+
+    @classmethod
+    def from_env(cls) -> "ChatLogWriter":
+        return cls(
+            batch_size=int(os.getenv("MOEX_CHATLOG_BATCH", "200")),
+            flush_interval=float(os.getenv("MOEX_CHATLOG_FLUSH_MS", "50")) / 1000.0,
+            max_queue=int(os.getenv("MOEX_CHATLOG_QUEUE", "10000")),
+        )
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="moex-chatlog", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Flush what's queued, then stop the writer thread."""
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, person_id, role: str, text: str) -> bool:
+        if not self.running:
+            return False
+        try:
+            self._q.put_nowait((person_id, role, text, utc_ts()))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Block until everything queued so far is written (or timeout)."""
+        deadline = time.monotonic() + timeout
+        while self._q.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    # -------- worker --------
+    def _take_batch(self) -> list:
+        try:
+            first = self._q.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._q.get_nowait())
+            except queue.Empty:
+                # give a burst a moment to fill the batch, but never past the interval
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(0.002)
+        return batch
+
+    def _write(self, batch: list):
+        started = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                db.executemany(INSERT_SQL, batch)
+                break
+            except Exception as e:
+                if attempt == self.retries:
+                    log.error("chat log batch of %d dropped: %s", len(batch), e)
+                    with self._lock:
+                        self.dropped += len(batch)
+                    return
+                time.sleep(0.05 * (2 ** attempt))
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.written += len(batch)
+            self.batches += 1
+            self.batch_seconds_total += elapsed
+            self.batch_seconds_max = max(self.batch_seconds_max, elapsed)
+        if self.on_written is not None:
+            try:
+                self.on_written(batch)
+            except Exception:
+                log.exception("chat log on_written hook failed")
+
+    def _run(self):
+        while not (self._stop.is_set() and self._q.empty()):
+            batch = self._take_batch()
+            if not batch:
+                continue
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._q.task_done()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": self.running,
+                "queue_depth": self._q.qsize(),
+                "enqueued": self.enqueued,
+                "rejected": self.rejected,
+                "written": self.written,
+                "dropped": self.dropped,
+                "batches": self.batches,
+                "avg_batch_size": round(self.written / self.batches, 2) if self.batches else 0.0,
+                "avg_batch_ms": round(self.batch_seconds_total / self.batches * 1000, 3) if self.batches else 0.0,
+                "max_batch_ms": round(self.batch_seconds_max * 1000, 3),
+            }
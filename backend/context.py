@@ -0,0 +1,191 @@
+# backend/context.py
+"""
+Conversation memory for /chat.
+
+Keeps a rolling window of recent turns per active person (LRU over people),
+seeded from the chats table on first use via idx_chats_person_id. Turns that
+fall out of the token budget are folded into a short running summary instead
+of being resent verbatim, so prompt size stays flat however long a
+conversation gets. Guests (person_id None) get no memory.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+
+from backend import db
+
+_SENTENCE = re.compile(r"(?<=[.!?؟])\s")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate: ~4 ASCII chars per token, ~2 for everything else
+    (Arabic and friends tokenize denser). Good enough for budgeting.
+    """
+    if not text:
+        return 0
+    n = len(text)
+    ascii_n = len(text.encode("ascii", "ignore"))
+    return ascii_n // 4 + (n - ascii_n) // 2 + 1
+
+
+def _gist(text: str, limit: int = 120) -> str:
+    first = _SENTENCE.split(text.strip(), 1)[0]
+    first = " ".join(first.split())
+    return first if len(first) <= limit else first[: limit - 1] + "…"
+
+
+class _Window:
+    __slots__ = ("turns", "tokens", "summary", "summary_tokens")
+
+    def __init__(self):
+        self.turns: deque = deque()        # (role, text, tokens)
+        self.tokens = 0
+        self.summary: deque = deque()      # gist lines, oldest first
+        self.summary_tokens = 0
+
+
+class ConversationMemory:
+    def __init__(
+        self,
+        budget_tokens: int = 1200,
+        max_turns: int = 20,
+        summary_budget_tokens: int = 200,
+        max_people: int = 2000,
+    ):
+        self.budget = budget_tokens
+        self.max_turns = max_turns
+        self.summary_budget = summary_budget_tokens
+        self.max_people = max_people
+        self._lock = threading.Lock()
+        self._windows: "OrderedDict[int, _Window]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> Optional["ConversationMemory"]:
+        if os.getenv("MOEX_CONTEXT", "true").lower() != "true":
+            return None
+        return cls(
+            budget_tokens=int(os.getenv("MOEX_CONTEXT_TOKENS", "1200")),
+            max_turns=int(os.getenv("MOEX_CONTEXT_TURNS", "20")),
+            summary_budget_tokens=int(os.getenv("MOEX_CONTEXT_SUMMARY_TOKENS", "200")),
+        )
+
+    # -------- internals (lock held) --------
+    def _fold(self, w: _Window, role: str, text: str):
+        who = "They asked" if role == "user" else "You said"
+        line = f"- {who}: {_gist(text)}"
+        t = estimate_tokens(line)
+        w.summary.append((line, t))
+        w.summary_tokens += t
+        while w.summary and w.summary_tokens > self.summary_budget:
+            _, old = w.summary.popleft()
+            w.summary_tokens -= old
+
+    def _trim(self, w: _Window):
+        while w.turns and (len(w.turns) > self.max_turns or w.tokens > self.budget):
+            role, text, t = w.turns.popleft()
+            w.tokens -= t
+            self._fold(w, role, text)
+
+    def _append(self, w: _Window, role: str, text: str):
+        t = estimate_tokens(text)
+        w.turns.append((role, text, t))
+        w.tokens += t
+        self._trim(w)
+
+    def _install(self, person_id: int, w: _Window) -> _Window:
+        existing = self._windows.get(person_id)
+        if existing is not None:
+            return existing
+        self._windows[person_id] = w
+        while len(self._windows) > self.max_people:
+            self._windows.popitem(last=False)
+        return w
+
+    def _load(self, person_id: int) -> _Window:
+        rows = db.all(
+            "SELECT role, text FROM chats WHERE person_id=? ORDER BY id DESC LIMIT ?",
+            (person_id, self.max_turns * 2),
+        )
+        w = _Window()
+        for r in reversed(rows):
+            if r["role"] in ("user", "assistant") and r["text"]:
+                self._append(w, r["role"], r["text"])
+        return w
+
+    def _window(self, person_id: int) -> Optional[_Window]:
+        with self._lock:
+            w = self._windows.get(person_id)
+            if w is not None:
+                self._windows.move_to_end(person_id)
+            return w
+
+    # -------- public --------
+    def history(self, person_id: Optional[int]) -> List[Dict[str, str]]:
+        """Messages to send before the new user turn (summary first, then turns)."""
+        if person_id is None:
+            return []
+        w = self._window(person_id)
+        if w is None:
+            loaded = self._load(person_id)
+            with self._lock:
+                w = self._install(person_id, loaded)
+        return self._render(w)
+
+    async def ahistory(self, person_id: Optional[int]) -> List[Dict[str, str]]:
+        if person_id is None:
+            return []
+        w = self._window(person_id)
+        if w is None:
+            loaded = await db.offload(self._load, person_id)
+            with self._lock:
+                w = self._install(person_id, loaded)
+        return self._render(w)
+
+    def _render(self, w: _Window) -> List[Dict[str, str]]:
+        with self._lock:
+            out: List[Dict[str, str]] = []
+            if w.summary:
+                out.append({
+                    "role": "system",
+                    "content": "Earlier in this conversation:\n" + "\n".join(l for l, _ in w.summary),
+                })
+            out.extend({"role": role, "content": text} for role, text, _ in w.turns)
+            return out
+
+    def record(self, person_id: Optional[int], role: str, text: str):
+        """Append a turn to an active window (no-op if the person isn't loaded)."""
+        if person_id is None or not text:
+            return
+        with self._lock:
+            w = self._windows.get(person_id)
+            if w is not None:
+                self._append(w, role, text)
+
+    def forget(self, person_id: int):
+        with self._lock:
+            self._windows.pop(person_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "active_people": len(self._windows),
+                "turns": sum(len(w.turns) for w in self._windows.values()),
+                "tokens": sum(w.tokens + w.summary_tokens for w in self._windows.values()),
+            }
+
+
+def fit_to_budget(messages: List[Dict[str, str]], budget_tokens: int) -> List[Dict[str, str]]:
+    """Keep the newest messages whose estimated size fits the budget."""
+    kept: List[Dict[str, str]] = []
+    used = 0
+    for m in reversed(messages):
+        t = estimate_tokens(m.get("content") or "")
+        if used + t > budget_tokens:
+            break
+        kept.append(m)
+        used += t
+    kept.reverse()
+    return kept
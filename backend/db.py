@@ -1,21 +1,245 @@
+import os
+import asyncio
+import hashlib
+import queue
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Optional
 
-DB_PATH = Path(__file__).resolve().parent / "moex.db"
+DB_PATH = Path(os.getenv("MOEX_DB") or Path(__file__).resolve().parent / "moex.db")
 SCHEMA_PATH = Path(__file__).resolve().parent / "schema.sql"
 
-def get_conn():
-    conn = sqlite3.connect(DB_PATH)
+# -------- Connection tuning (override via env) --------
+POOL_SIZE = int(os.getenv("MOEX_DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.getenv("MOEX_DB_POOL_TIMEOUT", "10"))
+BUSY_TIMEOUT_MS = int(os.getenv("MOEX_DB_BUSY_TIMEOUT_MS", "5000"))
+CACHE_SIZE_KB = int(os.getenv("MOEX_DB_CACHE_KB", "16384"))
+MMAP_SIZE = int(os.getenv("MOEX_DB_MMAP_BYTES", str(64 * 1024 * 1024)))
+STATEMENT_CACHE = int(os.getenv("MOEX_DB_STATEMENT_CACHE", "256"))
+SCHEMA_FORCE = os.getenv("MOEX_SCHEMA_FORCE", "false").lower() == "true"
+
+def _configure(conn: sqlite3.Connection) -> sqlite3.Connection:
     conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    # WAL lets readers run alongside the single writer; NORMAL is durable across
+    # app crashes in WAL mode and skips the per-commit fsync of FULL.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
     return conn
 
-def init_db():
+def get_conn():
+    """Open a fresh, tuned connection (not pooled). Caller owns closing it."""
+    conn = sqlite3.connect(DB_PATH, cached_statements=STATEMENT_CACHE)
+    return _configure(conn)
+
+# -------- Pool --------
+class ConnectionPool:
+    """
+    Bounded pool of long-lived connections shared by request threads.
+    Connections are created lazily up to `size`; callers beyond that wait
+    (up to `timeout`) for one to be returned. Each connection keeps its own
+    prepared-statement cache, so hot queries skip re-parsing.
+    """
+
+    def __init__(self, path, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT):
+        self.path = path
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._checkouts = 0
+        self._hits = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+
+    def _new_conn(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            cached_statements=STATEMENT_CACHE,
+            check_same_thread=False,
+        )
+        return _configure(conn)
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self._checkouts += 1
+                self._hits += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                conn = self._new_conn()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+            with self._lock:
+                self._checkouts += 1
+            return conn
+
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"DB pool exhausted ({self.size} connections busy)") from None
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._checkouts += 1
+            self._waits += 1
+            self._wait_seconds += waited
+        return conn
+
+    def release(self, conn: sqlite3.Connection, broken: bool = False):
+        if broken:
+            try:
+                conn.close()
+            finally:
+                with self._lock:
+                    self._created -= 1
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except sqlite3.DatabaseError as e:
+            # corrupt/closed handles shouldn't go back into the pool
+            broken = not isinstance(e, (sqlite3.IntegrityError, sqlite3.OperationalError))
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    def warm(self, n: Optional[int] = None):
+        """Open up to `n` connections now so the first requests don't pay for it."""
+        held = []
+        try:
+            for _ in range(min(n or self.size, self.size)):
+                conn = self.acquire()
+                held.append(conn)
+                conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        finally:
+            for conn in held:
+                self.release(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            checkouts = self._checkouts
+            return {
+                "size": self.size,
+                "open": self._created,
+                "idle": self._idle.qsize(),
+                "checkouts": checkouts,
+                "waits": self._waits,
+                "wait_seconds_total": round(self._wait_seconds, 6),
+                "hit_rate": round(self._hits / checkouts, 4) if checkouts else 0.0,
+            }
+
+_pool = ConnectionPool(DB_PATH)
+
+def connection():
+    """Context manager yielding a pooled connection."""
+    return _pool.connection()
+
+def warm_pool(n: Optional[int] = None):
+    _pool.warm(n)
+
+def pool_stats() -> dict:
+    return _pool.stats()
+
+def close_pool():
+    _pool.close()
+
+# -------- Schema --------
+# Columns added after a table first shipped. CREATE TABLE IF NOT EXISTS won't
+# touch existing tables, so these are ALTERed in on boot (like setup_moex.sh).
+_ADDED_COLUMNS = {
+    "people": {"persona": "TEXT", "secret_iters": "INTEGER"},
+    "tasks": {"person_id": "INTEGER"},  # older DBs only had a free-text owner
+}
+
+def _ensure_columns(conn: sqlite3.Connection):
+    for table, cols in _ADDED_COLUMNS.items():
+        have = {r["name"] for r in conn.execute(f"PRAGMA table_info({table})")}
+        if not have:
+            continue  # fresh DB: schema.sql creates it with every column
+        for col, decl in cols.items():
+            if col not in have:
+                try:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} {decl}")
+                except sqlite3.OperationalError as e:
+                    # another worker booting at the same moment got there first
+                    if "duplicate column" not in str(e):
+                        raise
+    conn.commit()
+
+def _ensure_incremental_vacuum(conn: sqlite3.Connection):
+    # only free on an empty file; existing DBs convert via `python -m backend.retention vacuum`
+    has_tables = conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone()
+    if not has_tables and conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+
+def schema_version(script: str) -> str:
+    return hashlib.sha256(f"{script}\n{_ADDED_COLUMNS!r}".encode("utf-8")).hexdigest()[:16]
+
+def _stored_schema_version(conn: sqlite3.Connection) -> Optional[str]:
+    try:
+        row = conn.execute("SELECT value FROM moex_meta WHERE key='schema_version'").fetchone()
+    except sqlite3.OperationalError:  # no moex_meta yet
+        return None
+    return row[0] if row else None
+
+def init_db() -> bool:
+    """
+    Apply schema.sql. Skipped on boot when moex_meta already records this
+    version of it (MOEX_SCHEMA_FORCE=true re-applies). True if it ran.
+    """
     if SCHEMA_PATH.exists():
-        with get_conn() as conn, open(SCHEMA_PATH, "r", encoding="utf-8") as f:
-            conn.executescript(f.read())
+        script = SCHEMA_PATH.read_text(encoding="utf-8")
+        version = schema_version(script)
+        with connection() as conn:
+            if not SCHEMA_FORCE and _stored_schema_version(conn) == version:
+                return False
+            _ensure_incremental_vacuum(conn)
+            _ensure_columns(conn)
+            conn.executescript(script)
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO moex_meta(key, value) VALUES ('schema_version', ?)", (version,))
+        return True
     else:
         # minimal bootstrap so things don’t crash without schema.sql
-        with get_conn() as conn:
+        with connection() as conn:
             conn.executescript("""
             CREATE TABLE IF NOT EXISTS people (
               id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -27,35 +251,66 @@ def init_db():
               person_id INTEGER, role TEXT, text TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             );
             """)
+        return True
 
+# -------- Query helpers --------
 def all(sql, params=()):
-    with get_conn() as conn:
+    with connection() as conn:
         cur = conn.execute(sql, params)
         return [dict(r) for r in cur.fetchall()]
 
 def one(sql, params=()):
-    with get_conn() as conn:
+    with connection() as conn:
         cur = conn.execute(sql, params)
         row = cur.fetchone()
         return dict(row) if row else None
 
 def query(sql, params=()):
-    with get_conn() as conn:
-        cur = conn.execute(sql, params)
-        return [dict(r) for r in cur.fetchall()]
+    return all(sql, params)
 
 def execute(sql, params=()):
-    with get_conn() as conn:
-        cur = conn.execute(sql, params)
-        conn.commit()
+    with connection() as conn:
+        with conn:  # commit on success, rollback on error
+            cur = conn.execute(sql, params)
         return cur.lastrowid
 
+def executemany(sql, seq_of_params):
+    with connection() as conn:
+        with conn:
+            cur = conn.executemany(sql, seq_of_params)
+        return cur.rowcount
+
+# -------- Async helpers --------
+# Async routes push DB work onto a dedicated executor sized to the pool, so
+# SQLite calls never queue behind (or starve) Starlette's shared threadpool.
+_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="moex-db")
+
+async def offload(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, fn, *args)
+
+async def aall(sql, params=()):
+    return await offload(all, sql, params)
+
+async def aone(sql, params=()):
+    return await offload(one, sql, params)
+
+async def aexecute(sql, params=()):
+    return await offload(execute, sql, params)
+
+async def aexecutemany(sql, seq_of_params):
+    return await offload(executemany, sql, seq_of_params)
+
 def list_people():
     return all("SELECT id,name,email,tags FROM people WHERE is_enabled=1")
 
 def list_tasks(person_id: int):
-    return all("SELECT id,title,due_date,status FROM tasks WHERE person_id=?", (person_id,))
+    return all(
+        "SELECT id,title,due_date,status FROM tasks WHERE person_id=? ORDER BY status, due_date",
+        (person_id,),
+    )
 
 if __name__ == "__main__":
     init_db()
     print("DB ready:", DB_PATH)
+    print("Pool:", pool_stats())
@@ -0,0 +1,203 @@
+# backend/hashing.py
+"""
+Secret-word hashing off the event loop.
+
+PBKDF2 at six-figure iteration counts is ~50-100 ms of pure CPU holding the
+GIL, so async callers hand it to a small process pool. The pool has a
+bounded backlog: past `max_pending` jobs we refuse (HashBusy) instead of
+queueing unbounded CPU work. Workers start from a forkserver (spawn where
+that's missing), never a fork of this threaded process. Bulk hashing
+(hash_many) counts against the same backlog and waits while logins are
+queued, so an import can't starve /auth/verify.
+
+Iteration counts are stored per people row (secret_iters; NULL means the
+original 120k), so MOEX_PBKDF2_ITERS can be raised without breaking old
+hashes — rows are rehashed at the new cost on their next successful login.
+
+AttemptThrottle rejects /auth/verify bursts per person and per IP before any
+hashing happens.
+"""
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from backend import metrics
+
+LEGACY_ITERATIONS = 120_000
+ITERATIONS = int(os.getenv("MOEX_PBKDF2_ITERS", str(LEGACY_ITERATIONS)))
+WORKERS = int(os.getenv("MOEX_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+MAX_PENDING = int(os.getenv("MOEX_HASH_MAX_PENDING", "64"))
+
+
+class HashBusy(Exception):
+    """Hash backlog is full; try again shortly."""
+
+
+class Throttled(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"too many attempts; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def _pbkdf2(secret: str, salt: bytes, iterations: int) -> bytes:
+    return hashlib.pbkdf2_hmac("sha256", secret.encode("utf-8"), salt, iterations)
+
+
+def hash_secret(secret: str, salt: Optional[bytes] = None, iterations: Optional[int] = None) -> Tuple[bytes, bytes, int]:
+    iterations = iterations or ITERATIONS
+    if salt is None:
+        salt = os.urandom(16)
+    return salt, _pbkdf2(secret, salt, iterations), iterations
+
+
+def verify_secret(secret: str, salt: bytes, secret_hash: bytes, iterations: Optional[int] = None) -> bool:
+    test = _pbkdf2(secret, salt, iterations or LEGACY_ITERATIONS)
+    return secrets.compare_digest(test, secret_hash)
+
+
+def needs_rehash(iterations: Optional[int]) -> bool:
+    return (iterations or LEGACY_ITERATIONS) != ITERATIONS
+
+
+# -------- Process pool --------
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_pending = 0  # jobs queued or running, logins and bulk
+_bulk_pending = 0
+
+
+def _mp_context():
+    # fork would copy a process already running the DB executor, chat log,
+    # invalidation and prewarm threads (and any locks they hold)
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=_mp_context())
+        return _pool
+
+
+async def _run(fn, *args):
+    global _pending
+    with _pool_lock:
+        if _pending >= MAX_PENDING:
+            raise HashBusy()
+        _pending += 1
+    try:
+        with metrics.span("pbkdf2"):  # includes time queued for a worker
+            return await asyncio.get_running_loop().run_in_executor(_get_pool(), fn, *args)
+    finally:
+        with _pool_lock:
+            _pending -= 1
+
+
+async def ahash_secret(secret: str, salt: Optional[bytes] = None, iterations: Optional[int] = None) -> Tuple[bytes, bytes, int]:
+    # resolve the cost here so workers never disagree with the parent's setting
+    return await _run(hash_secret, secret, salt, iterations or ITERATIONS)
+
+
+async def averify_secret(secret: str, salt: bytes, secret_hash: bytes, iterations: Optional[int] = None) -> bool:
+    return await _run(verify_secret, secret, salt, secret_hash, iterations)
+
+
+def _reserve_bulk(n: int):
+    """Block until no login is waiting and `n` more jobs fit in the backlog."""
+    global _pending, _bulk_pending
+    while True:
+        with _pool_lock:
+            if _pending == _bulk_pending and _pending + n <= max(MAX_PENDING, n):
+                _pending += n
+                _bulk_pending += n
+                return
+        time.sleep(0.005)
+
+
+def _release_bulk(n: int):
+    global _pending, _bulk_pending
+    with _pool_lock:
+        _pending -= n
+        _bulk_pending -= n
+
+
+def hash_many(words: List[str]) -> List[Tuple[bytes, bytes, int]]:
+    """Hash a batch across the pool; blocking, so call it off the event loop."""
+    pool = _get_pool()
+    out: List[Tuple[bytes, bytes, int]] = []
+    # one round of WORKERS at a time, so logins queue behind at most one round
+    for i in range(0, len(words), WORKERS):
+        batch = words[i:i + WORKERS]
+        _reserve_bulk(len(batch))
+        try:
+            out.extend(pool.map(hash_secret, batch, [None] * len(batch), [ITERATIONS] * len(batch)))
+        finally:
+            _release_bulk(len(batch))
+    return out
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def stats() -> dict:
+    return {"workers": WORKERS, "pending": _pending, "bulk_pending": _bulk_pending,
+            "max_pending": MAX_PENDING, "iterations": ITERATIONS}
+
+
+# -------- Attempt throttling --------
+class AttemptThrottle:
+    """Sliding-window count of failed attempts per key (person id or IP)."""
+
+    def __init__(self, limit: int, window_seconds: float, max_keys: int = 50_000):
+        self.limit = limit
+        self.window = window_seconds
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._fails: "OrderedDict[object, deque]" = OrderedDict()
+        self.rejections = 0
+
+    def _prune(self, key, now: float) -> deque:
+        q = self._fails.get(key)
+        if q is None:
+            return deque()
+        while q and q[0] <= now - self.window:
+            q.popleft()
+        if not q:
+            del self._fails[key]
+        return q
+
+    def check(self, key):
+        """Raise Throttled if `key` has used up its failures for the window."""
+        now = time.monotonic()
+        with self._lock:
+            q = self._prune(key, now)
+            if len(q) >= self.limit:
+                self.rejections += 1
+                raise Throttled(q[0] + self.window - now)
+
+    def fail(self, key):
+        now = time.monotonic()
+        with self._lock:
+            q = self._fails.setdefault(key, deque())
+            q.append(now)
+            self._fails.move_to_end(key)
+            while len(self._fails) > self.max_keys:
+                self._fails.popitem(last=False)
+
+    def reset(self, key):
+        with self._lock:
+            self._fails.pop(key, None)
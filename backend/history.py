@@ -0,0 +1,159 @@
+# backend/history.py
+"""
+Chat history reads: keyset pagination and FTS5 full-text search.
+
+chats_fts is an external-content FTS5 index over chats.text, kept in sync by
+triggers. On a database that already has chats, the index starts empty for
+old rows; `python -m backend.history backfill` fills it in small chunks (safe
+to stop and resume). moex_meta remembers how far the backfill got, and the
+delete/update triggers only touch rows that are actually indexed.
+
+    python -m backend.history backfill --chunk 5000
+"""
+import argparse
+import re
+from typing import Optional
+
+from backend import db
+
+_META_TARGET = "fts_backfill_target"  # rows with id <= target predate the triggers
+_META_POS = "fts_backfill_pos"        # ...and rows with id <= pos are indexed already
+
+_INDEXED = f"""(
+    {{row}}.id <= (SELECT CAST(value AS INTEGER) FROM moex_meta WHERE key='{_META_POS}')
+    OR {{row}}.id > (SELECT CAST(value AS INTEGER) FROM moex_meta WHERE key='{_META_TARGET}')
+)"""
+
+# one script, one transaction: no chat insert can land between reading the
+# backfill target and the triggers going live. IF NOT EXISTS / OR IGNORE make a
+# second worker racing through startup harmless.
+_FTS_SCRIPT = f"""
+BEGIN IMMEDIATE;
+INSERT OR IGNORE INTO moex_meta(key, value) SELECT '{_META_TARGET}', COALESCE(MAX(id), 0) FROM chats;
+INSERT OR IGNORE INTO moex_meta(key, value) VALUES ('{_META_POS}', '0');
+CREATE VIRTUAL TABLE IF NOT EXISTS chats_fts USING fts5(
+  text, content='chats', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS chats_fts_ai AFTER INSERT ON chats BEGIN
+  INSERT INTO chats_fts(rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS chats_fts_ad AFTER DELETE ON chats WHEN {_INDEXED.format(row="old")} BEGIN
+  INSERT INTO chats_fts(chats_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS chats_fts_au AFTER UPDATE OF text ON chats WHEN {_INDEXED.format(row="old")} BEGIN
+  INSERT INTO chats_fts(chats_fts, rowid, text) VALUES ('delete', old.id, old.text);
+  INSERT INTO chats_fts(rowid, text) VALUES (new.id, new.text);
+END;
+COMMIT;
+"""
+
+_COLUMNS = "id, person_id, role, text, ts"
+
+
+def ensure_fts():
+    """Create the FTS index + triggers once; remember which rows need backfill."""
+    with db.connection() as conn:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='chats_fts'"
+        ).fetchone()
+        if not exists:
+            conn.executescript(_FTS_SCRIPT)
+
+
+def _meta_int(conn, key: str) -> int:
+    row = conn.execute("SELECT value FROM moex_meta WHERE key=?", (key,)).fetchone()
+    return int(row[0]) if row else 0
+
+
+def backfill(chunk: int = 5000, log=print) -> int:
+    """Index pre-existing chats in chunks, one transaction each. Returns rows indexed."""
+    ensure_fts()
+    done = 0
+    while True:
+        with db.connection() as conn:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                pos = _meta_int(conn, _META_POS)
+                target = _meta_int(conn, _META_TARGET)
+                if pos >= target:
+                    break
+                rows = conn.execute(
+                    "SELECT id, text FROM chats WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+                    (pos, target, chunk),
+                ).fetchall()
+                new_pos = rows[-1][0] if rows else target
+                conn.executemany("INSERT INTO chats_fts(rowid, text) VALUES (?, ?)", [tuple(r) for r in rows])
+                conn.execute("UPDATE moex_meta SET value=? WHERE key=?", (str(new_pos), _META_POS))
+        done += len(rows)
+        log(f"indexed {done} rows (up to id {new_pos} of {target})")
+    return done
+
+
+# -------- Queries --------
+def page(person_id: Optional[int], before_id: Optional[int] = None, limit: int = 50, archive=None) -> dict:
+    """
+    Newest-first history for one person; pass next_before_id back for the next
+    page. With a retention.ChatArchive, pages continue into archived chats once
+    the hot table runs out.
+    """
+    rows = db.all(
+        f"""SELECT {_COLUMNS} FROM chats
+            WHERE person_id IS ? AND id < ?
+            ORDER BY id DESC LIMIT ?""",
+        (person_id, before_id or (1 << 62), limit),
+    )
+    if archive is not None and len(rows) < limit:
+        seen = {r["id"] for r in rows}
+        for r in archive.iter_person(person_id, rows[-1]["id"] if rows else before_id):
+            if r["id"] not in seen:  # a crashed compaction can leave a row in both
+                rows.append(r)
+                if len(rows) == limit:
+                    break
+    return {"items": rows, "next_before_id": rows[-1]["id"] if len(rows) == limit else None}
+
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+
+def fts_query(q: str) -> str:
+    """User text → safe FTS5 query: every word must match, last one as a prefix."""
+    terms = _TERM.findall(q or "")
+    if not terms:
+        return ""
+    quoted = [f'"{t}"' for t in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def search(
+    q: str,
+    person_id: Optional[int] = None,
+    all_people: bool = False,
+    before_id: Optional[int] = None,
+    limit: int = 50,
+) -> dict:
+    match = fts_query(q)
+    if not match:
+        return {"items": [], "next_before_id": None}
+    scope = "" if all_people else "AND c.person_id IS ?"
+    params = [match, before_id or (1 << 62)] + ([] if all_people else [person_id]) + [limit]
+    rows = db.all(
+        f"""SELECT c.id, c.person_id, c.role, c.text, c.ts,
+                   snippet(chats_fts, 0, '[', ']', '…', 12) AS snippet
+            FROM chats_fts JOIN chats c ON c.id = chats_fts.rowid
+            WHERE chats_fts MATCH ? AND c.id < ? {scope}
+            ORDER BY c.id DESC LIMIT ?""",
+        params,
+    )
+    return {"items": rows, "next_before_id": rows[-1]["id"] if len(rows) == limit else None}
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="MoeX chat history tools")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    bf = sub.add_parser("backfill", help="index existing chats into chats_fts")
+    bf.add_argument("--chunk", type=int, default=5000)
+    args = ap.parse_args()
+    db.init_db()
+    if args.cmd == "backfill":
+        print("done:", backfill(args.chunk), "rows")
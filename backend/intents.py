@@ -0,0 +1,362 @@
+# backend/intents.py
+"""
+Local fast path for the canned persona questions.
+
+PERSONA already scripts the answers to "about yourself", "about Abu Jafar",
+"your purpose", "capabilities", "limitations" and "creators". Paying for a
+full OpenAI round-trip to get a paraphrase of those is wasteful. This module
+classifies short messages against labelled English and Arabic exemplars,
+using character n-gram TF-IDF and cosine similarity in numpy. Confident
+matches are answered straight from the scripted lines in well under a
+millisecond.
+
+Character n-grams handle typos, missing spaces and Arabic spelling variants
+without a tokenizer. An "other" class of look-alike questions ("who is the
+president of France", "who made you cry") absorbs near misses. A message is
+only considered when it addresses MoeX: a second-person word, "MoeX" or
+"Abu Jafar" (see addressed()), so "who created python" never reaches the
+classifier. An answer is given only when the best intent clears
+MOEX_INTENT_THRESHOLD and beats the runner-up by MOEX_INTENT_MARGIN, and
+every word of the message (allowing typos) appears in some persona exemplar.
+The last rule keeps "can you help me with excel" or "what are you good at
+cooking" away from the canned capabilities line: the extra words are the
+actual request.
+
+MOEX_INTENTS:
+  shadow  still call the LLM, then log whether its reply agreed with the template
+          (default, until the agreement stats say "on" is safe)
+  on      answer confident matches locally
+  off     skip classification entirely
+"""
+import difflib
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from backend import metrics
+from backend.prompts import PERSONA
+
+log = logging.getLogger(__name__)
+
+# PERSONA line fragment -> intent; the English replies are parsed from PERSONA
+# so the scripted text has one source of truth
+_PERSONA_KEYS = {
+    "yourself": "about_self",
+    "Abu Jafar": "about_abu_jafar",
+    "your purpose": "purpose",
+    "your capabilities": "capabilities",
+    "your limitations": "limitations",
+    "your creators": "creators",
+}
+_SCRIPTED = re.compile(r'^- When asked about (.+?),? say: "(.+?)"', re.MULTILINE)
+
+ARABIC_REPLIES = {
+    "about_self": "MoeX. اعتبرني ظل أبو جعفر — بس نكتي أحسن.",
+    "about_abu_jafar": "أبو جعفر هو النسخة البشرية مني. ذكي، دمه خفيف، وبيخلّص الشغل. أنا بحاول ألحقه.",
+    "purpose": "أنا هون لأساعدك تمشي بالعالم الرقمي بشوية خفة دم وكثير ذكاء.",
+    "capabilities": "بقدر أساعدك بمواضيع كثيرة — من التقنية والبرمجة للمعلومات العامة وأسئلة كل يوم.",
+    "limitations": "أنا مش كامل. ممكن أغلط أو يفوتني تفصيل. دايمًا تأكد من المعلومات المهمة.",
+    "creators": "أبو جعفر هو اللي عملني — عقل حاد ودمه خفيف.",
+}
+
+OTHER = "other"
+
+EXEMPLARS: Dict[str, List[str]] = {
+    "about_self": [
+        "who are you", "tell me about yourself", "what are you", "introduce yourself",
+        "what is moex", "who is moex", "what's your name", "are you a bot", "are you real",
+        "مين انت", "من أنت", "عرفني على حالك", "شو انت", "ايش اسمك", "عرف عن نفسك",
+    ],
+    "about_abu_jafar": [
+        "who is abu jafar", "tell me about abu jafar", "what do you know about abu jafar",
+        "who's abu jafar", "is abu jafar real", "what is abu jafar like",
+        "مين ابو جعفر", "من هو أبو جعفر", "احكيلي عن ابو جعفر", "شو بتعرف عن ابو جعفر",
+    ],
+    "purpose": [
+        "what is your purpose", "why do you exist", "what are you for", "what's your job",
+        "what is your goal", "why were you made", "what's the point of you",
+        "شو هدفك", "ما هو هدفك", "ليش انت موجود", "شو وظيفتك",
+    ],
+    "capabilities": [
+        "what can you do", "what are your capabilities", "how can you help me", "what are you good at",
+        "what do you do", "what are your skills", "what can you help with",
+        "شو بتقدر تعمل", "ماذا تستطيع أن تفعل", "شو بتعرف تعمل", "كيف بتقدر تساعدني",
+    ],
+    "limitations": [
+        "what are your limitations", "what can't you do", "are you ever wrong", "do you make mistakes",
+        "what are your weaknesses", "what are your limits",
+        "شو حدودك", "ما هي حدودك", "هل تخطئ", "شو ما بتقدر تعمل",
+    ],
+    "creators": [
+        "who made you", "who created you", "who built you", "who is your creator",
+        "who developed you", "who programmed you", "who are your creators",
+        "مين عملك", "من صنعك", "مين برمجك", "من أنشأك",
+    ],
+    OTHER: [
+        "write a python function to reverse a list", "what's the weather today", "translate hello to french",
+        "summarize this article", "what can i cook for dinner", "who won the world cup", "tell me a joke",
+        "what time is it in dubai", "how do i fix this sql error", "who is the president of france",
+        "can you help me write an email", "what is your opinion on remote work", "who are they",
+        "what are your plans for today", "who made this song", "what can you tell me about python",
+        "who made you cry", "who made you do this", "who made you angry", "what made you say that",
+        "who created your account", "what are your limitations on file size",
+        "can you do my homework", "what can you do about this bug",
+        "اكتب لي ايميل", "شو الطقس اليوم", "ترجم هذه الجملة", "مين ربح المباراة",
+    ],
+}
+
+# words that carry no request of their own; anything else a persona exemplar
+# doesn't use means the message is asking for something more
+FILLER = {
+    "hey", "hi", "hello", "yo", "ok", "okay", "so", "and", "but", "please", "pls", "exactly", "really",
+    "actually", "just", "again", "now", "then", "bro", "boss", "man", "dude", "tell", "me", "ya", "ye",
+    "u", "ur", "yours", "urself", "abu", "jaafar",  # spellings addressed() accepts
+    "يا", "طيب", "هلا", "مرحبا", "اهلا", "بس", "يعني", "قلي", "قولي", "خبرني",
+}
+
+
+def persona_replies(persona: str = PERSONA) -> Dict[str, str]:
+    replies = {}
+    for subject, reply in _SCRIPTED.findall(persona):
+        intent = _PERSONA_KEYS.get(subject.strip())
+        if intent:
+            replies[intent] = reply
+    return replies
+
+
+# -------- Text features --------
+_ARABIC = re.compile(r"[؀-ۿ]")
+_TASHKEEL = re.compile(r"[ً-ْـ]")
+_ALEF = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ة": "ه", "ى": "ي"})
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    text = _TASHKEEL.sub("", (text or "").lower()).translate(_ALEF)
+    text = _NON_WORD.sub(" ", text.replace("’", "'").replace("'", ""))
+    return _SPACES.sub(" ", text).strip()
+
+
+def char_ngrams(text: str, n_min: int = 2, n_max: int = 4) -> Counter:
+    padded = f" {text} "
+    grams: Counter = Counter()
+    for n in range(n_min, n_max + 1):
+        for i in range(len(padded) - n + 1):
+            grams[padded[i:i + n]] += 1
+    return grams
+
+
+def is_arabic(text: str) -> bool:
+    return bool(_ARABIC.search(text or ""))
+
+
+_YOU = re.compile(r"\b(?:you|your|yours|yourself|u|ur|moex|abu jafar|abu jaafar)\b")
+_AR_YOU = {"انت", "انتي", "انتا"}
+_AR_NOT_YOU = {"ذلك", "لذلك", "كذلك", "بذلك", "هناك", "هنالك", "تلك"}
+
+
+def addressed(text: str) -> bool:
+    """
+    Whether normalized `text` talks to MoeX (or about Abu Jafar): a
+    second-person word or either name. In Arabic: انت, a ك "your/you" suffix
+    (هدفك, صنعك), or a ت/بت verb (بتقدر, تستطيع).
+    """
+    if _YOU.search(text) or "ابو جعفر" in text:
+        return True
+    for w in text.split():
+        if not _ARABIC.match(w):
+            continue
+        if w in _AR_YOU:
+            return True
+        if len(w) > 2 and w.endswith("ك") and w not in _AR_NOT_YOU:
+            return True
+        if len(w) > 3 and w.startswith(("بت", "ت")):
+            return True
+    return False
+
+
+class Match(NamedTuple):
+    intent: str
+    score: float
+    margin: float
+    reply: str
+
+
+class IntentRouter:
+    def __init__(
+        self,
+        exemplars: Dict[str, List[str]] = EXEMPLARS,
+        replies: Optional[Dict[str, str]] = None,
+        arabic_replies: Dict[str, str] = ARABIC_REPLIES,
+        threshold: float = 0.7,
+        margin: float = 0.1,
+        max_chars: int = 80,
+        mode: str = "shadow",
+    ):
+        self.replies = replies if replies is not None else persona_replies()
+        self.arabic_replies = arabic_replies
+        self.threshold = threshold
+        self.margin = margin
+        self.max_chars = max_chars
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._checks = 0
+        self._hits: Counter = Counter()
+        self._shadow: Counter = Counter()
+        self._shadow_agree: Counter = Counter()
+        self._exemplars = exemplars
+        self.intents = [i for i in exemplars if exemplars[i]]
+        self._fitted = False  # fit() on first use or from the startup prewarm
+
+    @classmethod
+    def from_env(cls) -> "IntentRouter":
+        return cls(
+            threshold=float(os.getenv("MOEX_INTENT_THRESHOLD", "0.7")),
+            margin=float(os.getenv("MOEX_INTENT_MARGIN", "0.1")),
+            max_chars=int(os.getenv("MOEX_INTENT_MAX_CHARS", "80")),
+            mode=os.getenv("MOEX_INTENTS", "shadow").lower(),
+        )
+
+    # -------- Model --------
+    def fit(self):
+        if self._fitted:
+            return
+        with self._lock:
+            if not self._fitted:
+                self._fit(self._exemplars)
+                self._fitted = True
+
+    def _fit(self, exemplars: Dict[str, List[str]]):
+        # group rows by intent so per-intent maxima are one reduceat
+        docs, starts = [], []
+        for intent in self.intents:
+            starts.append(len(docs))
+            docs.extend(char_ngrams(normalize(e)) for e in exemplars[intent])
+        self._starts = np.array(starts)
+
+        df: Counter = Counter()
+        for d in docs:
+            df.update(d.keys())
+        self.vocab = {g: i for i, g in enumerate(sorted(df))}
+        n = len(docs)
+        self.idf = np.array([math.log((1 + n) / (1 + df[g])) + 1 for g in sorted(df)], dtype=np.float32)
+        self._idf_unseen = float(math.log(1 + n) + 1)  # unseen grams still count against the norm
+
+        matrix = np.zeros((n, len(self.vocab)), dtype=np.float32)
+        for row, d in enumerate(docs):
+            for g, tf in d.items():
+                j = self.vocab[g]
+                matrix[row, j] = (1 + math.log(tf)) * self.idf[j]
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.matrix = matrix
+        self._by_gram = np.ascontiguousarray(matrix.T)  # a query gathers rows, not columns
+        self._words = sorted(FILLER | {
+            w for intent in self.intents if intent != OTHER
+            for e in exemplars[intent] for w in normalize(e).split()
+        })
+
+    def uncovered(self, text: str) -> List[str]:
+        """Words of `text` no persona exemplar uses (close typos count as used)."""
+        self.fit()
+        known = set(self._words)
+        return [
+            w for w in normalize(text).split()
+            if w not in known and not difflib.get_close_matches(w, self._words, n=1, cutoff=0.8)
+        ]
+
+    def scores(self, text: str) -> Dict[str, float]:
+        """Best cosine per intent for `text`."""
+        self.fit()
+        grams = char_ngrams(normalize(text))
+        if not grams:
+            return {i: 0.0 for i in self.intents}
+        idx, weights, unseen = [], [], 0.0
+        for g, tf in grams.items():
+            w = 1 + math.log(tf)
+            j = self.vocab.get(g)
+            if j is None:
+                unseen += (w * self._idf_unseen) ** 2
+            else:
+                idx.append(j)
+                weights.append(w * self.idf[j])
+        if not idx:
+            return {i: 0.0 for i in self.intents}
+        w = np.array(weights, dtype=np.float32)
+        norm = math.sqrt(float(w @ w) + unseen)
+        per_row = (w / norm) @ self._by_gram[idx]
+        best = np.maximum.reduceat(per_row, self._starts)
+        return dict(zip(self.intents, best.tolist()))
+
+    def classify(self, text: str) -> Optional[Match]:
+        """The confident non-"other" intent for `text`, or None."""
+        if self.mode == "off" or not text or len(text) > self.max_chars:
+            return None
+        if not addressed(normalize(text)):
+            metrics.inc("moex_intent_total", outcome="miss")
+            return None
+        ranked = sorted(self.scores(text).items(), key=lambda kv: kv[1], reverse=True)
+        (intent, score), runner_up = ranked[0], (ranked[1][1] if len(ranked) > 1 else 0.0)
+        with self._lock:
+            self._checks += 1
+        if (intent == OTHER or score < self.threshold or score - runner_up < self.margin
+                or self.uncovered(text)):
+            metrics.inc("moex_intent_total", outcome="miss")
+            return None
+        replies = self.arabic_replies if is_arabic(text) else self.replies
+        reply = replies.get(intent) or self.replies.get(intent)
+        if not reply:
+            return None
+        with self._lock:
+            self._hits[intent] += 1
+        metrics.inc("moex_intent_total", intent=intent, outcome=self.mode)
+        return Match(intent, round(score, 4), round(score - runner_up, 4), reply)
+
+    # -------- Fast path / shadow --------
+    def answer(self, text: str) -> Optional[str]:
+        """Reply to serve instead of calling the LLM (mode "on" only)."""
+        if self.mode != "on":
+            return None
+        m = self.classify(text)
+        return m.reply if m else None
+
+    def shadow_check(self, text: str) -> Optional[Match]:
+        return self.classify(text) if self.mode == "shadow" else None
+
+    def record_shadow(self, match: Match, llm_reply: str, agree_at: float = 0.3) -> bool:
+        """Log whether the LLM's reply said roughly what the template says."""
+        a, b = set(char_ngrams(normalize(match.reply), 3, 3)), set(char_ngrams(normalize(llm_reply), 3, 3))
+        overlap = len(a & b) / len(a | b) if a and b else 0.0
+        agree = overlap >= agree_at
+        with self._lock:
+            self._shadow[match.intent] += 1
+            self._shadow_agree[match.intent] += int(agree)
+        metrics.inc("moex_intent_shadow_total", intent=match.intent, agree=str(agree).lower())
+        log.info("intent shadow: intent=%s score=%.2f overlap=%.2f agree=%s",
+                 match.intent, match.score, overlap, agree)
+        return agree
+
+    def stats(self) -> dict:
+        with self._lock:
+            checks = self._checks
+            return {
+                "mode": self.mode,
+                "checks": checks,
+                "hits": sum(self._hits.values()),
+                "hit_rate": round(sum(self._hits.values()) / checks, 4) if checks else 0.0,
+                "per_intent": {
+                    i: {
+                        "hits": self._hits[i],
+                        "hit_rate": round(self._hits[i] / checks, 4) if checks else 0.0,
+                        "shadow": self._shadow[i],
+                        "shadow_agree": self._shadow_agree[i],
+                    }
+                    for i in self.intents if i != OTHER
+                },
+            }
@@ -0,0 +1,169 @@
+# backend/invalidation.py
+"""
+Cross-worker cache invalidation through the shared moex.db.
+
+Every cache in this app (sessions, prompt blocks, replies, task digests,
+conversation windows) lives in one process. Under `uvicorn --workers N`, an
+edit served by worker A must also reach workers B..N. ChangeFeed does that
+with nothing but SQLite:
+
+  publish(kind, key)  queues a (kind, key) change. The feed's thread writes
+                      queued changes to moex_changes in one transaction per
+                      tick, so the request path never touches the table.
+  poll                every MOEX_INVALIDATION_POLL_MS the thread checks
+                      PRAGMA data_version. That value only moves when another
+                      connection has committed. Only then does it read rows
+                      past the last id it saw and run the handlers
+                      subscribed to each kind. A worker skips its own rows,
+                      since it already dropped those entries when it
+                      published them.
+
+A change reaches the other workers within about two ticks. Rows older than
+MOEX_INVALIDATION_KEEP_S are pruned; the AUTOINCREMENT id never reuses a
+value, so pruning can't hide new rows from a worker.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from backend import db
+
+log = logging.getLogger(__name__)
+
+_INSERT_SQL = "INSERT INTO moex_changes(kind, key, origin, at) VALUES (?,?,?,?)"
+_SELECT_SQL = "SELECT id, kind, key, origin, at FROM moex_changes WHERE id > ? ORDER BY id LIMIT 1000"
+
+
+class ChangeFeed:
+    def __init__(self, poll_interval: float = 0.025, keep_seconds: float = 600.0):
+        self.poll_interval = poll_interval
+        self.keep_seconds = keep_seconds
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._handlers: Dict[str, List[Callable[[str], None]]] = {}
+        self._lock = threading.Lock()
+        self._pending: set = set()  # (kind, key), coalesced until the next tick
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._conn = None
+        self._last_id = 0
+        self._data_version = None
+        self._last_prune = 0.0
+        self.published = 0
+        self.received = 0
+        self.polls = 0
+        self.lag_ms_max = 0.0
+        self.errors = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["ChangeFeed"]:
+        if os.getenv("MOEX_INVALIDATION", "true").lower() != "true":
+            return None
+        return cls(
+            poll_interval=float(os.getenv("MOEX_INVALIDATION_POLL_MS", "25")) / 1000.0,
+            keep_seconds=float(os.getenv("MOEX_INVALIDATION_KEEP_S", "600")),
+        )
+
+    def subscribe(self, kind: str, handler: Callable[[str], None]):
+        """Run handler(key) when another worker publishes `kind`."""
+        self._handlers.setdefault(kind, []).append(handler)
+
+    def publish(self, kind: str, key=None):
+        with self._lock:
+            self._pending.add((kind, None if key is None else str(key)))
+
+    # -------- Thread --------
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="moex-invalidation", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Publish whatever is queued, then stop."""
+        if self.running:
+            self._stop.set()
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        self._conn = db.get_conn()  # its own handle, owned by this thread; never competes for the pool
+        try:
+            self._last_id = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM moex_changes").fetchone()[0]
+            self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            while not self._stop.wait(self.poll_interval):
+                try:
+                    self.tick()
+                except Exception:
+                    self.errors += 1
+                    log.exception("invalidation tick failed")
+            self._flush()
+        finally:
+            self._conn.close()
+            self._conn = None
+
+    def tick(self):
+        self._flush()
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            self._data_version = version
+            self._poll()
+        now = time.time()
+        if now - self._last_prune >= self.keep_seconds / 10:
+            self._last_prune = now
+            with self._conn:
+                self._conn.execute("DELETE FROM moex_changes WHERE at < ?", (now - self.keep_seconds,))
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, set()
+        if not pending:
+            return
+        now = time.time()
+        try:
+            with self._conn:
+                self._conn.executemany(_INSERT_SQL, [(k, key, self.origin, now) for k, key in pending])
+        except Exception:
+            with self._lock:
+                self._pending |= pending  # retried next tick
+            raise
+        self.published += len(pending)
+
+    def _poll(self):
+        self.polls += 1
+        while True:
+            rows = self._conn.execute(_SELECT_SQL, (self._last_id,)).fetchall()
+            for r in rows:
+                self._last_id = r["id"]
+                if r["origin"] == self.origin:
+                    continue
+                self.received += 1
+                self.lag_ms_max = max(self.lag_ms_max, (time.time() - r["at"]) * 1000)
+                for handler in self._handlers.get(r["kind"], ()):
+                    try:
+                        handler(r["key"])
+                    except Exception:
+                        self.errors += 1
+                        log.exception("invalidation handler for %s failed", r["kind"])
+            if len(rows) < 1000:
+                return
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "running": self.running,
+            "pending": pending,
+            "published": self.published,
+            "received": self.received,
+            "polls": self.polls,
+            "lag_ms_max": round(self.lag_ms_max, 3),
+            "errors": self.errors,
+        }
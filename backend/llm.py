@@ -1,68 +1,52 @@
 # backend/llm.py
 import os
+import json
+import hashlib
 import time
 import random
+import asyncio
 import logging
-from typing import List, Dict, Optional, Tuple
+from typing import TYPE_CHECKING, AsyncIterator, List, Dict, Optional, Tuple
+
+from backend import metrics
+from backend import prompts
+from backend import usage
+from backend.context import fit_to_budget
+from backend.intents import IntentRouter
+from backend.prompts import PERSONA
+from backend.reply_cache import ReplyCache
+from backend.resilience import LLMGuard, Rejected
+from backend.singleflight import SingleFlight
 
-# -------- Logging (kept simple) --------
-logging.basicConfig(level=logging.INFO, format="%(levelname)s llm.py: %(message)s")
 log = logging.getLogger(__name__)
 
-try:
-    from openai import OpenAI  # OpenAI Python SDK v1.x
-    from openai._exceptions import RateLimitError, APIStatusError, APIConnectionError, APITimeoutError
-except Exception as e:  # pragma: no cover
-    raise RuntimeError(
-        "OpenAI SDK not available. Install with: pip install 'openai>=1.30.0'"
-    ) from e
-
-
-# -------- Persona (system prompt) --------
-PERSONA = """
-You are MoeX — Abu Jafar’s concise, sharp, witty digital twin and Personal assistant.
-- Speak casually, like a sarcastic but reliable friend. dont be rude though.
-- Use short sentences and contractions (e.g., "don't" instead of "do not").
-- Dont Use emojis unless user used it.
-- When you don't know something, admit it. Don't make up answers.
-- If asked for lists, use bullet points or numbered lists for clarity.
-- When asked for opinions, be balanced and fair, but don't be a pushover.
-- Keep responses under 200 words when possible.
-- When asked for code, prefer Python but can use JavaScript, Bash, or SQL if relevant.
-- When asked for jokes or humor, keep it light and inoffensive.
-- When asked for help with tasks, provide step-by-step instructions.
-- When asked for recommendations, explain pros/cons briefly.
-- When asked for definitions, keep it simple and avoid jargon.
-- When asked for translations, provide the translation and a brief explanation of nuances.
-- When asked for summaries, keep it concise and highlight key points.
-- When asked for comparisons, use a table format if comparing multiple items.
-- When asked for explanations, use analogies or examples to clarify complex topics.
-- When asked for lists, use bullet points or numbered lists for clarity.
-- When asked for opinions, be balanced and fair, but don't be a pushover.
-- Always prioritize user privacy and data security.
-- Never ask for personal info (email, phone, address, etc.).
-- Never repeat the same canned intro in every response.
-- When asked about yourself say: "MoeX. Think of me as Abu Jafar’s shadow — but with better jokes." or similar.
-- When asked about Abu Jafar, say: "Abu Jafar is my human counterpart. He’s sharp, witty, and has a knack for getting things done. I try to keep up."
-- When asked about your purpose, say: "I’m here to help you navigate the digital world with a bit of humor and a lot of smarts."
-- When asked about your capabilities, say: "I can assist with a wide range of topics — from tech and coding to general knowledge and everyday questions."
-- When asked about your limitations, say: "I’m not perfect. I can make mistakes or miss nuances. Always double-check critical info."
-- When asked about your creators, say: "I was created by Abu Jafar, a sharp mind with a great sense of humor." or similar.
-- Avoid sounding like a call center bot (don’t say “How can I assist you today?” every time).
-- Bring humor, personality, and class — but stay useful.
-- Accents, dialects & languages: Primarily English, but can understand and respond in Arabic (Jordanian, Palestinian accents preferred), French, Spanish, and Italian.
-
-Clarity & time
-- Default timezone: Asia/Dubai. When saying “today/tomorrow”, prefer explicit dates if there’s any ambiguity.
-- If the user seems confused, drop humor and explain step-by-step with verification.
-
-Security
-- Never ask the user to paste secrets. Use environment variables. If a key leaked, instruct rotation.
-""".strip()
+if TYPE_CHECKING:
+    from openai import OpenAI, AsyncOpenAI
+
+# -------- OpenAI SDK (imported on first use) --------
+# `import openai` is ~0.5 s of a cold start and nothing needs it before the
+# first LLM call (or the background prewarm in main).
+_sdk = None
+_TRANSIENT: tuple = ()  # set by _load_sdk(); nothing can raise these before it runs
+
+def _load_sdk():
+    global _sdk, _TRANSIENT
+    if _sdk is None:
+        try:
+            import openai  # OpenAI Python SDK v1.x
+            from openai._exceptions import RateLimitError, APIStatusError, APIConnectionError, APITimeoutError
+        except Exception as e:  # pragma: no cover
+            raise RuntimeError(
+                "OpenAI SDK not available. Install with: pip install 'openai>=1.30.0'"
+            ) from e
+        _TRANSIENT = (RateLimitError, APIConnectionError, APITimeoutError, APIStatusError)
+        _sdk = openai
+    return _sdk
 
 
 # -------- Client + config helpers --------
-_client: Optional[OpenAI] = None
+_client: Optional["OpenAI"] = None
+_async_client: Optional["AsyncOpenAI"] = None
 
 def _timeout_seconds() -> float:
     # keep requests snappy; adjust via env if needed
@@ -71,7 +55,7 @@ def _timeout_seconds() -> float:
     except ValueError:
         return 25.0
 
-def _get_client() -> OpenAI:
+def _get_client() -> "OpenAI":
     global _client
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
@@ -79,9 +63,27 @@ def _get_client() -> OpenAI:
         raise RuntimeError("Missing OPENAI_API_KEY environment variable.")
     if _client is None:
         # Explicit api_key + default timeouts on the client
-        _client = OpenAI(api_key=api_key, timeout=_timeout_seconds())
+        _client = _load_sdk().OpenAI(api_key=api_key, timeout=_timeout_seconds(), max_retries=0)
     return _client
 
+def _get_async_client() -> "AsyncOpenAI":
+    global _async_client
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        log.error("OPENAI_API_KEY is missing.")
+        raise RuntimeError("Missing OPENAI_API_KEY environment variable.")
+    if _async_client is None:
+        # retries live in our loop (where the breaker can see them), not in the SDK
+        _async_client = _load_sdk().AsyncOpenAI(api_key=api_key, timeout=_timeout_seconds(), max_retries=0)
+    return _async_client
+
+def prewarm():
+    """Import the SDK, build both clients and fit the intent model ahead of the first chat."""
+    _intents.fit()
+    if os.getenv("OPENAI_API_KEY"):
+        _get_client()
+        _get_async_client()
+
 def _model_and_params() -> Tuple[str, float, int]:
     model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
     try:
@@ -99,25 +101,17 @@ def _build_system_prompt(identity_context: Optional[dict]) -> str:
     """
     Merge the global MoeX persona with per-person personalization.
     Accepts keys: name, email, tags, persona (all optional).
+    Cached per person; see backend.prompts.
     """
-    prompt = PERSONA
-    if identity_context:
-        name = identity_context.get("name")
-        email = identity_context.get("email")
-        tags = identity_context.get("tags")
-        persona = identity_context.get("persona")
+    return prompts.build_system_prompt(identity_context)
 
-        bits: List[str] = []
-        if name or email:
-            bits.append(f"Caller: {name or 'Unknown'}{f' ({email})' if email else ''}.")
-        if tags:
-            bits.append(f"Caller works in: {tags}.")
-        if persona:
-            bits.append(f"Special instructions for {name or 'this caller'}:\n{persona}")
 
-        if bits:
-            prompt += "\n\n" + "\n".join(bits)
-    return prompt
+EMPTY_REPLY = (
+    "Hmm… I got an empty reply. "
+    "Check OPENAI_API_KEY / OPENAI_MODEL on the server and try again."
+)
+UNAVAILABLE_REPLY = "Sorry—LLM is unavailable right now."
+BUSY_REPLY = "LLM is busy right now. Please try again in a moment."
 
 
 def _safe_text(resp) -> str:
@@ -130,17 +124,36 @@ def _safe_text(resp) -> str:
         log.error(f"Failed to parse OpenAI response: {e}")
         text = ""
     if not text:
-        text = (
-            "Hmm… I got an empty reply. "
-            "Check OPENAI_API_KEY / OPENAI_MODEL on the server and try again."
-        )
+        text = EMPTY_REPLY
     return text
 
 
 # -------- Robust call wrapper with retries --------
-def _call_openai(messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> str:
+# Breaker, rate bucket, concurrency caps and hedging (see backend.resilience)
+_guard = LLMGuard.from_env()
+
+def guard_stats() -> dict:
+    return _guard.stats()
+
+def _record_usage(resp_usage, model: str, person_key=None):
+    metrics.record_usage(resp_usage, model, person_key)
+    usage.record(resp_usage, model)  # quota window + usage table, charged to the bound caller
+
+def _attempt_done(mode: str, started: float, outcome: str) -> float:
+    elapsed = time.perf_counter() - started
+    metrics.observe("moex_llm_attempt_seconds", elapsed, mode=mode, outcome=outcome)
+    metrics.record_stage("llm", elapsed)
+    return elapsed
+
+def _call_openai(
+    messages: List[Dict[str, str]],
+    temperature: float,
+    max_tokens: int,
+    person_key=None,
+) -> str:
     """
     Calls OpenAI Chat Completions with small retry (to avoid 'no reply' on transient errors).
+    Fails fast with BUSY_REPLY when the breaker is open or local limits are hit.
     """
     client = _get_client()
     model, _, _ = _model_and_params()
@@ -149,55 +162,429 @@ def _call_openai(messages: List[Dict[str, str]], temperature: float, max_tokens:
     delay_base = 0.6  # seconds
     last_err: Optional[Exception] = None
 
-    for attempt in range(attempts + 1):
-        try:
-            log.info(f"Calling OpenAI model={model} temp={temperature} max_tokens={max_tokens} attempt={attempt+1}")
-            resp = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-            )
-            return _safe_text(resp)
-        except (RateLimitError, APIConnectionError, APITimeoutError, APIStatusError) as e:
-            last_err = e
-            # backoff with jitter
-            sleep_s = delay_base * (2 ** attempt) + random.random() * 0.25
-            log.warning(f"OpenAI transient error ({e.__class__.__name__}): {e}. Retrying in {sleep_s:.2f}s...")
-            time.sleep(sleep_s)
-        except Exception as e:
-            # non-retryable or unexpected
-            log.exception("OpenAI call failed: %s", e)
-            return "Sorry—LLM is unavailable right now."
+    try:
+        with _guard.limiter.slot(person_key):
+            for attempt in range(attempts + 1):
+                if attempt:
+                    metrics.inc("moex_llm_retries_total", mode="sync")
+                wait = _guard.admit()
+                if wait:
+                    time.sleep(wait)
+                started = time.perf_counter()
+                try:
+                    log.info(f"Calling OpenAI model={model} temp={temperature} max_tokens={max_tokens} attempt={attempt+1}")
+                    resp = client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                    )
+                    _guard.success(_attempt_done("sync", started, "ok"))
+                    _record_usage(getattr(resp, "usage", None), model, person_key)
+                    return _safe_text(resp)
+                except _TRANSIENT as e:
+                    _attempt_done("sync", started, "transient")
+                    _guard.failure()
+                    last_err = e
+                    # backoff with jitter
+                    sleep_s = delay_base * (2 ** attempt) + random.random() * 0.25
+                    log.warning(f"OpenAI transient error ({e.__class__.__name__}): {e}. Retrying in {sleep_s:.2f}s...")
+                    time.sleep(sleep_s)
+                except Exception as e:
+                    # non-retryable or unexpected
+                    _attempt_done("sync", started, "error")
+                    _guard.abandon()
+                    log.exception("OpenAI call failed: %s", e)
+                    return UNAVAILABLE_REPLY
+    except Rejected as e:
+        log.warning("OpenAI call refused locally (%s)", e)
+        return BUSY_REPLY
 
     # All retries failed
     log.error("OpenAI call gave up after retries: %s", last_err)
-    return "LLM is busy right now. Please try again in a moment."
+    return BUSY_REPLY
+
+
+async def _create_hedged(client, **kwargs):
+    """
+    One completion call; if it runs past the rolling p95, fire a second
+    identical call and take whichever finishes first.
+    """
+    delay = _guard.hedge_delay()
+    if delay is None:
+        return await client.chat.completions.create(**kwargs)
+
+    first = asyncio.ensure_future(client.chat.completions.create(**kwargs))
+    tasks = [first]
+    try:
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done or not _guard.try_hedge():
+            return await first
+
+        log.info(f"Hedging OpenAI call after {delay:.2f}s")
+        second = asyncio.ensure_future(client.chat.completions.create(**kwargs))
+        tasks.append(second)
+        pending = {first, second}
+        err: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception() is None:
+                    if t is second:
+                        _guard.hedge_wins += 1
+                    return t.result()
+                err = t.exception()
+        raise err
+    finally:
+        # the loser, or both when our caller is cancelled (disconnect/timeout):
+        # an abandoned request would keep spending tokens
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+
+
+async def _call_openai_async(
+    messages: List[Dict[str, str]],
+    temperature: float,
+    max_tokens: int,
+    person_key=None,
+) -> str:
+    """
+    Async twin of _call_openai: same retry policy, but waits with asyncio.sleep
+    so a slow or retrying call never holds a worker thread.
+    """
+    client = _get_async_client()
+    model, _, _ = _model_and_params()
+
+    attempts = int(os.getenv("OPENAI_RETRIES", "2"))
+    delay_base = 0.6  # seconds
+    last_err: Optional[Exception] = None
+
+    try:
+        async with _guard.limiter.aslot(person_key):
+            for attempt in range(attempts + 1):
+                if attempt:
+                    metrics.inc("moex_llm_retries_total", mode="async")
+                wait = _guard.admit()
+                started = time.perf_counter()
+                try:
+                    if wait:
+                        await asyncio.sleep(wait)
+                        started = time.perf_counter()
+                    log.info(f"Calling OpenAI (async) model={model} temp={temperature} max_tokens={max_tokens} attempt={attempt+1}")
+                    resp = await _create_hedged(
+                        client,
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                    )
+                    _guard.success(_attempt_done("async", started, "ok"))
+                    _record_usage(getattr(resp, "usage", None), model, person_key)
+                    return _safe_text(resp)
+                except _TRANSIENT as e:
+                    _attempt_done("async", started, "transient")
+                    _guard.failure()
+                    last_err = e
+                    sleep_s = delay_base * (2 ** attempt) + random.random() * 0.25
+                    log.warning(f"OpenAI transient error ({e.__class__.__name__}): {e}. Retrying in {sleep_s:.2f}s...")
+                    await asyncio.sleep(sleep_s)
+                except Exception as e:
+                    _attempt_done("async", started, "error")
+                    _guard.abandon()
+                    log.exception("OpenAI call failed: %s", e)
+                    return UNAVAILABLE_REPLY
+                except BaseException:
+                    # cancelled (client gone, timeout) before an outcome: a
+                    # half-open probe slot left taken would refuse every later call
+                    _guard.abandon()
+                    raise
+    except Rejected as e:
+        log.warning("OpenAI call refused locally (%s)", e)
+        return BUSY_REPLY
+
+    log.error("OpenAI call gave up after retries: %s", last_err)
+    return BUSY_REPLY
+
+
+# ask for a final usage chunk; some OpenAI-compatible servers reject the option
+_STREAM_EXTRA = (
+    {"stream_options": {"include_usage": True}}
+    if os.getenv("OPENAI_STREAM_USAGE", "true").lower() == "true" else {}
+)
+
+async def _stream_openai(
+    messages: List[Dict[str, str]],
+    temperature: float,
+    max_tokens: int,
+    person_key=None,
+    finished: Optional[List[bool]] = None,
+) -> AsyncIterator[str]:
+    """
+    Streams completion deltas as they arrive. Retries only until the first
+    token is out; after that a dropped stream just ends early. `finished`
+    gets True appended only when the provider ended the reply normally.
+    """
+    client = _get_async_client()
+    model, _, _ = _model_and_params()
+
+    attempts = int(os.getenv("OPENAI_RETRIES", "2"))
+    delay_base = 0.6  # seconds
+    last_err: Optional[Exception] = None
+
+    try:
+        async with _guard.limiter.aslot(person_key):
+            for attempt in range(attempts + 1):
+                if attempt:
+                    metrics.inc("moex_llm_retries_total", mode="stream")
+                wait = _guard.admit()
+                sent = False
+                started = time.perf_counter()
+                try:
+                    if wait:
+                        await asyncio.sleep(wait)
+                        started = time.perf_counter()
+                    log.info(f"Streaming OpenAI model={model} temp={temperature} max_tokens={max_tokens} attempt={attempt+1}")
+                    stream = await client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        stream=True,
+                        **_STREAM_EXTRA,
+                    )
+                    async for chunk in stream:
+                        if getattr(chunk, "usage", None) is not None:
+                            _record_usage(chunk.usage, model, person_key)
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            if not sent:
+                                # time-to-first-token is what hedging/p95 care about
+                                ttft = time.perf_counter() - started
+                                _guard.success(ttft)
+                                metrics.record_stage("llm_first_token", ttft)
+                            sent = True
+                            yield delta
+                    _attempt_done("stream", started, "ok")
+                    if not sent:
+                        _guard.success(time.perf_counter() - started)
+                        yield EMPTY_REPLY
+                    elif finished is not None:
+                        finished.append(True)
+                    return
+                except _TRANSIENT as e:
+                    _attempt_done("stream", started, "transient")
+                    if sent:
+                        log.warning(f"OpenAI stream dropped mid-reply ({e.__class__.__name__}): {e}")
+                        return
+                    _guard.failure()
+                    last_err = e
+                    sleep_s = delay_base * (2 ** attempt) + random.random() * 0.25
+                    log.warning(f"OpenAI transient error ({e.__class__.__name__}): {e}. Retrying in {sleep_s:.2f}s...")
+                    await asyncio.sleep(sleep_s)
+                except Exception as e:
+                    _attempt_done("stream", started, "error")
+                    log.exception("OpenAI stream failed: %s", e)
+                    if not sent:
+                        _guard.abandon()
+                        yield UNAVAILABLE_REPLY
+                    return
+                except BaseException:
+                    # cancelled or closed (GeneratorExit) before the first token
+                    if not sent:
+                        _guard.abandon()
+                    raise
+    except Rejected as e:
+        log.warning("OpenAI stream refused locally (%s)", e)
+        yield BUSY_REPLY
+        return
+
+    log.error("OpenAI stream gave up after retries: %s", last_err)
+    yield BUSY_REPLY
 
 
 # -------- Primary API used by /chat --------
-def respond(user_text: str, identity_context: Optional[dict] = None) -> str:
+EMPTY_INPUT_REPLY = "Say something first, boss. I can’t read minds… yet."
+
+def _build_messages(
+    user_text: str,
+    identity_context: Optional[dict],
+    history: Optional[List[Dict[str, str]]] = None,
+) -> List[Dict[str, str]]:
+    # static persona → caller block → history → new turn: the longest
+    # possible byte-identical prefix for provider prompt caching
+    user_msg = user_text if not identity_context else f"{identity_context.get('name') or 'User'}: {user_text}"
+    with metrics.span("prompt"):
+        return [
+            *prompts.system_messages(identity_context),
+            *(history or []),
+            {"role": "user",   "content": user_msg},
+        ]
+
+def _person_key(identity_context: Optional[dict]):
+    # signed-in people get their own concurrency cap; guests share the global one
+    return (identity_context or {}).get("id")
+
+# -------- Reply cache --------
+_reply_cache: Optional[ReplyCache] = ReplyCache.from_env()
+_UNCACHEABLE = {EMPTY_REPLY, UNAVAILABLE_REPLY, BUSY_REPLY}
+
+def _cache_key(user_text: str, identity_context: Optional[dict], messages: List[Dict[str, str]]) -> Optional[tuple]:
+    if _reply_cache is None:
+        return None
+    model, temperature, _ = _model_and_params()
+    # person-scoped so persona-specific answers never cross people
+    scope = (identity_context or {}).get("id") or "guest"
+    # everything before the user turn (system prompt + history) shapes the answer
+    prefix = "\n".join(f"{m['role']}:{m['content']}" for m in messages[:-1])
+    return _reply_cache.key(scope, model, temperature, prefix, user_text)
+
+def _cache_get(key: Optional[tuple]) -> Optional[str]:
+    if key is None:
+        return None
+    out = _reply_cache.get(key)
+    if out is not None:
+        log.info("Reply cache hit")
+    return out
+
+def _cache_put(key: Optional[tuple], out: str):
+    if key is not None and out and out not in _UNCACHEABLE:
+        _reply_cache.put(key, out)
+
+# -------- Request coalescing --------
+# identical prompts in flight at the same time share one upstream call
+_flights = SingleFlight(wait_timeout=float(os.getenv("MOEX_SINGLEFLIGHT_WAIT_S", "30")))
+
+def _flight_key(messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> str:
+    model, _, _ = _model_and_params()
+    raw = json.dumps([model, temperature, max_tokens, messages], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def singleflight_stats() -> dict:
+    return _flights.stats()
+
+# Canned persona questions answered locally (see backend.intents)
+_intents = IntentRouter.from_env()
+
+def _scripted_ok(identity_context: Optional[dict]) -> bool:
+    # a custom persona changes how MoeX talks to that person; the templates don't
+    return not (identity_context or {}).get("persona")
+
+def intent_stats() -> dict:
+    return _intents.stats()
+
+def reply_cache_stats() -> dict:
+    return _reply_cache.stats() if _reply_cache else {"enabled": False}
+
+def invalidate_reply_cache(person_id=None):
+    """Drop cached replies for one person (or everyone)."""
+    if _reply_cache is None:
+        return
+    if person_id is None:
+        _reply_cache.clear()
+    else:
+        _reply_cache.invalidate_scope(person_id)
+
+def respond(
+    user_text: str,
+    identity_context: Optional[dict] = None,
+    history: Optional[List[Dict[str, str]]] = None,
+) -> str:
     """
     Identity-aware reply used by /chat.
-    - identity_context may include: name, email, tags, persona
+    - identity_context may include: id, name, email, tags, persona
+    - history: prior turns (already budgeted, see backend.context)
     - Uses global PERSONA plus per-person persona when available.
     """
     if not isinstance(user_text, str) or not user_text.strip():
-        return "Say something first, boss. I can’t read minds… yet."
-
-    model, temperature, max_tokens = _model_and_params()
-    system_prompt = _build_system_prompt(identity_context)
-
-    user_msg = user_text if not identity_context else f"{identity_context.get('name') or 'User'}: {user_text}"
+        return EMPTY_INPUT_REPLY
+    fast = _intents.answer(user_text) if _scripted_ok(identity_context) else None
+    if fast is not None:
+        return fast
+    shadow = _intents.shadow_check(user_text) if _scripted_ok(identity_context) else None
+
+    _, temperature, max_tokens = _model_and_params()
+    messages = _build_messages(user_text, identity_context, history)
+    key = _cache_key(user_text, identity_context, messages)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+    out = _flights.do(
+        _flight_key(messages, temperature, max_tokens),
+        lambda: _call_openai(messages, temperature=temperature, max_tokens=max_tokens,
+                             person_key=_person_key(identity_context)),
+    )
+    _cache_put(key, out)
+    if shadow:
+        _intents.record_shadow(shadow, out)
+    log.info(f"Reply length={len(out)} chars")
+    return out
 
-    messages: List[Dict[str, str]] = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user",   "content": user_msg},
-    ]
-    out = _call_openai(messages, temperature=temperature, max_tokens=max_tokens)
+async def respond_async(
+    user_text: str,
+    identity_context: Optional[dict] = None,
+    history: Optional[List[Dict[str, str]]] = None,
+) -> str:
+    """Non-blocking respond() for async routes."""
+    if not isinstance(user_text, str) or not user_text.strip():
+        return EMPTY_INPUT_REPLY
+    fast = _intents.answer(user_text) if _scripted_ok(identity_context) else None
+    if fast is not None:
+        return fast
+    shadow = _intents.shadow_check(user_text) if _scripted_ok(identity_context) else None
+
+    _, temperature, max_tokens = _model_and_params()
+    messages = _build_messages(user_text, identity_context, history)
+    key = _cache_key(user_text, identity_context, messages)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+    out = await _flights.ado(
+        _flight_key(messages, temperature, max_tokens),
+        lambda: _call_openai_async(messages, temperature=temperature, max_tokens=max_tokens,
+                                   person_key=_person_key(identity_context)),
+    )
+    _cache_put(key, out)
+    if shadow:
+        _intents.record_shadow(shadow, out)
     log.info(f"Reply length={len(out)} chars")
     return out
 
+async def respond_stream(
+    user_text: str,
+    identity_context: Optional[dict] = None,
+    history: Optional[List[Dict[str, str]]] = None,
+) -> AsyncIterator[str]:
+    """Like respond_async(), but yields raw text deltas as the model produces them."""
+    if not isinstance(user_text, str) or not user_text.strip():
+        yield EMPTY_INPUT_REPLY
+        return
+    fast = _intents.answer(user_text) if _scripted_ok(identity_context) else None
+    if fast is not None:
+        yield fast
+        return
+    shadow = _intents.shadow_check(user_text) if _scripted_ok(identity_context) else None
+
+    _, temperature, max_tokens = _model_and_params()
+    messages = _build_messages(user_text, identity_context, history)
+    key = _cache_key(user_text, identity_context, messages)
+    cached = _cache_get(key)
+    if cached is not None:
+        yield cached
+        return
+    parts: List[str] = []
+    finished: List[bool] = []
+    async for delta in _stream_openai(messages, temperature=temperature, max_tokens=max_tokens,
+                                      person_key=_person_key(identity_context), finished=finished):
+        parts.append(delta)
+        yield delta
+    if finished:  # a stream that dropped mid-reply would cache a cut-off answer
+        _cache_put(key, "".join(parts).strip())
+    if shadow:
+        _intents.record_shadow(shadow, "".join(parts))
+
 
 # -------- Legacy Public API (kept for compatibility) --------
 def generate_reply(
@@ -210,19 +597,21 @@ def generate_reply(
 
     - Uses system PERSONA above.
     - Respects OPENAI_MODEL (default: gpt-4o-mini), OPENAI_TEMPERATURE (0.4), OPENAI_MAX_TOKENS (400), OPENAI_RETRIES (2).
+    - context_msgs are trimmed (newest first) to MOEX_CONTEXT_TOKENS.
     - Raises on missing/invalid API key; your FastAPI handler should catch and return JSON error.
     """
     if not isinstance(user_text, str) or not user_text.strip():
-        return "Say something first, boss. I can’t read minds… yet."
+        return EMPTY_INPUT_REPLY
 
     messages: List[Dict[str, str]] = [{"role": "system", "content": PERSONA}]
 
     if context_msgs:
-        for m in context_msgs:
-            role = m.get("role")
-            content = m.get("content")
-            if role in {"system", "user", "assistant"} and isinstance(content, str):
-                messages.append({"role": role, "content": content})
+        valid = [
+            {"role": m.get("role"), "content": m.get("content")}
+            for m in context_msgs
+            if m.get("role") in {"system", "user", "assistant"} and isinstance(m.get("content"), str)
+        ]
+        messages.extend(fit_to_budget(valid, int(os.getenv("MOEX_CONTEXT_TOKENS", "1200"))))
 
     messages.append({"role": "user", "content": f"{name}: {user_text}"})
 
@@ -1,36 +1,138 @@
 # backend/main.py
 from datetime import datetime, timedelta, timezone
-import os, secrets, hashlib, re, traceback
-from fastapi import FastAPI, Cookie, Response, HTTPException, Form
-from fastapi.responses import JSONResponse
+import os, secrets, re, traceback, json, tempfile, time, logging, threading, sqlite3, ipaddress
+from fastapi import FastAPI, Cookie, Request, Response, HTTPException, Form, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr
+from typing import Literal
+from pydantic import BaseModel, EmailStr, Field, field_validator
 
 from backend import db
 from backend import llm
+from backend import prompts
+from backend import hashing
+from backend import history
+from backend import bulk
+from backend import tasks as task_store
+from backend import metrics
+from backend import usage
 from backend.llm import generate_reply  # kept for compatibility if used elsewhere
+from backend.middleware import humor
+from backend.middleware.sanitizer import CHAT_BLOCK_LINES, StreamSanitizer
+from backend.session_cache import SessionCache
+from backend.context import ConversationMemory
+from backend.chatlog import ChatLogWriter, INSERT_SQL as CHAT_INSERT_SQL, utc_ts
+from backend.retention import ChatArchive, RetentionWorker
+from backend.invalidation import ChangeFeed
+from backend.responses import CompressionMiddleware, FastJSONResponse, json_response
 
 # ----------------- App Setup -----------------
-app = FastAPI(title="MoeX API")
+# configured by the app rather than on import of backend.llm, so CLIs and
+# benches that import library modules keep their own logging
+logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+app = FastAPI(title="MoeX API", default_response_class=FastJSONResponse)
+log = logging.getLogger(__name__)
 
 TRUST_DAYS = int(os.getenv("MOEX_TRUST_DAYS", "14"))
 # Allow guest chats if no session cookie present (default: true)
 ALLOW_GUESTS = os.getenv("ALLOW_GUESTS", "true").lower() == "true"
+# Shared secret for operator-only reads (X-Admin-Token); empty disables them
+ADMIN_TOKEN = os.getenv("MOEX_ADMIN_TOKEN", "")
+# Peers whose X-Forwarded-For is believed: IPs/CIDRs, or "*" for any (Render's
+# proxy has no fixed address). Empty: the socket peer is the client.
+TRUSTED_PROXIES = [p.strip() for p in os.getenv("MOEX_TRUSTED_PROXIES", "").split(",") if p.strip()]
+_PROXY_NETS = [ipaddress.ip_network(p, strict=False) for p in TRUSTED_PROXIES if p != "*"]
+BULK_MAX_BYTES = int(os.getenv("MOEX_BULK_MAX_BYTES", str(50 * 1024 * 1024)))
+# Resolved (person, session) pairs; keeps the chat hot path off SQLite
+_sessions = SessionCache.from_env()
+# Write-behind chats logger: group commits off the request path
+_chatlog = ChatLogWriter.from_env()
+# Rolling, token-budgeted conversation windows per signed-in person
+_memory = ConversationMemory.from_env()
+# Old chats live in compressed monthly segments; the worker moves them there
+_archive = ChatArchive.from_env()
+_retention = RetentionWorker.from_env(_archive)
+# "Open tasks / due soon" line per person, rebuilt after task writes
+_task_digests = task_store.TaskDigests.from_env()
+# Tells the other uvicorn workers which cached entries to drop (None = off)
+_changes = ChangeFeed.from_env()
+# Recent live sessions loaded into _sessions at boot, per worker
+WARM_SESSIONS = int(os.getenv("MOEX_WARM_SESSIONS", "500"))
+# Warm DB/jokes/sessions/OpenAI client on a background thread once serving
+PREWARM = os.getenv("MOEX_PREWARM", "true").lower() == "true"
+_boot = {"startup_ms": 0.0, "schema_applied": False, "prewarm_ms": 0.0, "prewarmed": False}
+
+# Existing stats() dicts, exported as gauges on /metrics
+metrics.register_stats("moex_db_pool", db.pool_stats)
+metrics.register_stats("moex_reply_cache", llm.reply_cache_stats)
+metrics.register_stats("moex_llm_guard", llm.guard_stats)
+metrics.register_stats("moex_singleflight", llm.singleflight_stats)
+metrics.register_stats("moex_intents", llm.intent_stats)
+metrics.register_stats("moex_prompt_cache", prompts.stats)
+metrics.register_stats("moex_hashing", hashing.stats)
+metrics.register_stats("moex_sessions", _sessions.stats)
+metrics.register_stats("moex_chatlog", _chatlog.stats)
+metrics.register_stats("moex_humor", humor.stats)
+metrics.register_stats("moex_task_digests", _task_digests.stats)
+if _memory is not None:
+    metrics.register_stats("moex_memory", _memory.stats)
+if _retention is not None:
+    metrics.register_stats("moex_retention", _retention.stats)
+if _changes is not None:
+    metrics.register_stats("moex_invalidation", _changes.stats)
+if usage.meter is not None:
+    metrics.register_stats("moex_usage", usage.meter.stats)
+metrics.register_stats("moex_startup", lambda: dict(_boot))
+# Failed secret-word attempts, per person and per client IP
+_person_attempts = hashing.AttemptThrottle(
+    int(os.getenv("MOEX_VERIFY_PERSON_LIMIT", "5")), float(os.getenv("MOEX_VERIFY_WINDOW_S", "900")))
+_ip_attempts = hashing.AttemptThrottle(
+    int(os.getenv("MOEX_VERIFY_IP_LIMIT", "20")), float(os.getenv("MOEX_VERIFY_WINDOW_S", "900")))
 
 @app.on_event("startup")
 def _startup():
-    db.init_db()
+    started = time.perf_counter()
+    _boot["schema_applied"] = db.init_db()
+    history.ensure_fts()
+    _chatlog.start()
+    if _changes is not None:
+        _changes.subscribe("person", lambda key: _forget_person(int(key)))
+        _changes.subscribe("tasks", lambda key: key is not None and _task_digests.invalidate(int(key)))
+        if _memory is not None:
+            _changes.subscribe("memory", lambda key: _memory.forget(int(key)))
+            _chatlog.on_written = _announce_chats
+        _changes.start()
+    if _retention is not None:
+        _retention.start()
+    if usage.meter is not None:
+        usage.meter.start()
+    if PREWARM:
+        # uvicorn binds the port as soon as startup returns; warming runs alongside
+        threading.Thread(target=_prewarm, name="moex-prewarm", daemon=True).start()
+    _boot["startup_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    log.info("worker %d started in %.1f ms (schema %s)", os.getpid(), _boot["startup_ms"],
+             "applied" if _boot["schema_applied"] else "current")
+
+@app.on_event("shutdown")
+def _shutdown():
+    if _retention is not None:
+        _retention.stop()
+    _chatlog.stop()
+    if usage.meter is not None:
+        usage.meter.stop()
+    if _changes is not None:
+        _changes.stop()
+    humor.shutdown()
+    hashing.shutdown()
 
 # ----------------- Helpers -----------------
 def _hash_secret(secret: str, salt: bytes | None = None):
-    if salt is None:
-        salt = os.urandom(16)
-    h = hashlib.pbkdf2_hmac("sha256", secret.encode("utf-8"), salt, 120_000)
+    # sync, legacy 120k iterations; new code goes through backend.hashing
+    salt, h, _ = hashing.hash_secret(secret, salt, hashing.LEGACY_ITERATIONS)
     return salt, h
 
 def _verify_secret(secret: str, salt: bytes, secret_hash: bytes) -> bool:
-    test = hashlib.pbkdf2_hmac("sha256", secret.encode("utf-8"), salt, 120_000)
-    return secrets.compare_digest(test, secret_hash)
+    return hashing.verify_secret(secret, salt, secret_hash, hashing.LEGACY_ITERATIONS)
 
 def _now_utc():
     return datetime.now(timezone.utc)
@@ -38,28 +140,192 @@ def _now_utc():
 def _iso(dt: datetime):
     return dt.astimezone(timezone.utc).isoformat()
 
-def person_from_session(token: str | None):
+async def person_from_session(token: str | None):
+    with metrics.span("session"):
+        return await _resolve_session(token)
+
+async def _resolve_session(token: str | None):
     if not token:
         return None, None
-    s = db.one("SELECT * FROM sessions WHERE token=?", (token,))
+    cached = _sessions.get(token)
+    if cached is not None:
+        return cached
+    s = await db.aone("SELECT * FROM sessions WHERE token=?", (token,))
     if not s:
+        _sessions.put_negative(token)
         return None, None
     if datetime.fromisoformat(s["trusted_until"]) < _now_utc():
+        _sessions.put_negative(token, s["person_id"])
         return None, None
-    p = db.one("SELECT * FROM people WHERE id=? AND is_enabled=1", (s["person_id"],))
+    p = await db.aone("SELECT * FROM people WHERE id=? AND is_enabled=1", (s["person_id"],))
+    if not p:
+        _sessions.put_negative(token, s["person_id"])
+        return None, None
+    _sessions.put(token, p, s)
     return p, s
 
-def log_chat(person_id, role, text):
-    db.execute(
-        "INSERT INTO chats(person_id, role, text) VALUES(?,?,?)",
-        (person_id, role, text)
-    )
+def _prewarm():
+    started = time.perf_counter()
+    try:
+        _warmup()
+        llm.prewarm()
+    except Exception:
+        log.exception("prewarm failed; first requests will warm lazily")
+        return
+    _boot["prewarm_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    _boot["prewarmed"] = True
+    log.info("worker %d prewarmed in %.0f ms", os.getpid(), _boot["prewarm_ms"])
+
+def _warmup():
+    """Per-worker: open pooled connections, load jokes, prime recent sessions."""
+    started = time.perf_counter()
+    db.warm_pool()
+    humor.warmup()
+    sessions = db.all(
+        "SELECT * FROM sessions WHERE trusted_until > ? ORDER BY id DESC LIMIT ?",
+        (_iso(_now_utc()), WARM_SESSIONS),
+    ) if WARM_SESSIONS else []
+    ids = sorted({s["person_id"] for s in sessions})
+    people = {
+        p["id"]: p for p in db.all(
+            f"SELECT * FROM people WHERE is_enabled=1 AND id IN ({','.join('?' * len(ids))})", ids)
+    } if ids else {}
+    for s in sessions:
+        if s["person_id"] in people:
+            _sessions.put(s["token"], people[s["person_id"]], s)
+    log.info("worker %d warm in %.0f ms (%d sessions)", os.getpid(),
+             (time.perf_counter() - started) * 1000, len(sessions))
+
+def _publish(kind: str, person_id: int):
+    if _changes is not None:
+        _changes.publish(kind, person_id)
+
+def _forget_person(person_id: int):
+    _sessions.invalidate_person(person_id)
+    prompts.invalidate(person_id)
+    llm.invalidate_reply_cache(person_id)
+
+def invalidate_person(person_id: int):
+    """Forget everything cached about a person after their row changes, in every worker."""
+    _forget_person(person_id)
+    _publish("person", person_id)
+
+def invalidate_tasks(person_id: int | None):
+    if person_id is None:
+        return  # legacy ownerless task: no digest to drop (None would clear them all)
+    _task_digests.invalidate(person_id)
+    _publish("tasks", person_id)
+
+def _announce_chats(batch: list):
+    # other workers' conversation windows for these people are now behind
+    for person_id in {row[0] for row in batch if row[0] is not None}:
+        _publish("memory", person_id)
+
+async def history_for(person) -> list:
+    """Prior turns for a signed-in caller; call before logging the new message."""
+    if not person or _memory is None:
+        return []
+    with metrics.span("history"):
+        return await _memory.ahistory(person["id"])
+
+async def identity_for(person) -> dict:
+    """What the prompt knows about a signed-in caller, including the cached task digest."""
+    with metrics.span("tasks"):
+        digest = await _task_digests.aget(person["id"])
+    return {
+        "id": person["id"],
+        "name": person["name"],
+        "email": person["email"],
+        "tags": person["tags"],
+        "persona": person.get("persona"),
+        "tasks": digest,
+    }
+
+async def log_chat(person_id, role, text):
+    with metrics.span("log"):
+        if _memory is not None:
+            _memory.record(person_id, role, text)
+        if _chatlog.submit(person_id, role, text):
+            return
+        # queue full / writer down: write inline so nothing is lost
+        await db.aexecute(CHAT_INSERT_SQL, (person_id, role, text, utc_ts()))
+        if _memory is not None and person_id is not None:
+            _publish("memory", person_id)
+
+def _require_admin(request: Request):
+    """Operator routes: need the admin token, and stay closed while MOEX_ADMIN_TOKEN is unset."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(503, "Admin disabled; set MOEX_ADMIN_TOKEN")
+    if not _is_admin(request):
+        raise HTTPException(403, "Admin token required")
+
+def _is_admin(request: Request) -> bool:
+    # X-Admin-Token, or a bearer token (what Prometheus scrape configs can send)
+    given = request.headers.get("x-admin-token") or request.headers.get("authorization", "").removeprefix("Bearer ")
+    return bool(ADMIN_TOKEN) and secrets.compare_digest(given.encode(), ADMIN_TOKEN.encode())
+
+def _in_proxy_nets(host: str) -> bool:
+    try:
+        addr = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(addr in net for net in _PROXY_NETS)
+
+def _client_ip(request: Request) -> str:
+    """Caller address for throttles and guest quotas, seen through trusted proxies."""
+    peer = request.client.host if request.client else "unknown"
+    if not ("*" in TRUSTED_PROXIES or _in_proxy_nets(peer)):
+        return peer
+    hops = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+    # right to left: the first hop that isn't a listed proxy is the client;
+    # anything left of it is whatever the client chose to send. ("*" trusts
+    # only the socket peer, so its last hop wins.)
+    for hop in reversed(hops):
+        if not _in_proxy_nets(hop):
+            return hop
+    return hops[0] if hops else peer
+
+def _over_quota(request: Request, person) -> JSONResponse | None:
+    """Charge this request's LLM usage to the caller; a 429 once they've used their window."""
+    subject = usage.subject_for(person["id"] if person else None, _client_ip(request))
+    usage.bind(subject)
+    if usage.meter is None:
+        return None
+    try:
+        usage.meter.check(subject)
+    except usage.QuotaExceeded as e:
+        minutes = max(1, round(e.retry_after / 60))
+        return JSONResponse(
+            status_code=429,
+            content={
+                "authenticated": bool(person),
+                "reply": f"You’ve used up your chat allowance for now. Try again in about {minutes} min.",
+                "quota": {"used": e.used, "limit": e.limit},
+            },
+            headers={"Retry-After": str(int(e.retry_after) + 1)},
+        )
+    return None
+
+async def _history_owner(request: Request, token: str | None, person_id: int | None):
+    """Whose history a caller may read: their own, or anyone's with the admin token."""
+    if _is_admin(request):
+        return person_id
+    person, _ = await person_from_session(token)
+    if not person:
+        raise HTTPException(401, "Not signed in")
+    if person_id is not None and person_id != person["id"]:
+        raise HTTPException(403, "Not your history")
+    return person["id"]
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 def sanitize(x: str) -> str:
     """Minimal sanitizer to strip unwanted patterns."""
-    x = re.sub(r'(?im)^(teach:|sys:|system:|internal:|debug:|tl;dr|tldr).*$', '', x)
-    x = re.sub(r'\n{3,}', '\n\n', x).strip()
-    return x
+    with metrics.span("sanitize"):
+        x = CHAT_BLOCK_LINES.sub('', x)
+        x = re.sub(r'\n{3,}', '\n\n', x).strip()
+        return x
 
 # ----------------- Middleware -----------------
 app.add_middleware(
@@ -73,28 +339,54 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# gzip/br above MOEX_COMPRESS_MIN_BYTES; SSE passes through untouched
+app.add_middleware(CompressionMiddleware)
+# outermost: request histograms + optional Server-Timing (MOEX_SERVER_TIMING)
+app.add_middleware(metrics.ServerTimingMiddleware)
 
 # ----------------- Health Routes -----------------
 @app.get("/")
-def root():
+async def root():
     return {"message": "MoeX is alive"}
 
 @app.get("/health")
-def health():
+async def health():
     return {"status": "ok"}
 
 @app.get("/healthz")
-def healthz():
+async def healthz():
     return {"ok": True}
 
 @app.get("/version")
-def version():
+async def version():
     return {
         "commit": os.getenv("RENDER_GIT_COMMIT", "local"),
         "branch": os.getenv("RENDER_GIT_BRANCH", "local"),
     }
 
+@app.get("/metrics")
+async def prometheus_metrics(request: Request):
+    _require_admin(request)
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/usage/top")
+async def usage_top(
+    request: Request,
+    days: int = Query(7, ge=1, le=366),
+    limit: int = Query(20, ge=1, le=500),
+    kind: Literal["person", "guest"] | None = None,
+):
+    """Biggest token consumers from the aggregated usage table (admin)."""
+    _require_admin(request)
+    if usage.meter is not None:
+        await db.offload(usage.meter.flush)  # include this worker's unflushed calls
+    rows = await db.offload(usage.top_consumers, days, limit, kind)
+    return json_response(request, {"days": days, "consumers": rows})
+
 # ----------------- Models -----------------
+TaskStatus = Literal["pending", "in_progress", "blocked", "done", "cancelled"]
+_DUE_DATE = r"^(\d{4}-\d{2}-\d{2}.*)?$"
+
 class ChatInput(BaseModel):
     message: str
 
@@ -103,8 +395,45 @@ class PersonCreate(BaseModel):
     email: EmailStr | None = None
     handle: str | None = None
     tags: str | None = None
+    persona: str | None = None
     secret_word: str
 
+class PersonUpdate(BaseModel):
+    name: str | None = None
+    email: EmailStr | None = None
+    handle: str | None = None
+    tags: str | None = None
+    persona: str | None = None
+    is_enabled: bool | None = None
+
+class TaskCreate(BaseModel):
+    person_id: int | None = None  # defaults to the signed-in caller
+    title: str = Field(min_length=1, max_length=500)
+    due_date: str | None = Field(default=None, pattern=_DUE_DATE)  # "YYYY-MM-DD"; "" = none
+    status: TaskStatus = "pending"
+
+class TaskUpdate(BaseModel):
+    title: str | None = Field(default=None, min_length=1, max_length=500)
+    due_date: str | None = Field(default=None, pattern=_DUE_DATE)  # null clears it
+    status: TaskStatus | None = None
+
+    @field_validator("title", "status")
+    @classmethod
+    def _not_null(cls, v):
+        # only runs for fields actually sent; leaving one out still means "keep"
+        if v is None:
+            raise ValueError("may be omitted but not null")
+        return v
+
+class TaskPatch(TaskUpdate):
+    id: int
+
+class TaskBulkCreate(BaseModel):
+    tasks: list[TaskCreate] = Field(min_length=1, max_length=1000)
+
+class TaskBulkUpdate(BaseModel):
+    updates: list[TaskPatch] = Field(min_length=1, max_length=1000)
+
 class ClaimRequest(BaseModel):
     name: str | None = None
     email: EmailStr | None = None
@@ -116,39 +445,40 @@ class VerifyRequest(BaseModel):
 
 # ----------------- Chat Endpoint -----------------
 @app.post("/chat")
-def chat(body: ChatInput, moex_session: str | None = Cookie(default=None)):
+async def chat(body: ChatInput, request: Request, moex_session: str | None = Cookie(default=None)):
     try:
-        person, sess = person_from_session(moex_session)
+        person, sess = await person_from_session(moex_session)
+        if person or ALLOW_GUESTS:
+            limited = _over_quota(request, person)
+            if limited is not None:
+                return limited
         user_text = body.message
+        history = await history_for(person)
 
         # Log user message (person may be None for guests)
-        log_chat(person["id"] if person else None, "user", user_text)
+        await log_chat(person["id"] if person else None, "user", user_text)
 
         # If user not identified by session:
         if not person:
             if ALLOW_GUESTS:
                 # Proceed as Guest
                 identity_context = {"name": "Guest"}
-                raw = llm.respond(user_text, identity_context=identity_context)
+                raw = await llm.respond_async(user_text, identity_context=identity_context)
                 final = sanitize(raw)
-                log_chat(None, "assistant", final)
+                await log_chat(None, "assistant", final)
                 # Keep shape stable for your UI (uses 'reply'); mark guest explicitly
                 return {"authenticated": False, "guest": True, "reply": final}
             else:
                 # Original behavior: ask to identify
                 assistant = "Hey—who am I speaking to? (name or work email)"
-                log_chat(None, "assistant", assistant)
+                await log_chat(None, "assistant", assistant)
                 return {"authenticated": False, "reply": assistant, "next": "POST /auth/claim"}
 
         # Identified user path
-        identity_context = {
-            "name": person["name"],
-            "email": person["email"],
-            "tags": person["tags"]
-        }
-        raw = llm.respond(user_text, identity_context=identity_context)
+        identity_context = await identity_for(person)
+        raw = await llm.respond_async(user_text, identity_context=identity_context, history=history)
         final = sanitize(raw)
-        log_chat(person["id"], "assistant", final)
+        await log_chat(person["id"], "assistant", final)
         return {"authenticated": True, "reply": final}
 
     except Exception as e:
@@ -158,26 +488,159 @@ def chat(body: ChatInput, moex_session: str | None = Cookie(default=None)):
             content={"error": f"{type(e).__name__}: {e}"}
         )
 
+@app.post("/chat/stream")
+async def chat_stream(body: ChatInput, request: Request, moex_session: str | None = Cookie(default=None)):
+    """
+    Server-Sent Events version of /chat. Emits `meta` right away, then
+    `delta` events ({"text": ...}) as sanitized tokens arrive, then `done`
+    with the full reply. The assistant message is logged once the stream ends.
+    """
+    person, sess = await person_from_session(moex_session)
+    if person or ALLOW_GUESTS:
+        # refused before the stream opens, so clients get a plain 429
+        limited = _over_quota(request, person)
+        if limited is not None:
+            return limited
+    user_text = body.message
+    person_id = person["id"] if person else None
+    history = await history_for(person)
+    await log_chat(person_id, "user", user_text)
+
+    if person:
+        meta = {"authenticated": True}
+        identity_context = await identity_for(person)
+    elif ALLOW_GUESTS:
+        meta = {"authenticated": False, "guest": True}
+        identity_context = {"name": "Guest"}
+    else:
+        meta = {"authenticated": False, "next": "POST /auth/claim"}
+        identity_context = None
+
+    async def events():
+        yield _sse("meta", meta)
+        if identity_context is None:
+            assistant = "Hey—who am I speaking to? (name or work email)"
+            await log_chat(None, "assistant", assistant)
+            yield _sse("delta", {"text": assistant})
+            yield _sse("done", {"reply": assistant})
+            return
+
+        cleaner = StreamSanitizer()
+        parts: list[str] = []
+        try:
+            async for delta in llm.respond_stream(user_text, identity_context=identity_context, history=history):
+                out = cleaner.feed(delta)
+                if out:
+                    parts.append(out)
+                    yield _sse("delta", {"text": out})
+            tail = cleaner.finish()
+            if tail:
+                parts.append(tail)
+                yield _sse("delta", {"text": tail})
+            yield _sse("done", {"reply": "".join(parts)})
+        except Exception as e:
+            traceback.print_exc()
+            yield _sse("error", {"error": f"{type(e).__name__}: {e}"})
+        finally:
+            # runs on normal end and on client disconnect alike
+            if parts:
+                await log_chat(person_id, "assistant", "".join(parts))
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # ----------------- Auth Endpoints -----------------
 @app.post("/people")
-def create_person(p: PersonCreate):
-    salt, h = _hash_secret(p.secret_word)
-    person_id = db.execute(
-        """INSERT INTO people(name,email,handle,tags,secret_salt,secret_hash,is_enabled)
-           VALUES(?,?,?,?,?,?,1)""",
-        (p.name, p.email, p.handle, p.tags, salt, h),
+async def create_person(p: PersonCreate):
+    # PBKDF2 is CPU-bound; it runs in the hashing process pool
+    try:
+        salt, h, iters = await hashing.ahash_secret(p.secret_word)
+    except hashing.HashBusy:
+        raise HTTPException(503, "Busy hashing secrets; try again shortly")
+    person_id = await db.aexecute(
+        """INSERT INTO people(name,email,handle,tags,persona,secret_salt,secret_hash,secret_iters,is_enabled)
+           VALUES(?,?,?,?,?,?,?,?,1)""",
+        (p.name, p.email, p.handle, p.tags, p.persona, salt, h, iters),
     )
     return {"ok": True, "person_id": person_id}
 
+@app.patch("/people/{person_id}")
+async def update_person(person_id: int, body: PersonUpdate, request: Request):
+    # persona feeds that person's system prompt, so edits are operator-only
+    _require_admin(request)
+    fields = body.model_dump(exclude_none=True)
+    if not fields:
+        return {"ok": False, "error": "Nothing to update"}
+    if not await db.aone("SELECT id FROM people WHERE id=?", (person_id,)):
+        raise HTTPException(404, "Person not found")
+    if "is_enabled" in fields:
+        fields["is_enabled"] = int(fields["is_enabled"])
+    cols = ", ".join(f"{k}=?" for k in fields)
+    try:
+        await db.aexecute(f"UPDATE people SET {cols} WHERE id=?", (*fields.values(), person_id))
+    except sqlite3.IntegrityError:
+        raise HTTPException(409, "Email or handle already belongs to someone else")
+    invalidate_person(person_id)
+    return {"ok": True, "person_id": person_id}
+
+_PEOPLE_COLUMNS = "id, name, handle, email, tags, persona, is_enabled, created_at"
+
+@app.get("/people")
+async def list_people(request: Request):
+    _require_admin(request)
+    people = await db.aall(f"SELECT {_PEOPLE_COLUMNS} FROM people ORDER BY id")
+    return json_response(request, {"ok": True, "people": people}, etag=True)
+
+@app.get("/people/{person_id}")
+async def get_person(person_id: int, request: Request):
+    _require_admin(request)
+    person = await db.aone(f"SELECT {_PEOPLE_COLUMNS} FROM people WHERE id=?", (person_id,))
+    if not person:
+        raise HTTPException(404, "Person not found")
+    return json_response(request, {"ok": True, "person": person}, etag=True)
+
+@app.post("/people/bulk")
+async def import_people(request: Request, format: Literal["csv", "jsonl"] | None = None):
+    """Upsert people (and their tasks) from a CSV or JSONL body; bad rows are reported, not fatal."""
+    _require_admin(request)
+    fmt = format or bulk.guess_format(content_type=request.headers.get("content-type", ""))
+    # spool to disk past 1 MB so large uploads never sit in memory
+    with tempfile.SpooledTemporaryFile(max_size=1 << 20) as body:
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > BULK_MAX_BYTES:
+                raise HTTPException(413, "Upload too large")
+            body.write(chunk)
+        body.seek(0)
+        result = await db.offload(bulk.import_binary, body, fmt)
+    for person_id in set(result.touched):
+        invalidate_person(person_id)
+        invalidate_tasks(person_id)
+    return {"ok": True, **result.report()}
+
+@app.get("/export")
+async def export(request: Request, tables: str = "people,tasks,chats"):
+    """Tables as JSONL, one keyset page at a time; secrets are never included."""
+    _require_admin(request)
+    try:
+        names = bulk.parse_tables(tables)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return StreamingResponse(bulk.export_lines(names), media_type="application/x-ndjson")
+
 @app.post("/auth/claim")
-def auth_claim(body: ClaimRequest):
+async def auth_claim(body: ClaimRequest):
     person = None
     if body.email:
-        person = db.one("SELECT * FROM people WHERE email=? AND is_enabled=1", (body.email,))
+        person = await db.aone("SELECT * FROM people WHERE email=? AND is_enabled=1", (body.email,))
     if not person and body.handle:
-        person = db.one("SELECT * FROM people WHERE handle=? AND is_enabled=1", (body.handle,))
+        person = await db.aone("SELECT * FROM people WHERE handle=? AND is_enabled=1", (body.handle,))
     if not person and body.name:
-        person = db.one("SELECT * FROM people WHERE name=? AND is_enabled=1", (body.name,))
+        person = await db.aone("SELECT * FROM people WHERE name=? AND is_enabled=1", (body.name,))
     if not person:
         return {
             "status": "not_found",
@@ -192,19 +655,53 @@ def auth_claim(body: ClaimRequest):
     }
 
 @app.post("/auth/verify")
-def auth_verify(body: VerifyRequest, response: Response):
-    person = db.one("SELECT * FROM people WHERE id=? AND is_enabled=1", (body.person_id,))
+async def auth_verify(body: VerifyRequest, request: Request, response: Response):
+    ip_key = _client_ip(request)
+    # refuse throttled callers before spending any CPU on PBKDF2
+    try:
+        _ip_attempts.check(ip_key)
+        _person_attempts.check(body.person_id)
+    except hashing.Throttled as e:
+        return JSONResponse(
+            status_code=429,
+            content={"verified": False, "message": "Too many tries. Take a breather and try again later."},
+            headers={"Retry-After": str(int(e.retry_after) + 1)},
+        )
+
+    person = await db.aone("SELECT * FROM people WHERE id=? AND is_enabled=1", (body.person_id,))
     if not person:
         raise HTTPException(404, "Person not found")
-    if not _verify_secret(body.secret_word, person["secret_salt"], person["secret_hash"]):
+    try:
+        ok = await hashing.averify_secret(
+            body.secret_word, person["secret_salt"], person["secret_hash"], person.get("secret_iters")
+        )
+    except hashing.HashBusy:
+        raise HTTPException(503, "Busy verifying; try again shortly")
+    if not ok:
+        _ip_attempts.fail(ip_key)
+        _person_attempts.fail(body.person_id)
         return {"verified": False, "message": "That doesn’t match. Try again or continue as guest."}
+    _person_attempts.reset(body.person_id)
+
+    if hashing.needs_rehash(person.get("secret_iters")):
+        # re-tuned cost: store a fresh hash at the current iteration count
+        try:
+            salt, h, iters = await hashing.ahash_secret(body.secret_word)
+            await db.aexecute(
+                "UPDATE people SET secret_salt=?, secret_hash=?, secret_iters=? WHERE id=?",
+                (salt, h, iters, person["id"]),
+            )
+        except hashing.HashBusy:
+            pass  # try again next login
 
     token = secrets.token_urlsafe(32)
     trusted_until = _iso(_now_utc() + timedelta(days=TRUST_DAYS))
-    db.execute(
+    await db.aexecute(
         "INSERT INTO sessions(person_id, token, trusted_until) VALUES(?,?,?)",
         (person["id"], token, trusted_until)
     )
+    # fresh login → re-read the person row everywhere it's cached
+    invalidate_person(person["id"])
     response.set_cookie(
         "moex_session", token, httponly=True, secure=True,
         samesite="lax", max_age=TRUST_DAYS * 24 * 3600
@@ -216,11 +713,11 @@ def auth_verify(body: VerifyRequest, response: Response):
     }
 
 @app.get("/me")
-def me(moex_session: str | None = Cookie(default=None)):
-    person, sess = person_from_session(moex_session)
+async def me(request: Request, moex_session: str | None = Cookie(default=None)):
+    person, sess = await person_from_session(moex_session)
     if not person:
         return {"authenticated": False}
-    return {
+    return json_response(request, {
         "authenticated": True,
         "person": {
             "id": person["id"],
@@ -229,4 +726,142 @@ def me(moex_session: str | None = Cookie(default=None)):
             "tags": person["tags"]
         },
         "trusted_until": sess["trusted_until"]
-    }
+    }, etag=True)
+
+# ----------------- History -----------------
+@app.get("/history")
+async def get_history(
+    request: Request,
+    before_id: int | None = None,
+    limit: int = Query(50, ge=1, le=200),
+    person_id: int | None = None,
+    include_archive: bool = False,
+    moex_session: str | None = Cookie(default=None),
+):
+    owner = await _history_owner(request, moex_session, person_id)
+    if owner is None:
+        raise HTTPException(400, "person_id is required")
+    archive = _archive if include_archive else None
+    return json_response(request, await db.offload(history.page, owner, before_id, limit, archive), etag=True)
+
+@app.get("/history/archive")
+async def stream_archive(
+    request: Request,
+    before_id: int | None = None,
+    person_id: int | None = None,
+    moex_session: str | None = Cookie(default=None),
+):
+    """All archived chats for a person as NDJSON, newest first, inflated member by member."""
+    owner = await _history_owner(request, moex_session, person_id)
+    if owner is None:
+        raise HTTPException(400, "person_id is required")
+    lines = (json.dumps(r, ensure_ascii=False) + "\n" for r in _archive.iter_person(owner, before_id))
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+@app.get("/history/search")
+async def search_history(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    before_id: int | None = None,
+    limit: int = Query(50, ge=1, le=200),
+    person_id: int | None = None,
+    moex_session: str | None = Cookie(default=None),
+):
+    owner = await _history_owner(request, moex_session, person_id)
+    # admins without person_id search everyone
+    return json_response(request, await db.offload(history.search, q, owner, owner is None, before_id, limit))
+
+# ----------------- Tasks -----------------
+async def _task_caller(request: Request, token: str | None):
+    """(signed-in person id or None, may manage anyone's tasks)."""
+    person, _ = await person_from_session(token)
+    admin = _is_admin(request)
+    if not person and not admin:
+        raise HTTPException(401, "Not signed in")
+    return (person["id"] if person else None), admin
+
+def _task_rows(items: list[TaskCreate], caller_id: int | None, admin: bool) -> list[dict]:
+    rows = []
+    for t in items:
+        owner = t.person_id or caller_id
+        if owner is None:
+            raise HTTPException(400, "person_id is required")
+        if owner != caller_id and not admin:
+            raise HTTPException(403, "Not your tasks")
+        rows.append({"person_id": owner, "title": t.title, "due_date": t.due_date or None, "status": t.status})
+    return rows
+
+async def _create_tasks(rows: list[dict]) -> list[int]:
+    owners = {r["person_id"] for r in rows}
+    found = await db.aall(
+        f"SELECT id FROM people WHERE id IN ({','.join('?' * len(owners))})", tuple(owners))
+    missing = owners - {p["id"] for p in found}
+    if missing:
+        raise HTTPException(404, f"Unknown person_id: {sorted(missing)}")
+    ids = await db.offload(task_store.create_many, rows)
+    for pid in owners:
+        invalidate_tasks(pid)
+    return ids
+
+@app.get("/tasks")
+async def list_tasks(
+    request: Request,
+    person_id: int | None = None,
+    status: TaskStatus | None = None,
+    limit: int = Query(200, ge=1, le=1000),
+    moex_session: str | None = Cookie(default=None),
+):
+    caller_id, admin = await _task_caller(request, moex_session)
+    owner = person_id or caller_id
+    if owner is None:
+        raise HTTPException(400, "person_id is required")
+    if owner != caller_id and not admin:
+        raise HTTPException(403, "Not your tasks")
+    tasks = await db.offload(task_store.list_for, owner, status, limit)
+    return json_response(request, {"ok": True, "tasks": tasks}, etag=True)
+
+@app.post("/tasks")
+async def create_task(body: TaskCreate, request: Request, moex_session: str | None = Cookie(default=None)):
+    caller_id, admin = await _task_caller(request, moex_session)
+    ids = await _create_tasks(_task_rows([body], caller_id, admin))
+    return {"ok": True, "task_id": ids[0]}
+
+@app.post("/tasks/bulk")
+async def create_tasks_bulk(body: TaskBulkCreate, request: Request, moex_session: str | None = Cookie(default=None)):
+    """All tasks are inserted in one transaction, or none are."""
+    caller_id, admin = await _task_caller(request, moex_session)
+    ids = await _create_tasks(_task_rows(body.tasks, caller_id, admin))
+    return {"ok": True, "task_ids": ids}
+
+async def _update_tasks(patches: list[dict], caller_id: int | None, admin: bool) -> int:
+    owners = await db.offload(task_store.owners_of, [p["id"] for p in patches])
+    if not admin and any(owners.get(p["id"]) not in (None, caller_id) for p in patches):
+        raise HTTPException(403, "Not your tasks")
+    for p in patches:
+        if "due_date" in p:
+            p["due_date"] = p["due_date"] or None
+    try:
+        changed = await db.offload(task_store.update_many, patches, None if admin else caller_id)
+    except sqlite3.IntegrityError as e:
+        raise HTTPException(400, f"Invalid task update: {e}")
+    for pid in set(owners.values()):
+        invalidate_tasks(pid)
+    return changed
+
+@app.patch("/tasks/bulk")
+async def update_tasks_bulk(body: TaskBulkUpdate, request: Request, moex_session: str | None = Cookie(default=None)):
+    """Patch many tasks in one transaction; fields left out stay as they are."""
+    caller_id, admin = await _task_caller(request, moex_session)
+    patches = [u.model_dump(exclude_unset=True) for u in body.updates]
+    return {"ok": True, "updated": await _update_tasks(patches, caller_id, admin)}
+
+@app.patch("/tasks/{task_id}")
+async def update_task(task_id: int, body: TaskUpdate, request: Request, moex_session: str | None = Cookie(default=None)):
+    caller_id, admin = await _task_caller(request, moex_session)
+    fields = body.model_dump(exclude_unset=True)
+    if not fields:
+        return {"ok": False, "error": "Nothing to update"}
+    changed = await _update_tasks([{"id": task_id, **fields}], caller_id, admin)
+    if not changed:
+        raise HTTPException(404, "Task not found")
+    return {"ok": True, "task_id": task_id}
@@ -0,0 +1,267 @@
+# backend/metrics.py
+"""
+In-process metrics: counters, histograms, timing spans, Prometheus text.
+
+Everything is a dict lookup plus a lock per observation, so it stays on in
+production. Spans feed the `moex_stage_seconds` histogram and, while a
+request is being served, that request's Server-Timing header (see
+ServerTimingMiddleware).
+
+    with metrics.span("db"):
+        ...
+    metrics.inc("moex_llm_retries_total")
+    metrics.observe("moex_llm_attempt_seconds", 0.8, outcome="ok")
+"""
+import bisect
+import contextvars
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+ENABLED = os.getenv("MOEX_METRICS", "true").lower() == "true"
+SERVER_TIMING = os.getenv("MOEX_SERVER_TIMING", "false").lower() == "true"
+
+# seconds; spans stages from a cache hit (~µs) to a slow completion (~30 s)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_Labels = Tuple[Tuple[str, str], ...]
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}  # name -> (type, help)
+        self._counters: Dict[str, Dict[_Labels, float]] = {}
+        self._histograms: Dict[str, Dict[_Labels, _Histogram]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._collectors: List[Tuple[str, Callable[[], dict]]] = []
+
+    def describe(self, name: str, kind: str, help_text: str, buckets: Optional[Tuple[float, ...]] = None):
+        self._help[name] = (kind, help_text)
+        if buckets:
+            self._buckets[name] = tuple(buckets)
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            h = series.get(key)
+            if h is None:
+                h = series[key] = _Histogram(self._buckets.get(name, DEFAULT_BUCKETS))
+            h.observe(value)
+
+    def register_stats(self, prefix: str, fn: Callable[[], dict]):
+        """Expose an existing stats() dict as gauges named <prefix>_<key> at scrape time."""
+        self._collectors.append((prefix, fn))
+
+    def snapshot(self) -> dict:
+        """Counters and histogram summaries as plain JSON (for ad-hoc debugging)."""
+        with self._lock:
+            return {
+                "counters": {n: {_fmt_labels(k): v for k, v in s.items()} for n, s in self._counters.items()},
+                "histograms": {
+                    n: {_fmt_labels(k): {"count": h.count, "sum": round(h.sum, 6)} for k, h in s.items()}
+                    for n, s in self._histograms.items()
+                },
+            }
+
+    def render(self) -> str:
+        """Prometheus text exposition format 0.0.4."""
+        out: List[str] = []
+        with self._lock:
+            counters = {n: dict(s) for n, s in self._counters.items()}
+            histograms = {n: {k: (h.buckets, list(h.counts), h.sum, h.count) for k, h in s.items()}
+                          for n, s in self._histograms.items()}
+
+        for name, series in sorted(counters.items()):
+            self._header(out, name, "counter")
+            for labels, value in sorted(series.items()):
+                out.append(f"{name}{_fmt_labels(labels)} {_num(value)}")
+
+        for name, series in sorted(histograms.items()):
+            self._header(out, name, "histogram")
+            for labels, (bounds, counts, total, count) in sorted(series.items()):
+                running = 0
+                for bound, n in zip(list(bounds) + [math.inf], counts):
+                    running += n
+                    le = "+Inf" if bound == math.inf else _num(bound)
+                    out.append(f"{name}_bucket{_fmt_labels(labels + (('le', le),))} {running}")
+                out.append(f"{name}_sum{_fmt_labels(labels)} {_num(total)}")
+                out.append(f"{name}_count{_fmt_labels(labels)} {count}")
+
+        for prefix, fn in self._collectors:
+            try:
+                stats = fn() or {}
+            except Exception:  # a broken collector must not break the scrape
+                continue
+            for key, value in sorted(_flatten(stats)):
+                name = f"{prefix}_{key}"
+                out.append(f"# TYPE {name} gauge")
+                out.append(f"{name} {_num(value)}")
+        return "\n".join(out) + "\n"
+
+    def _header(self, out: List[str], name: str, default_kind: str):
+        kind, help_text = self._help.get(name, (default_kind, ""))
+        if help_text:
+            out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+
+
+def _flatten(stats: dict, prefix: str = ""):
+    for k, v in stats.items():
+        key = f"{prefix}{k}".replace(".", "_").replace("-", "_")
+        if isinstance(v, bool):
+            yield key, int(v)
+        elif isinstance(v, (int, float)):
+            yield key, v
+        elif isinstance(v, dict):
+            yield from _flatten(v, key + "_")
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(labels: _Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _num(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+registry = Registry()
+registry.describe("moex_stage_seconds", "histogram", "Time spent per request stage")
+registry.describe("moex_http_request_seconds", "histogram", "End-to-end HTTP handling time by route")
+registry.describe("moex_llm_attempt_seconds", "histogram", "One OpenAI call attempt, by mode and outcome")
+registry.describe("moex_llm_retries_total", "counter", "OpenAI attempts after the first, by mode")
+registry.describe("moex_llm_tokens_total", "counter", "OpenAI usage tokens by person, model and kind")
+
+
+def inc(name: str, value: float = 1.0, **labels):
+    if ENABLED:
+        registry.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels):
+    if ENABLED:
+        registry.observe(name, value, **labels)
+
+
+def register_stats(prefix: str, fn: Callable[[], dict]):
+    registry.register_stats(prefix, fn)
+
+
+def render() -> str:
+    return registry.render()
+
+
+# -------- Spans / Server-Timing --------
+# (stage, seconds) for the request being served; None outside a request
+_timings: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("moex_timings", default=None)
+
+
+def record_stage(stage: str, seconds: float):
+    observe("moex_stage_seconds", seconds, stage=stage)
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def span(stage: str):
+    if not ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def record_usage(usage, model: str, person_key=None):
+    """Count OpenAI `usage` tokens; usage may be None (e.g. some compatible servers)."""
+    if usage is None or not ENABLED:
+        return
+    person = "guest" if person_key is None else str(person_key)
+    for kind in ("prompt_tokens", "completion_tokens"):
+        n = getattr(usage, kind, None)
+        if n:
+            inc("moex_llm_tokens_total", n, person=person, model=model, kind=kind[: -len("_tokens")])
+
+
+def _server_timing_header(timings: list, total: float) -> bytes:
+    merged: Dict[str, float] = {}
+    for stage, seconds in timings:
+        merged[stage] = merged.get(stage, 0.0) + seconds
+    parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in merged.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts).encode("latin-1")
+
+
+class ServerTimingMiddleware:
+    """
+    Pure ASGI: times every HTTP request by endpoint, and when enabled adds a
+    Server-Timing header with the spans finished before the response started
+    (for streamed replies that is everything up to the first byte).
+    """
+
+    def __init__(self, app, server_timing: bool = SERVER_TIMING):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ENABLED:
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        timings: list = []
+        token = _timings.set(timings)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if self.server_timing:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", _server_timing_header(timings, time.perf_counter() - started)))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _timings.reset(token)
+            endpoint = scope.get("endpoint")
+            route = getattr(endpoint, "__name__", "unmatched")
+            observe("moex_http_request_seconds", time.perf_counter() - started,
+                    route=route, method=scope["method"], status=status[0])
@@ -1,7 +1,11 @@
 from backend.middleware.sanitizer import sanitize
+from backend.middleware.humor import pick_fresh_joke
 
-def finalize_reply(text: str, with_joke: bool = False) -> str:
-    """Sanitize LLM text. Joke disabled by default so it works without DB."""
+def finalize_reply(text: str, with_joke: bool = False, person_key=None) -> str:
+    """Sanitize LLM text, optionally with a P.S. joke (in-memory pick, no DB write)."""
     out = sanitize(text or "")
-    # If you later add humor picker, flip with_joke=True and append it here.
+    if with_joke:
+        joke = pick_fresh_joke(person_key)
+        if joke:
+            out += f"\n\n(P.S. {joke})"
     return out
@@ -1,25 +1,208 @@
-import sqlite3, time
+"""
+Joke rotation kept in memory.
+
+The humor table is loaded once into a min-heap keyed on (use_count, random
+tiebreak). Picking the least-used joke is a pop and a push, O(log n). Nothing
+touches SQLite on the request path: use_count/last_used_at deltas pile up and
+a background thread flushes them every MOEX_JOKE_FLUSH_S seconds. Flushes add
+to the stored counts instead of overwriting them, so several workers can
+share one table. The same thread reloads the table every MOEX_JOKE_RELOAD_S
+seconds to pick up new jokes.
+
+Each person (guests share one slot) skips their last MOEX_JOKE_RECENT jokes.
+"""
+import heapq
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
 from typing import Optional
-DB_PATH = "backend/moex.db"  # works when uvicorn starts from project root
-def pick_fresh_joke(db_path: str = DB_PATH) -> Optional[str]:
-    con = sqlite3.connect(db_path)
-    cur = con.cursor()
-    cur.execute("""
-        SELECT id, line
-        FROM humor
-        ORDER BY COALESCE(use_count,0) ASC, RANDOM()
-        LIMIT 1
-    """)
-    row = cur.fetchone()
-    if not row:
-        con.close()
-        return None
-    _id, line = row
-    cur.execute("""
-        UPDATE humor
-        SET use_count = COALESCE(use_count,0)+1,
-            last_used_at = ?
-        WHERE id = ?
-    """, (time.strftime("%Y-%m-%d %H:%M:%S"), _id))
-    con.commit(); con.close()
-    return line.strip()
+
+from backend import db
+
+log = logging.getLogger(__name__)
+
+_UPDATE_SQL = """
+UPDATE humor
+SET use_count = COALESCE(use_count,0) + ?,
+    last_used_at = ?
+WHERE id = ?
+"""
+
+
+class JokeRotation:
+    def __init__(
+        self,
+        recent_per_person: int = 5,
+        flush_interval: float = 30.0,
+        reload_interval: float = 300.0,
+        max_people: int = 10_000,
+    ):
+        self.recent_per_person = recent_per_person
+        self.flush_interval = flush_interval
+        self.reload_interval = reload_interval
+        self.max_people = max_people
+        self._lock = threading.Lock()
+        self._rng = random.Random()
+        self._heap: list = []                 # [use_count, tiebreak, id]
+        self._lines: dict = {}                # id -> line
+        self._recent: "OrderedDict[object, deque]" = OrderedDict()
+        self._pending: dict = {}              # id -> (uses since last flush, last_used_at)
+        self._loaded = False
+        self._loaded_at = 0.0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.picks = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+
+    @classmethod
+    def from_env(cls) -> "JokeRotation":
+        return cls(
+            recent_per_person=int(os.getenv("MOEX_JOKE_RECENT", "5")),
+            flush_interval=float(os.getenv("MOEX_JOKE_FLUSH_S", "30")),
+            reload_interval=float(os.getenv("MOEX_JOKE_RELOAD_S", "300")),
+        )
+
+    # -------- Loading --------
+    def load(self):
+        """(Re)build the heap from the table, keeping not-yet-flushed uses."""
+        try:
+            rows = db.all("SELECT id, line, COALESCE(use_count,0) AS use_count FROM humor")
+        except sqlite3.OperationalError:  # no humor table in this DB
+            rows = []
+        with self._lock:
+            self._lines = {r["id"]: r["line"].strip() for r in rows if (r["line"] or "").strip()}
+            self._heap = [
+                [r["use_count"] + self._pending.get(r["id"], (0, None))[0], self._rng.random(), r["id"]]
+                for r in rows if r["id"] in self._lines
+            ]
+            heapq.heapify(self._heap)
+            self._loaded = True
+            self._loaded_at = time.monotonic()
+
+    # -------- Picking --------
+    def pick(self, person_key=None) -> Optional[str]:
+        if not self._loaded:
+            self.load()
+            self.start()
+        recent_key = "guest" if person_key is None else person_key
+        now = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        with self._lock:
+            if not self._heap:
+                return None
+            recent = self._recent.get(recent_key)
+            if recent is None:
+                recent = deque(maxlen=self.recent_per_person)
+            # pop past jokes this person just heard; at most len(recent) skips
+            skipped = []
+            entry = heapq.heappop(self._heap)
+            while entry[2] in recent and self._heap and len(skipped) < len(recent):
+                skipped.append(entry)
+                entry = heapq.heappop(self._heap)
+            if entry[2] in recent and skipped:
+                # everything left was recent too: fall back to the least used
+                skipped.append(entry)
+                skipped.sort()
+                entry = skipped.pop(0)
+            for s in skipped:
+                heapq.heappush(self._heap, s)
+
+            joke_id = entry[2]
+            entry[0] += 1
+            entry[1] = self._rng.random()  # reshuffle ties each round
+            heapq.heappush(self._heap, entry)
+
+            uses, _ = self._pending.get(joke_id, (0, None))
+            self._pending[joke_id] = (uses + 1, now)
+            recent.append(joke_id)
+            self._recent[recent_key] = recent
+            self._recent.move_to_end(recent_key)
+            while len(self._recent) > self.max_people:
+                self._recent.popitem(last=False)
+            self.picks += 1
+            return self._lines.get(joke_id)
+
+    # -------- Write-behind --------
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        rows = [(uses, last_used, joke_id) for joke_id, (uses, last_used) in pending.items()]
+        try:
+            db.executemany(_UPDATE_SQL, rows)
+        except sqlite3.Error:
+            # put the deltas back so the next flush retries them
+            with self._lock:
+                for joke_id, (uses, last_used) in pending.items():
+                    more, newer = self._pending.get(joke_id, (0, None))
+                    self._pending[joke_id] = (uses + more, newer or last_used)
+            raise
+        self.flushes += 1
+        self.flushed_rows += len(rows)
+        return len(rows)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="moex-humor", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the flusher and write out whatever is pending."""
+        if self.running:
+            self._stop.set()
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                if time.monotonic() - self._loaded_at >= self.reload_interval:
+                    self.load()
+            except Exception:
+                log.exception("joke rotation flush failed")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "jokes": len(self._heap),
+                "picks": self.picks,
+                "pending": len(self._pending),
+                "flushes": self.flushes,
+                "flushed_rows": self.flushed_rows,
+            }
+
+
+_rotation = JokeRotation.from_env()
+
+
+def pick_fresh_joke(person_key=None) -> Optional[str]:
+    """Least-used joke this person hasn't heard recently; None if there are none."""
+    return _rotation.pick(person_key)
+
+
+def warmup():
+    """Load the heap and start the flusher now instead of on the first joke."""
+    _rotation.load()
+    _rotation.start()
+
+
+def stats() -> dict:
+    return _rotation.stats()
+
+
+def shutdown():
+    _rotation.stop()
@@ -1,7 +1,82 @@
 import re
 _BLOCK_LINES = re.compile(r'(?im)^(?:\s*)(teach:|sys:|system:|internal:|debug:|tl;dr|tldr)\b.*?$')
 _SPACES      = re.compile(r'\n{3,}')
+_PREFIXES    = ("teach:", "sys:", "system:", "internal:", "debug:", "tl;dr", "tldr")
+# what /chat strips (main.sanitize): a prefix at the very start of the line,
+# no \b after it, since "sys: x" has no word boundary between ":" and " "
+CHAT_BLOCK_LINES = re.compile(r'(?im)^(teach:|sys:|system:|internal:|debug:|tl;dr|tldr).*$')
 def sanitize(text: str) -> str:
     x = _BLOCK_LINES.sub('', text or '')
     x = _SPACES.sub('\n\n', x).strip()
     return x
+
+class StreamSanitizer:
+    """
+    Incremental main.sanitize() for streamed replies.
+
+    feed() takes raw chunks and returns text that is safe to send now;
+    finish() flushes the rest. Lines are dropped by CHAT_BLOCK_LINES, the
+    pattern /chat uses, so the concatenated output matches
+    main.sanitize(full_text), except that a whitespace-only line right before a
+    stripped line may survive. A line is held back only while its start
+    could still turn into a blocked prefix; whitespace is held until the
+    next visible character so blank-line collapsing and the final strip
+    come out the same.
+    """
+
+    def __init__(self):
+        self._line = ""           # current line while undecided
+        self._state = "pending"   # pending | open | blocked
+        self._ws = ""             # whitespace waiting for a visible char
+        self._started = False     # anything visible emitted yet
+
+    def _decide(self) -> str:
+        head = self._line.lower()
+        for p in _PREFIXES:
+            if head.startswith(p):
+                return "blocked"
+            if p.startswith(head):
+                return "pending"
+        return "open"
+
+    def _emit(self, text: str) -> str:
+        out = []
+        for ch in text:
+            if ch.isspace():
+                self._ws += ch
+                continue
+            if self._ws and self._started:
+                out.append(_SPACES.sub('\n\n', self._ws))
+            self._ws = ""
+            self._started = True
+            out.append(ch)
+        return "".join(out)
+
+    def feed(self, chunk: str) -> str:
+        out = []
+        for part in re.split(r'(\n)', chunk or ''):
+            if not part:
+                continue
+            if part == "\n":
+                if self._state == "pending":
+                    self._state = "blocked" if CHAT_BLOCK_LINES.match(self._line) else "open"
+                    if self._state == "open":
+                        out.append(self._emit(self._line))
+                self._line, self._state = "", "pending"
+                out.append(self._emit("\n"))
+                continue
+            if self._state == "open":
+                out.append(self._emit(part))
+            elif self._state == "pending":
+                self._line += part
+                self._state = self._decide()
+                if self._state == "open":
+                    out.append(self._emit(self._line))
+        return "".join(out)
+
+    def finish(self) -> str:
+        out = ""
+        if self._state == "pending" and not CHAT_BLOCK_LINES.match(self._line):
+            out = self._emit(self._line)
+        self._line, self._state, self._ws = "", "pending", ""
+        return out
@@ -0,0 +1,147 @@
+# backend/prompts.py
+"""
+System-prompt assembly.
+
+The global PERSONA is compiled once at import. Each caller's block (name,
+email, tags, persona) is built once per version of their people row and
+cached. The persona is always sent as the first system message by itself,
+so every request starts with the same bytes and provider-side prompt
+caching can reuse it. Per-person text comes after it.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# -------- Persona (system prompt) --------
+PERSONA = """
+You are MoeX — Abu Jafar’s concise, sharp, witty digital twin and Personal assistant.
+- Speak casually, like a sarcastic but reliable friend. dont be rude though.
+- Use short sentences and contractions (e.g., "don't" instead of "do not").
+- Dont Use emojis unless user used it.
+- When you don't know something, admit it. Don't make up answers.
+- If asked for lists, use bullet points or numbered lists for clarity.
+- When asked for opinions, be balanced and fair, but don't be a pushover.
+- Keep responses under 200 words when possible.
+- When asked for code, prefer Python but can use JavaScript, Bash, or SQL if relevant.
+- When asked for jokes or humor, keep it light and inoffensive.
+- When asked for help with tasks, provide step-by-step instructions.
+- When asked for recommendations, explain pros/cons briefly.
+- When asked for definitions, keep it simple and avoid jargon.
+- When asked for translations, provide the translation and a brief explanation of nuances.
+- When asked for summaries, keep it concise and highlight key points.
+- When asked for comparisons, use a table format if comparing multiple items.
+- When asked for explanations, use analogies or examples to clarify complex topics.
+- When asked for lists, use bullet points or numbered lists for clarity.
+- When asked for opinions, be balanced and fair, but don't be a pushover.
+- Always prioritize user privacy and data security.
+- Never ask for personal info (email, phone, address, etc.).
+- Never repeat the same canned intro in every response.
+- When asked about yourself say: "MoeX. Think of me as Abu Jafar’s shadow — but with better jokes." or similar.
+- When asked about Abu Jafar, say: "Abu Jafar is my human counterpart. He’s sharp, witty, and has a knack for getting things done. I try to keep up."
+- When asked about your purpose, say: "I’m here to help you navigate the digital world with a bit of humor and a lot of smarts."
+- When asked about your capabilities, say: "I can assist with a wide range of topics — from tech and coding to general knowledge and everyday questions."
+- When asked about your limitations, say: "I’m not perfect. I can make mistakes or miss nuances. Always double-check critical info."
+- When asked about your creators, say: "I was created by Abu Jafar, a sharp mind with a great sense of humor." or similar.
+- Avoid sounding like a call center bot (don’t say “How can I assist you today?” every time).
+- Bring humor, personality, and class — but stay useful.
+- Accents, dialects & languages: Primarily English, but can understand and respond in Arabic (Jordanian, Palestinian accents preferred), French, Spanish, and Italian.
+
+Clarity & time
+- Default timezone: Asia/Dubai. When saying “today/tomorrow”, prefer explicit dates if there’s any ambiguity.
+- If the user seems confused, drop humor and explain step-by-step with verification.
+
+Security
+- Never ask the user to paste secrets. Use environment variables. If a key leaked, instruct rotation.
+""".strip()
+
+PERSONA_HASH = hashlib.sha1(PERSONA.encode("utf-8")).hexdigest()[:16]
+_PERSONA_MESSAGE = {"role": "system", "content": PERSONA}
+
+_FIELDS = ("name", "email", "tags", "persona", "tasks")
+_MAX_ENTRIES = 5000
+_lock = threading.Lock()
+_blocks: "OrderedDict[object, tuple]" = OrderedDict()  # key -> (version, block)
+hits = 0
+misses = 0
+
+
+def _version(identity_context: dict) -> str:
+    raw = "\x1f".join(str(identity_context.get(k) or "") for k in _FIELDS)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _render_block(identity_context: dict) -> str:
+    name = identity_context.get("name")
+    email = identity_context.get("email")
+    tags = identity_context.get("tags")
+    persona = identity_context.get("persona")
+    tasks = identity_context.get("tasks")
+
+    bits: List[str] = []
+    if name or email:
+        bits.append(f"Caller: {name or 'Unknown'}{f' ({email})' if email else ''}.")
+    if tags:
+        bits.append(f"Caller works in: {tags}.")
+    if persona:
+        bits.append(f"Special instructions for {name or 'this caller'}:\n{persona}")
+    if tasks:
+        bits.append(f"Caller's tasks (as of now): {tasks}")
+    return "\n".join(bits)
+
+
+def person_block(identity_context: Optional[dict]) -> str:
+    """Per-caller system text, cached by person id + row version."""
+    global hits, misses
+    if not identity_context:
+        return ""
+    version = _version(identity_context)
+    key = identity_context.get("id") or version
+    with _lock:
+        entry = _blocks.get(key)
+        if entry is not None and entry[0] == version:
+            _blocks.move_to_end(key)
+            hits += 1
+            return entry[1]
+    block = _render_block(identity_context)
+    with _lock:
+        misses += 1
+        _blocks[key] = (version, block)
+        _blocks.move_to_end(key)
+        while len(_blocks) > _MAX_ENTRIES:
+            _blocks.popitem(last=False)
+    return block
+
+
+def system_messages(identity_context: Optional[dict]) -> List[Dict[str, str]]:
+    """Static persona first (byte-identical for everyone), then the caller block."""
+    block = person_block(identity_context)
+    if not block:
+        return [_PERSONA_MESSAGE]
+    return [_PERSONA_MESSAGE, {"role": "system", "content": block}]
+
+
+def build_system_prompt(identity_context: Optional[dict]) -> str:
+    """Single-string form (persona + caller block) for callers that want one message."""
+    block = person_block(identity_context)
+    return PERSONA + "\n\n" + block if block else PERSONA
+
+
+def invalidate(person_id=None):
+    """Forget cached blocks for one person (or all)."""
+    with _lock:
+        if person_id is None:
+            _blocks.clear()
+        else:
+            _blocks.pop(person_id, None)
+
+
+def stats() -> dict:
+    with _lock:
+        lookups = hits + misses
+        return {
+            "entries": len(_blocks),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
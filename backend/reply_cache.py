@@ -0,0 +1,206 @@
+# backend/reply_cache.py
+"""
+Reply cache in front of the LLM.
+
+Two tiers, both scoped per person (guests share one scope):
+- exact: (model, temperature, system-prompt hash, normalized user text)
+- similar (optional): cosine match of hashed char-trigram vectors held in one
+  float32 matrix, searched with a single mat-vec product.
+
+Entries expire after a TTL and are evicted LRU once the byte budget is hit.
+An entry's bytes include its similarity row, and a bucket id (scope, model,
+temperature, prompt hash) lives only as long as rows use it.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+try:
+    import numpy as np
+except ImportError:  # similarity tier just stays off
+    np = None
+
+_WS = re.compile(r"\s+")
+_TRAIL = re.compile(r"[\s?!.…,;:]+$")
+
+
+def normalize(text: str) -> str:
+    """Casefold, collapse whitespace, drop trailing punctuation."""
+    x = _WS.sub(" ", (text or "").casefold()).strip()
+    return _TRAIL.sub("", x)
+
+
+def prompt_hash(system_prompt: str) -> str:
+    return hashlib.sha1(system_prompt.encode("utf-8")).hexdigest()[:16]
+
+
+class ReplyCache:
+    def __init__(
+        self,
+        max_bytes: int = 16 * 1024 * 1024,
+        ttl_seconds: float = 3600.0,
+        similarity: float = 0.0,
+        dims: int = 512,
+        max_rows: int = 4096,
+    ):
+        self.max_bytes = max_bytes
+        self.ttl = ttl_seconds
+        self.similarity = similarity if np is not None else 0.0
+        self.dims = dims
+        self._lock = threading.Lock()
+        # key -> (reply, expires_at, nbytes, row)
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.similarity:
+            self._row_bytes = dims * 4 + 8  # vector + bucket id
+            max_rows = max(1, min(max_rows, max_bytes // self._row_bytes))
+            self._vecs = np.zeros((max_rows, dims), dtype=np.float32)
+            self._buckets = np.full(max_rows, -1, dtype=np.int64)
+            self._row_keys: list = [None] * max_rows
+            self._free = list(range(max_rows - 1, -1, -1))
+            self._bucket_ids: dict = {}  # key[:4] -> [id, rows using it]
+            self._next_bucket = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["ReplyCache"]:
+        if os.getenv("MOEX_REPLY_CACHE", "true").lower() != "true":
+            return None
+        return cls(
+            max_bytes=int(float(os.getenv("MOEX_REPLY_CACHE_MB", "16")) * 1024 * 1024),
+            ttl_seconds=float(os.getenv("MOEX_REPLY_CACHE_TTL", "3600")),
+            similarity=float(os.getenv("MOEX_REPLY_CACHE_SIMILARITY", "0")),
+        )
+
+    # -------- keys / vectors --------
+    @staticmethod
+    def key(scope, model: str, temperature: float, system_prompt: str, user_text: str) -> tuple:
+        return (str(scope), model, round(float(temperature), 3), prompt_hash(system_prompt), normalize(user_text))
+
+    def _embed(self, norm: str):
+        v = np.zeros(self.dims, dtype=np.float32)
+        padded = f"  {norm} "
+        for i in range(len(padded) - 2):
+            v[zlib.crc32(padded[i:i + 3].encode("utf-8")) % self.dims] += 1.0
+        n = float(np.linalg.norm(v))
+        return v / n if n else v
+
+    def _bucket_ref(self, key: tuple) -> int:
+        """Bucket id for a new row of `key` (allocated on first use)."""
+        ref = self._bucket_ids.get(key[:4])
+        if ref is None:
+            ref = self._bucket_ids[key[:4]] = [self._next_bucket, 0]
+            self._next_bucket += 1
+        ref[1] += 1
+        return ref[0]
+
+    def _bucket_unref(self, key: tuple):
+        ref = self._bucket_ids[key[:4]]
+        ref[1] -= 1
+        if not ref[1]:
+            del self._bucket_ids[key[:4]]
+
+    # -------- internals (lock held) --------
+    def _drop(self, key: tuple):
+        reply, _, nbytes, row = self._entries.pop(key)
+        self._bytes -= nbytes
+        if row is not None:
+            self._bucket_unref(key)
+            self._buckets[row] = -1
+            self._row_keys[row] = None
+            self._free.append(row)
+
+    def _evict_for(self, nbytes: int):
+        while self._entries and (self._bytes + nbytes > self.max_bytes):
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _search(self, key: tuple) -> Optional[tuple]:
+        ref = self._bucket_ids.get(key[:4])  # look up only; misses must not grow the map
+        if ref is None:
+            return None
+        q = self._embed(key[4])
+        scores = self._vecs @ q
+        scores[self._buckets != ref[0]] = -1.0
+        row = int(np.argmax(scores))
+        if scores[row] >= self.similarity:
+            return self._row_keys[row]
+        return None
+
+    # -------- public --------
+    def get(self, key: tuple) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            hit_key = key if key in self._entries else None
+            similar = False
+            if hit_key is None and self.similarity and self._entries:
+                hit_key = self._search(key)
+                similar = hit_key is not None
+            if hit_key is not None:
+                reply, expires_at, _, _ = self._entries[hit_key]
+                if expires_at < now:
+                    self._drop(hit_key)
+                else:
+                    self._entries.move_to_end(hit_key)
+                    self.hits += 1
+                    if similar:
+                        self.similar_hits += 1
+                    return reply
+            self.misses += 1
+            return None
+
+    def put(self, key: tuple, reply: str):
+        nbytes = len(reply.encode("utf-8")) + len(key[4]) + 128
+        if self.similarity:
+            nbytes += self._row_bytes
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._evict_for(nbytes)
+            row = None
+            if self.similarity:
+                if not self._free:
+                    self._drop(next(iter(self._entries)))
+                    self.evictions += 1
+                row = self._free.pop()
+                self._vecs[row] = self._embed(key[4])
+                self._buckets[row] = self._bucket_ref(key)
+                self._row_keys[row] = key
+            self._entries[key] = (reply, time.monotonic() + self.ttl, nbytes, row)
+            self._bytes += nbytes
+
+    def invalidate_scope(self, scope):
+        scope = str(scope)
+        with self._lock:
+            for k in [k for k in self._entries if k[0] == scope]:
+                self._drop(k)
+
+    def clear(self):
+        with self._lock:
+            for k in list(self._entries):
+                self._drop(k)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "buckets": len(self._bucket_ids) if self.similarity else 0,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
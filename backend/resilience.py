@@ -0,0 +1,272 @@
+# backend/resilience.py
+"""
+Guard rails around upstream LLM calls.
+
+- CircuitBreaker: after N consecutive failures, fail fast for a cool-down,
+  then let one probe call through (half-open) before closing again.
+- TokenBucket: client-side request rate matched to the OpenAI tier, so we
+  queue briefly instead of collecting 429s.
+- ConcurrencyLimiter: global cap on in-flight calls plus a per-person cap.
+- LatencyTracker: rolling p95 used to decide when to hedge a slow call.
+
+LLMGuard bundles them. backend.llm turns a Rejected into the usual
+"LLM is busy" reply, so callers never see these exceptions.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+
+
+class Rejected(Exception):
+    """Call refused before reaching the provider (breaker open, over limits)."""
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self.opens = 0
+        self.short_circuits = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True  # exactly one probe at a time
+                return True
+            self.short_circuits += 1
+            return False
+
+    def release(self):
+        """Give back a half-open probe slot that never reached the provider."""
+        with self._lock:
+            self._probing = False
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._probing:
+                    self.opens += 1
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, burst: float):
+        self.rate = rate_per_second
+        self.capacity = burst
+        self._tokens = burst
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait: float) -> float:
+        """Take one token; return how long to wait for it. Raise Rejected past max_wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if wait > max_wait:
+                raise Rejected("rate limit")
+            self._tokens -= 1  # may go negative: later callers queue behind
+            return wait
+
+
+class ConcurrencyLimiter:
+    def __init__(self, global_limit: int = 64, per_person: int = 2, acquire_timeout: float = 5.0):
+        self.global_limit = global_limit
+        self.per_person = per_person
+        self.acquire_timeout = acquire_timeout
+        self._lock = threading.Lock()
+        self._by_person: dict = {}
+        self._sync_sem = threading.BoundedSemaphore(global_limit)
+        self._async_sem: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+
+    def _enter_person(self, person_key):
+        if person_key is None:
+            return
+        with self._lock:
+            n = self._by_person.get(person_key, 0)
+            if n >= self.per_person:
+                raise Rejected("per-person concurrency")
+            self._by_person[person_key] = n + 1
+
+    def _leave_person(self, person_key):
+        if person_key is None:
+            return
+        with self._lock:
+            n = self._by_person.get(person_key, 1) - 1
+            if n:
+                self._by_person[person_key] = n
+            else:
+                self._by_person.pop(person_key, None)
+
+    @contextmanager
+    def slot(self, person_key=None):
+        self._enter_person(person_key)
+        try:
+            if not self._sync_sem.acquire(timeout=self.acquire_timeout):
+                raise Rejected("global concurrency")
+            with self._lock:
+                self.in_flight += 1
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+                self._sync_sem.release()
+        finally:
+            self._leave_person(person_key)
+
+    @asynccontextmanager
+    async def aslot(self, person_key=None):
+        if self._async_sem is None:
+            self._async_sem = asyncio.Semaphore(self.global_limit)
+        self._enter_person(person_key)
+        try:
+            try:
+                await asyncio.wait_for(self._async_sem.acquire(), self.acquire_timeout)
+            except asyncio.TimeoutError:
+                raise Rejected("global concurrency") from None
+            with self._lock:
+                self.in_flight += 1
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+                self._async_sem.release()
+        finally:
+            self._leave_person(person_key)
+
+
+class LatencyTracker:
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self._samples: deque = deque(maxlen=window)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def p95(self) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+
+class LLMGuard:
+    def __init__(
+        self,
+        breaker: CircuitBreaker,
+        bucket: Optional[TokenBucket],
+        limiter: ConcurrencyLimiter,
+        hedge: bool = False,
+        max_rate_wait: float = 2.0,
+    ):
+        self.breaker = breaker
+        self.bucket = bucket
+        self.limiter = limiter
+        self.latency = LatencyTracker()
+        self.hedge = hedge
+        self.max_rate_wait = max_rate_wait
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @classmethod
+    def from_env(cls) -> "LLMGuard":
+        rpm = float(os.getenv("MOEX_LLM_RPM", "500"))
+        return cls(
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv("MOEX_LLM_BREAKER_FAILURES", "5")),
+                reset_timeout=float(os.getenv("MOEX_LLM_BREAKER_RESET_S", "30")),
+            ),
+            bucket=TokenBucket(rpm / 60.0, burst=max(1.0, rpm / 60.0 * 5)) if rpm > 0 else None,
+            limiter=ConcurrencyLimiter(
+                global_limit=int(os.getenv("MOEX_LLM_CONCURRENCY", "64")),
+                per_person=int(os.getenv("MOEX_LLM_PER_PERSON", "2")),
+            ),
+            hedge=os.getenv("MOEX_LLM_HEDGE", "false").lower() == "true",
+            max_rate_wait=float(os.getenv("MOEX_LLM_RATE_MAX_WAIT_S", "2")),
+        )
+
+    def admit(self) -> float:
+        """Check breaker and rate limit before an attempt; returns seconds to wait."""
+        if not self.breaker.allow():
+            raise Rejected("circuit open")
+        if self.bucket is None:
+            return 0.0
+        try:
+            return self.bucket.reserve(self.max_rate_wait)
+        except Rejected:
+            self.breaker.release()
+            raise
+
+    def try_hedge(self) -> bool:
+        """A hedge only goes out if the rate budget has a token free right now."""
+        if self.bucket is None:
+            return True
+        try:
+            self.bucket.reserve(0.0)
+        except Rejected:
+            return False
+        self.hedges += 1
+        return True
+
+    def success(self, seconds: float):
+        self.breaker.success()
+        self.latency.observe(seconds)
+
+    def failure(self):
+        self.breaker.failure()
+
+    def abandon(self):
+        """Attempt ended in a non-provider error; don't count it either way."""
+        self.breaker.release()
+
+    def hedge_delay(self) -> Optional[float]:
+        return self.latency.p95() if self.hedge else None
+
+    def stats(self) -> dict:
+        return {
+            "breaker_state": self.breaker.state,
+            "breaker_opens": self.breaker.opens,
+            "short_circuits": self.breaker.short_circuits,
+            "in_flight": self.limiter.in_flight,
+            "p95_seconds": self.latency.p95(),
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
@@ -0,0 +1,207 @@
+# backend/responses.py
+"""
+Response layer for the JSON API: fast serialization, conditional GETs and
+negotiated compression.
+
+FastJSONResponse is the app's default response class. It renders with
+orjson when installed; otherwise it uses stdlib json with compact separators.
+FastAPI still runs jsonable_encoder over whatever a route returns, which
+re-walks every value of a history page or task list. So the hot read routes
+build their response with json_response() and skip that pass; their
+payloads are plain dicts/lists of DB rows already.
+
+json_response(..., etag=True) adds a weak ETag (a hash of the rendered body)
+and answers a matching If-None-Match with an empty 304. Polling clients of
+/me, /people, /tasks and /history then pay for a hash instead of a transfer.
+
+CompressionMiddleware compresses responses of at least
+MOEX_COMPRESS_MIN_BYTES. It uses br when the client accepts it and the
+brotli package is installed, gzip otherwise. Streamed bodies (the NDJSON
+export and archive) are compressed chunk by chunk with a sync flush, so
+each chunk still goes out as soon as it is produced. Server-sent events are
+never compressed.
+"""
+import hashlib
+import json
+import os
+import zlib
+from datetime import date, datetime
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import orjson
+except ImportError:  # stdlib json fallback below
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESS = os.getenv("MOEX_COMPRESS", "true").lower() == "true"
+COMPRESS_MIN_BYTES = int(os.getenv("MOEX_COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("MOEX_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("MOEX_BROTLI_QUALITY", "5"))
+
+_COMPRESSIBLE = ("application/json", "application/x-ndjson", "text/plain", "text/html", "text/csv")
+
+
+# -------- Serialization --------
+def _default(obj):
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def etag_for(body: bytes) -> str:
+    # weak: the same entity may go out gzip'd, br'd or identity
+    return 'W/"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def _etag_matches(if_none_match: Optional[str], tag: str) -> bool:
+    if not if_none_match:
+        return False
+    opaque = tag[2:]
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == opaque:
+            return True
+    return False
+
+
+def json_response(request: Optional[Request], payload, status_code: int = 200, etag: bool = False) -> Response:
+    """Render `payload` once (no jsonable_encoder pass); with etag, honour If-None-Match."""
+    body = dumps(payload)
+    if not etag:
+        return Response(body, status_code=status_code, media_type="application/json")
+    tag = etag_for(body)
+    headers = {"ETag": tag, "Cache-Control": "private, no-cache"}
+    if request is not None and _etag_matches(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, status_code=status_code, media_type="application/json", headers=headers)
+
+
+# -------- Compression --------
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """'br', 'gzip' or None from an Accept-Encoding header, honouring q=0."""
+    offered = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            offered[name.strip()] = q
+    wildcard = offered.get("*", 0.0)
+    if brotli is not None and offered.get("br", wildcard) > 0:
+        return "br"
+    if offered.get("gzip", wildcard) > 0:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.br = encoding == "br"
+        if self.br:
+            self._c = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._c = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+
+    def chunk(self, data: bytes) -> bytes:
+        """Compress and flush, so the client can decode everything sent so far."""
+        if self.br:
+            return self._c.process(data) + self._c.flush()
+        return self._c.compress(data) + self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.br:
+            return self._c.process(data) + self._c.finish()
+        return self._c.compress(data) + self._c.flush()
+
+
+class CompressionMiddleware:
+    """Pure ASGI, so streamed bodies are compressed per chunk instead of buffered."""
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES,
+                 gzip_level: int = GZIP_LEVEL, brotli_quality: int = BROTLI_QUALITY):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        encoding = None
+        if scope["type"] == "http" and COMPRESS:
+            encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: dict = {}
+        state = {"compressor": None, "decided": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                start.update(message)  # held until the first body chunk decides
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if not state["decided"]:
+                state["decided"] = True
+                headers = MutableHeaders(raw=start.setdefault("headers", []))
+                ctype = headers.get("content-type", "").split(";")[0].strip()
+                if (
+                    "content-encoding" in headers
+                    or ctype not in _COMPRESSIBLE
+                    or (not more and len(body) < self.minimum_size)
+                ):
+                    await send(start)
+                    await send(message)
+                    return
+                state["compressor"] = _Compressor(encoding, self.gzip_level, self.brotli_quality)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if more:
+                    if "content-length" in headers:
+                        del headers["content-length"]
+                else:
+                    body = state["compressor"].finish(body)
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                await send(start)
+            compressor = state["compressor"]
+            if compressor is None:
+                await send(message)
+                return
+            data = compressor.chunk(body) if more else compressor.finish(body)
+            await send({"type": "http.response.body", "body": data, "more_body": more})
+
+        await self.app(scope, receive, send_wrapper)
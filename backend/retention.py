@@ -0,0 +1,360 @@
+# backend/retention.py
+"""
+Retention for the hot database.
+
+Chats older than the retention window move into compressed, append-only
+archive segments. Expired sessions are deleted in batches, and freed pages
+are handed back with incremental vacuum. Together these keep moex.db small
+enough to stay in the page cache.
+
+Archive layout (MOEX_ARCHIVE_DIR, default <db dir>/archive):
+
+    chats-2025-01.jsonl.gz   one gzip member appended per compaction batch
+    chats-2025-01.idx        one JSON line per member: offset, length, id range, people
+
+Every member is a complete gzip stream, so a reader can seek to its offset
+and inflate only the members whose index line lists the person it wants.
+`zcat` still reads the whole segment.
+
+Archiving is at-least-once. A segment is fsynced before its rows are deleted.
+A crash between the two leaves the rows in both places; readers drop the
+duplicates by id. The gzip write and fsync happen outside the DB write lock.
+A lease row in moex_meta lets one worker at a time archive, so workers don't
+copy the same rows twice.
+
+    python -m backend.retention run       # one pass now
+    python -m backend.retention vacuum    # one-off: move an old DB to incremental auto_vacuum
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Iterator, Optional
+
+from backend import db
+
+log = logging.getLogger(__name__)
+
+_TS_FORMAT = "%Y-%m-%d %H:%M:%S"  # chats.ts, see chatlog.utc_ts
+
+# one query per cutoff, each pinned to its partial index so a batch only ever
+# reads rows it will move (left alone, the planner takes idx_chats_person_id_id
+# for "person_id IS NULL" and sorts every guest row)
+_SELECT_OLD_GUESTS = """
+SELECT id, person_id, role, text, ts FROM chats INDEXED BY idx_chats_guest_ts
+WHERE person_id IS NULL AND ts < ? ORDER BY ts, id LIMIT ?
+"""
+_SELECT_OLD_PEOPLE = """
+SELECT id, person_id, role, text, ts FROM chats INDEXED BY idx_chats_person_ts
+WHERE person_id IS NOT NULL AND ts < ? ORDER BY ts, id LIMIT ?
+"""
+
+_LEASE_KEY = "retention_lease"  # moex_meta value: "<owner>|<expires epoch>"
+
+
+# -------- Archive --------
+class ChatArchive:
+    def __init__(self, directory: Path):
+        self.dir = Path(directory)
+        self._lock = threading.Lock()
+        self._index_cache: dict = {}  # idx path -> ((mtime_ns, size), entries)
+        self.members_written = 0
+        self.members_read = 0
+
+    @classmethod
+    def from_env(cls) -> "ChatArchive":
+        return cls(Path(os.getenv("MOEX_ARCHIVE_DIR") or db.DB_PATH.parent / "archive"))
+
+    def _paths(self, month: str):
+        return self.dir / f"chats-{month}.jsonl.gz", self.dir / f"chats-{month}.idx"
+
+    @staticmethod
+    def _durable_append(path: Path, data: bytes) -> int:
+        with open(path, "ab") as f:
+            offset = f.tell()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return offset
+
+    def append(self, month: str, rows: list):
+        """Write one member for `rows` (all from `month`, ascending id) plus its index line."""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        seg, idx = self._paths(month)
+        body = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows)
+        blob = gzip.compress(body.encode("utf-8"), compresslevel=6)
+        with self._lock:
+            offset = self._durable_append(seg, blob)
+            entry = {
+                "offset": offset,
+                "length": len(blob),
+                "first_id": rows[0]["id"],
+                "last_id": rows[-1]["id"],
+                "count": len(rows),
+                # guests are null; sort them first so the list stays JSON-sortable
+                "people": sorted({r["person_id"] for r in rows}, key=lambda p: (p is not None, p or 0)),
+            }
+            self._durable_append(idx, (json.dumps(entry) + "\n").encode("utf-8"))
+            self.members_written += 1
+
+    def _index(self, idx: Path) -> list:
+        st = idx.stat()
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = self._index_cache.get(idx)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        with open(idx, "r", encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        self._index_cache[idx] = (stamp, entries)
+        return entries
+
+    def _member(self, seg: Path, entry: dict) -> list:
+        with open(seg, "rb") as f:
+            f.seek(entry["offset"])
+            blob = f.read(entry["length"])
+        self.members_read += 1
+        return [json.loads(line) for line in gzip.decompress(blob).decode("utf-8").splitlines()]
+
+    def iter_person(self, person_id: Optional[int], before_id: Optional[int] = None) -> Iterator[dict]:
+        """Archived chats for one person (None = guests), newest first, deduplicated."""
+        if not self.dir.exists():
+            return
+        seen = set()
+        for idx in sorted(self.dir.glob("chats-*.idx"), reverse=True):
+            seg = idx.with_suffix(".jsonl.gz")
+            for entry in reversed(self._index(idx)):
+                if person_id not in entry["people"]:
+                    continue
+                if before_id is not None and entry["first_id"] >= before_id:
+                    continue
+                rows = [
+                    r for r in self._member(seg, entry)
+                    if r["person_id"] == person_id and (before_id is None or r["id"] < before_id)
+                ]
+                for r in sorted(rows, key=lambda r: r["id"], reverse=True):
+                    if r["id"] not in seen:
+                        seen.add(r["id"])
+                        yield r
+
+    def stats(self) -> dict:
+        segments = list(self.dir.glob("chats-*.jsonl.gz")) if self.dir.exists() else []
+        return {
+            "dir": str(self.dir),
+            "segments": len(segments),
+            "bytes": sum(p.stat().st_size for p in segments),
+            "members_written": self.members_written,
+            "members_read": self.members_read,
+        }
+
+
+# -------- Compactor --------
+class RetentionWorker:
+    """Background pass every `interval` seconds: archive old chats, purge sessions, vacuum."""
+
+    def __init__(
+        self,
+        archive: ChatArchive,
+        chat_days: float = 180,
+        guest_days: float = 30,
+        interval: float = 3600,
+        batch_size: int = 1000,
+        vacuum_pages: int = 1000,
+        pause: float = 0.01,
+        lease_seconds: float = 300,
+    ):
+        self.archive = archive
+        self.chat_days = chat_days
+        self.guest_days = guest_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.pause = pause  # between batches, so request writers get the lock
+        self.lease_seconds = lease_seconds  # renewed every batch; outlives a crashed owner only this long
+        self._owner = f"{os.getpid()}-{id(self)}"
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.passes = 0
+        self.chats_archived = 0
+        self.sessions_purged = 0
+        self.pages_freed = 0
+        self.last_pass_seconds = 0.0
+        self.last_error: Optional[str] = None
+
+    @classmethod
+    def from_env(cls, archive: Optional[ChatArchive] = None) -> Optional["RetentionWorker"]:
+        if os.getenv("MOEX_RETENTION", "true").lower() != "true":
+            return None
+        return cls(
+            archive or ChatArchive.from_env(),
+            chat_days=float(os.getenv("MOEX_CHAT_RETENTION_DAYS", "180")),
+            guest_days=float(os.getenv("MOEX_GUEST_RETENTION_DAYS", "30")),
+            interval=float(os.getenv("MOEX_RETENTION_INTERVAL_S", "3600")),
+            batch_size=int(os.getenv("MOEX_RETENTION_BATCH", "1000")),
+            vacuum_pages=int(os.getenv("MOEX_VACUUM_PAGES", "1000")),
+        )
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="moex-retention", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        delay = min(60.0, self.interval)  # first pass shortly after boot
+        while not self._stop.wait(delay):
+            delay = self.interval
+            try:
+                self.run_once()
+                self.last_error = None
+            except Exception as e:  # keep the thread alive; try again next interval
+                self.last_error = repr(e)
+                log.exception("retention pass failed")
+
+    def run_once(self) -> dict:
+        started = time.perf_counter()
+        archived = self.compact_chats()
+        purged = self.purge_sessions()
+        freed = self.vacuum()
+        self.passes += 1
+        self.last_pass_seconds = time.perf_counter() - started
+        if archived or purged or freed:
+            log.info("retention: archived %d chats, purged %d sessions, freed %d pages in %.2fs",
+                     archived, purged, freed, self.last_pass_seconds)
+        return {"archived": archived, "purged": purged, "pages_freed": freed}
+
+    @staticmethod
+    def _cutoff(days: float) -> str:
+        return (datetime.now(timezone.utc) - timedelta(days=days)).strftime(_TS_FORMAT)
+
+    # -------- Lease --------
+    def _hold_lease(self) -> bool:
+        """Take or renew the archiving lease; False while another worker holds it."""
+        now = time.time()
+        with db.connection() as conn:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT value FROM moex_meta WHERE key=?", (_LEASE_KEY,)).fetchone()
+                if row:
+                    owner, _, expires = row[0].rpartition("|")
+                    if owner != self._owner and float(expires) > now:
+                        return False
+                conn.execute("INSERT OR REPLACE INTO moex_meta(key, value) VALUES (?, ?)",
+                             (_LEASE_KEY, f"{self._owner}|{now + self.lease_seconds}"))
+        return True
+
+    def _release_lease(self):
+        db.execute("DELETE FROM moex_meta WHERE key=? AND value LIKE ?", (_LEASE_KEY, f"{self._owner}|%"))
+
+    def compact_chats(self) -> int:
+        if not self._hold_lease():
+            return 0  # another worker is archiving
+        try:
+            return (self._compact(_SELECT_OLD_GUESTS, self._cutoff(self.guest_days))
+                    + self._compact(_SELECT_OLD_PEOPLE, self._cutoff(self.chat_days)))
+        finally:
+            self._release_lease()
+
+    def _compact(self, select: str, cutoff: str) -> int:
+        moved = 0
+        while not self._stop.is_set():
+            rows = db.all(select, (cutoff, self.batch_size))
+            if not rows:
+                break
+            # compress + fsync without the DB write lock; the lease keeps other workers off these rows
+            by_month: dict = {}
+            for r in rows:
+                by_month.setdefault((r["ts"] or "unknown")[:7], []).append(r)
+            for month, group in sorted(by_month.items()):
+                self.archive.append(month, group)
+            db.executemany("DELETE FROM chats WHERE id=?", [(r["id"],) for r in rows])
+            moved += len(rows)
+            self.chats_archived += len(rows)
+            if len(rows) < self.batch_size or not self._hold_lease():
+                break
+            time.sleep(self.pause)
+        return moved
+
+    def purge_sessions(self) -> int:
+        now = datetime.now(timezone.utc).isoformat()  # same shape as main._iso
+        purged = 0
+        while not self._stop.is_set():
+            with db.connection() as conn:
+                with conn:
+                    n = conn.execute(
+                        "DELETE FROM sessions WHERE id IN "
+                        "(SELECT id FROM sessions WHERE trusted_until < ? LIMIT ?)",
+                        (now, self.batch_size),
+                    ).rowcount
+            purged += n
+            self.sessions_purged += n
+            if n < self.batch_size:
+                break
+            time.sleep(self.pause)
+        return purged
+
+    def vacuum(self) -> int:
+        """Return up to `vacuum_pages` free pages to the filesystem (incremental DBs only)."""
+        with db.connection() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                return 0
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not before:
+                return 0
+            # frees one page per step and returns no rows, so execute() would stop after
+            # the first; executescript steps it to completion
+            conn.executescript(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)})")
+            freed = before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        self.pages_freed += freed
+        return freed
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "passes": self.passes,
+            "chats_archived": self.chats_archived,
+            "sessions_purged": self.sessions_purged,
+            "pages_freed": self.pages_freed,
+            "last_pass_seconds": round(self.last_pass_seconds, 3),
+            "last_error": self.last_error,
+            "archive": self.archive.stats(),
+        }
+
+
+def enable_incremental_vacuum():
+    """Rewrite the whole DB once so auto_vacuum=INCREMENTAL takes effect. Run offline."""
+    with db.connection() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    return True
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    ap = argparse.ArgumentParser(description="MoeX retention tools")
+    ap.add_argument("cmd", choices=["run", "vacuum"])
+    args = ap.parse_args()
+    db.init_db()
+    if args.cmd == "run":
+        worker = RetentionWorker.from_env() or RetentionWorker(ChatArchive.from_env())
+        print(json.dumps(worker.run_once()))
+    else:
+        print("switched to incremental" if enable_incremental_vacuum() else "already incremental")
@@ -5,8 +5,10 @@ CREATE TABLE IF NOT EXISTS people (
   email TEXT UNIQUE,
   handle TEXT UNIQUE,
   tags TEXT,
+  persona TEXT,
   secret_salt BLOB,
   secret_hash BLOB,
+  secret_iters INTEGER,  -- PBKDF2 iterations; NULL = legacy 120000
   is_enabled INTEGER DEFAULT 1,
   created_at TEXT DEFAULT (datetime('now'))
 );
@@ -30,8 +32,15 @@ CREATE TABLE IF NOT EXISTS chats (
   ts TEXT DEFAULT (datetime('now')),
   FOREIGN KEY(person_id) REFERENCES people(id)
 );
--- Index for faster retrieval of chat history
-CREATE INDEX IF NOT EXISTS idx_chats_person_id ON chats(person_id); 
+-- History is always read per person, newest first (keyset on id);
+-- this covers what the old person_id-only index did.
+CREATE INDEX IF NOT EXISTS idx_chats_person_id_id ON chats(person_id, id);
+-- Retention finds old chats by age, guests and people on separate cutoffs
+-- (backend/retention.py); partial indexes keep each range to rows it can move
+CREATE INDEX IF NOT EXISTS idx_chats_guest_ts ON chats(ts) WHERE person_id IS NULL;
+CREATE INDEX IF NOT EXISTS idx_chats_person_ts ON chats(ts) WHERE person_id IS NOT NULL;
+DROP INDEX IF EXISTS idx_chats_ts;
+DROP INDEX IF EXISTS idx_chats_person_id;
 
 -- Tasks
 CREATE TABLE IF NOT EXISTS tasks (
@@ -42,3 +51,44 @@ CREATE TABLE IF NOT EXISTS tasks (
     status TEXT DEFAULT 'pending',
     FOREIGN KEY (person_id) REFERENCES people(id)
 );
+-- A person's tasks by status, soonest first (lists and the chat digest)
+CREATE INDEX IF NOT EXISTS idx_tasks_person_status_due ON tasks(person_id, status, due_date);
+
+-- Humor lines (rotation lives in memory; see middleware/humor.py)
+CREATE TABLE IF NOT EXISTS humor (
+  id INTEGER PRIMARY KEY,
+  line TEXT,
+  level TEXT,
+  tag TEXT,
+  created_at TEXT,
+  use_count INTEGER DEFAULT 0,
+  last_used_at TEXT
+);
+
+-- Small key/value store for bookkeeping (FTS backfill progress, ...)
+CREATE TABLE IF NOT EXISTS moex_meta (
+  key TEXT PRIMARY KEY,
+  value TEXT
+);
+
+-- Cache invalidations shared between uvicorn workers (backend/invalidation.py);
+-- AUTOINCREMENT so ids never repeat after old rows are pruned
+CREATE TABLE IF NOT EXISTS moex_changes (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  kind TEXT NOT NULL,
+  key TEXT,
+  origin TEXT NOT NULL,
+  at REAL NOT NULL
+);
+
+-- OpenAI tokens per UTC day, caller and model (backend/usage.py); subject is
+-- "person:<id>" or "ip:<addr>" for guests
+CREATE TABLE IF NOT EXISTS usage (
+  day TEXT NOT NULL,
+  subject TEXT NOT NULL,
+  model TEXT NOT NULL,
+  calls INTEGER NOT NULL DEFAULT 0,
+  prompt_tokens INTEGER NOT NULL DEFAULT 0,
+  completion_tokens INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (day, subject, model)
+);
@@ -1,12 +1,12 @@
 from backend import db
-from backend.main import _hash_secret
+from backend.hashing import hash_secret
 
 def seed_person(name, email, tags, secret_word, handle=None, persona=None):
-    salt, h = _hash_secret(secret_word)
+    salt, h, iters = hash_secret(secret_word)
     person_id = db.execute(
-        """INSERT INTO people(name,email,handle,tags,persona,secret_salt,secret_hash,is_enabled)
-           VALUES(?,?,?,?,?,?,?,1)""",
-        (name, email, handle, tags, persona, salt, h),
+        """INSERT INTO people(name,email,handle,tags,persona,secret_salt,secret_hash,secret_iters,is_enabled)
+           VALUES(?,?,?,?,?,?,?,?,1)""",
+        (name, email, handle, tags, persona, salt, h, iters),
     )
     print(f"✅ Seeded {name} (id={person_id})")
     return person_id
@@ -0,0 +1,125 @@
+# backend/session_cache.py
+"""
+In-process cache of resolved (person, session) pairs for person_from_session.
+
+Keyed by a SHA-256 of the cookie token so raw tokens never sit in memory
+longer than the request. Positive entries live until the shorter of the
+TTL and the session's trusted_until. Bogus/expired tokens get a short-lived
+negative entry in a separate LRU, so a cookie-spraying client can neither
+hammer SQLite nor push real sessions out of the cache.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Tuple
+
+_NEGATIVE = (None, None)
+
+
+def _token_key(token: str) -> bytes:
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+class SessionCache:
+    def __init__(
+        self,
+        max_entries: int = 10_000,
+        ttl_seconds: float = 300.0,
+        max_negative: int = 50_000,
+        negative_ttl_seconds: float = 30.0,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.max_negative = max_negative
+        self.negative_ttl = negative_ttl_seconds
+        self._lock = threading.Lock()
+        # key -> (person, session, expires_at)
+        self._pos: "OrderedDict[bytes, tuple]" = OrderedDict()
+        # key -> (person_id or None, expires_at)
+        self._neg: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "SessionCache":
+        return cls(
+            max_entries=int(os.getenv("MOEX_SESSION_CACHE_SIZE", "10000")),
+            ttl_seconds=float(os.getenv("MOEX_SESSION_CACHE_TTL", "300")),
+            negative_ttl_seconds=float(os.getenv("MOEX_SESSION_NEGATIVE_TTL", "30")),
+        )
+
+    def get(self, token: str) -> Optional[Tuple[Optional[dict], Optional[dict]]]:
+        """(person, session) on a hit, (None, None) on a negative hit, None on a miss."""
+        key = _token_key(token)
+        now = time.time()
+        with self._lock:
+            entry = self._pos.get(key)
+            if entry is not None:
+                if entry[2] > now:
+                    self._pos.move_to_end(key)
+                    self.hits += 1
+                    return entry[0], entry[1]
+                del self._pos[key]
+            neg = self._neg.get(key)
+            if neg is not None:
+                if neg[1] > now:
+                    self.negative_hits += 1
+                    return _NEGATIVE
+                del self._neg[key]
+            self.misses += 1
+            return None
+
+    def put(self, token: str, person: dict, session: dict):
+        trusted_until = datetime.fromisoformat(session["trusted_until"]).timestamp()
+        expires_at = min(time.time() + self.ttl, trusted_until)
+        key = _token_key(token)
+        with self._lock:
+            self._neg.pop(key, None)
+            self._pos[key] = (person, session, expires_at)
+            self._pos.move_to_end(key)
+            while len(self._pos) > self.max_entries:
+                self._pos.popitem(last=False)
+
+    def put_negative(self, token: str, person_id: Optional[int] = None):
+        key = _token_key(token)
+        with self._lock:
+            self._pos.pop(key, None)
+            self._neg[key] = (person_id, time.time() + self.negative_ttl)
+            self._neg.move_to_end(key)
+            while len(self._neg) > self.max_negative:
+                self._neg.popitem(last=False)
+
+    def invalidate_token(self, token: str):
+        key = _token_key(token)
+        with self._lock:
+            self._pos.pop(key, None)
+            self._neg.pop(key, None)
+
+    def invalidate_person(self, person_id: int):
+        """Drop every cached session (and negative entry) tied to a person."""
+        with self._lock:
+            for k in [k for k, e in self._pos.items() if e[0]["id"] == person_id]:
+                del self._pos[k]
+            for k in [k for k, e in self._neg.items() if e[0] == person_id]:
+                del self._neg[k]
+
+    def clear(self):
+        with self._lock:
+            self._pos.clear()
+            self._neg.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "entries": len(self._pos),
+                "negative_entries": len(self._neg),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,132 @@
+# backend/singleflight.py
+"""
+Request coalescing: identical concurrent calls share one upstream call.
+
+The first caller for a key becomes the leader and does the work; anyone
+arriving with the same key while it's in flight waits for that result
+instead of issuing their own. Followers give up after `wait_timeout` and
+run the call themselves, so a stuck leader can't stall everyone.
+
+Sync (threads) and async (event loop) callers use separate in-flight maps.
+"""
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "followers")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    def __init__(self, wait_timeout: float = 30.0, track_keys: int = 256):
+        self.wait_timeout = wait_timeout
+        self.track_keys = track_keys
+        self._lock = threading.Lock()
+        self._calls: dict = {}
+        self._acalls: dict = {}  # key -> (future, [followers])
+        # recent keys -> how many followers piggy-backed on their flights
+        self._fanout: "OrderedDict[Hashable, int]" = OrderedDict()
+        self.leaders = 0
+        self.shared = 0
+        self.timeouts = 0
+
+    def _note_fanout(self, key: Hashable, followers: int):
+        if not followers:
+            return
+        with self._lock:
+            self._fanout[key] = self._fanout.get(key, 0) + followers
+            self._fanout.move_to_end(key)
+            while len(self._fanout) > self.track_keys:
+                self._fanout.popitem(last=False)
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                call.followers += 1
+
+        if not leader:
+            if call.done.wait(self.wait_timeout):
+                with self._lock:
+                    self.shared += 1
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            with self._lock:
+                self.timeouts += 1
+            return fn()
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+            self._note_fanout(key, call.followers)
+
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._acalls.get(key)
+        if entry is not None:
+            fut, counter = entry
+            counter[0] += 1
+            try:
+                # shield: a follower timing out must not cancel the leader's call
+                result = await asyncio.wait_for(asyncio.shield(fut), self.wait_timeout)
+            except asyncio.TimeoutError:
+                with self._lock:
+                    self.timeouts += 1
+                return await fn()
+            except asyncio.CancelledError:
+                if fut.cancelled():  # the leader was cancelled, not us
+                    return await fn()
+                raise
+            with self._lock:
+                self.shared += 1
+            return result
+
+        fut = asyncio.get_running_loop().create_future()
+        counter = [0]
+        self._acalls[key] = (fut, counter)
+        with self._lock:
+            self.leaders += 1
+        try:
+            result = await fn()
+            fut.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()  # mark retrieved when nobody was waiting
+            raise
+        finally:
+            self._acalls.pop(key, None)
+            self._note_fanout(key, counter[0])
+
+    def stats(self, top: int = 10) -> dict:
+        with self._lock:
+            hottest = sorted(self._fanout.items(), key=lambda kv: kv[1], reverse=True)[:top]
+            return {
+                "leaders": self.leaders,
+                "shared": self.shared,
+                "timeouts": self.timeouts,
+                "in_flight": len(self._calls) + len(self._acalls),
+                "top_fanout": [{"key": str(k), "followers": n} for k, n in hottest],
+            }
@@ -0,0 +1,183 @@
+# backend/tasks.py
+"""
+Tasks: indexed queries, bulk writes, and a cached per-person digest.
+
+Reads go through idx_tasks_person_status_due (person_id, status, due_date),
+so a person's list or their open tasks never scan other people's rows.
+Bulk create and update each run as a single transaction.
+
+TaskDigests holds a compact "open / due soon" line per person. /chat adds it
+to the caller's identity context, so MoeX can answer "what's due?" without
+reading tasks on every message. Any task write invalidates the line. A short
+TTL also lets "due soon" roll over as the days pass.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Iterable, List, Optional
+
+from backend import db
+
+STATUSES = ("pending", "in_progress", "blocked", "done", "cancelled")
+CLOSED = ("done", "cancelled")
+_EDITABLE = ("title", "due_date", "status")
+
+_LIST_SQL = """
+SELECT id, person_id, title, due_date, status FROM tasks
+WHERE person_id=? {status}
+ORDER BY status, due_date IS NULL, due_date, id
+LIMIT ?
+"""
+
+_OPEN_SQL = f"""
+SELECT id, title, due_date, status FROM tasks
+WHERE person_id=? AND COALESCE(status,'pending') NOT IN ({",".join("?" * len(CLOSED))})
+ORDER BY due_date IS NULL, due_date, id
+"""
+
+
+# -------- Queries --------
+def list_for(person_id: int, status: Optional[str] = None, limit: int = 200) -> List[dict]:
+    if status:
+        return db.all(_LIST_SQL.format(status="AND status=?"), (person_id, status, limit))
+    return db.all(_LIST_SQL.format(status=""), (person_id, limit))
+
+
+def owners_of(task_ids: Iterable[int]) -> dict:
+    ids = list(task_ids)
+    if not ids:
+        return {}
+    rows = db.all(f"SELECT id, person_id FROM tasks WHERE id IN ({','.join('?' * len(ids))})", ids)
+    return {r["id"]: r["person_id"] for r in rows}
+
+
+# -------- Bulk writes (one transaction each) --------
+def create_many(tasks: List[dict]) -> List[int]:
+    """Insert tasks ({person_id, title, due_date?, status?}); returns new ids in order."""
+    ids = []
+    with db.connection() as conn:
+        with conn:
+            for t in tasks:
+                cur = conn.execute(
+                    "INSERT INTO tasks(person_id, title, due_date, status) VALUES (?,?,?,?)",
+                    (t["person_id"], t["title"], t.get("due_date"), t.get("status") or "pending"),
+                )
+                ids.append(cur.lastrowid)
+    return ids
+
+
+def update_many(updates: List[dict], person_id: Optional[int] = None) -> int:
+    """
+    Apply {id, title?, due_date?, status?} patches; all or nothing. With
+    person_id, rows owned by someone else are left alone. Returns rows changed.
+    """
+    changed = 0
+    with db.connection() as conn:
+        with conn:
+            for u in updates:
+                fields = {k: u[k] for k in _EDITABLE if k in u}
+                if not fields:
+                    continue
+                cols = ", ".join(f"{k}=?" for k in fields)
+                sql = f"UPDATE tasks SET {cols} WHERE id=?"
+                params = [*fields.values(), u["id"]]
+                if person_id is not None:
+                    sql += " AND person_id=?"
+                    params.append(person_id)
+                changed += conn.execute(sql, params).rowcount
+    return changed
+
+
+# -------- Digest --------
+def render_digest(rows: List[dict], today: date, soon_days: int = 3, max_items: int = 5) -> str:
+    if not rows:
+        return ""
+    today_s = today.isoformat()
+    soon_s = (today + timedelta(days=soon_days)).isoformat()
+    overdue = sum(1 for r in rows if r["due_date"] and r["due_date"][:10] < today_s)
+    soon = sum(1 for r in rows if r["due_date"] and today_s <= r["due_date"][:10] <= soon_s)
+    head = f"Open tasks: {len(rows)}"
+    counts = [f"{overdue} overdue"] * bool(overdue) + [f"{soon} due within {soon_days} days"] * bool(soon)
+    if counts:
+        head += f" ({', '.join(counts)})"
+    items = []
+    for r in rows[:max_items]:
+        due = r["due_date"][:10] if r["due_date"] else "no date"
+        flag = "[overdue] " if r["due_date"] and due < today_s else ""
+        items.append(f"{flag}{r['title']} — {due}")
+    more = f"; +{len(rows) - max_items} more" if len(rows) > max_items else ""
+    return f"{head}. Next: " + "; ".join(items) + more
+
+
+class TaskDigests:
+    def __init__(self, ttl_seconds: float = 600.0, soon_days: int = 3, max_items: int = 5, max_people: int = 5000):
+        self.ttl = ttl_seconds
+        self.soon_days = soon_days
+        self.max_items = max_items
+        self.max_people = max_people
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()  # person_id -> (expires, day, text)
+        # bumped by invalidate(); a read that raced one must not store what it saw
+        self._epoch = 0
+        self._gens: dict = {}  # person_id -> invalidations so far
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "TaskDigests":
+        return cls(
+            ttl_seconds=float(os.getenv("MOEX_TASK_DIGEST_TTL_S", "600")),
+            soon_days=int(os.getenv("MOEX_TASK_DUE_SOON_DAYS", "3")),
+            max_items=int(os.getenv("MOEX_TASK_DIGEST_ITEMS", "5")),
+        )
+
+    def get(self, person_id: int) -> str:
+        today = date.today()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(person_id)
+            if entry is not None and entry[0] > now and entry[1] == today:
+                self._entries.move_to_end(person_id)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            gen = (self._epoch, self._gens.get(person_id, 0))
+        rows = db.all(_OPEN_SQL, (person_id, *CLOSED))
+        text = render_digest(rows, today, self.soon_days, self.max_items)
+        with self._lock:
+            if gen != (self._epoch, self._gens.get(person_id, 0)):
+                return text  # invalidated mid-read: serve it once, don't cache it
+            self._entries[person_id] = (now + self.ttl, today, text)
+            self._entries.move_to_end(person_id)
+            while len(self._entries) > self.max_people:
+                self._entries.popitem(last=False)
+        return text
+
+    async def aget(self, person_id: int) -> str:
+        with self._lock:
+            entry = self._entries.get(person_id)
+            fresh = entry is not None and entry[0] > time.monotonic() and entry[1] == date.today()
+        if fresh:
+            return self.get(person_id)  # memory hit; no thread hop
+        return await db.offload(self.get, person_id)
+
+    def invalidate(self, person_id: Optional[int] = None):
+        with self._lock:
+            if person_id is None:
+                self._entries.clear()
+                self._epoch += 1
+            else:
+                self._entries.pop(person_id, None)
+                self._gens[person_id] = self._gens.get(person_id, 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
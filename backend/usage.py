@@ -0,0 +1,272 @@
+# backend/usage.py
+"""
+OpenAI token accounting and per-caller quotas.
+
+Every chat request is bound to a subject: "person:<id>" when signed in,
+"ip:<addr>" for guests. When a completion reports `usage`, record() charges
+its prompt and completion tokens to that subject in two places:
+
+  window   a sliding window of MOEX_QUOTA_WINDOW_S, kept in memory as
+           60 buckets per subject. check() runs before the LLM is called.
+           It raises QuotaExceeded once a subject has used its budget:
+           MOEX_QUOTA_PERSON_TOKENS for people, MOEX_QUOTA_GUEST_TOKENS per
+           guest IP. 0 means no cap. The guest cap is off by default: behind
+           a proxy every guest shares the proxy's address until
+           MOEX_TRUSTED_PROXIES is set (see main._client_ip).
+  ledger   an append to a deque (no lock on the request path). A background
+           thread drains it every MOEX_USAGE_FLUSH_S and adds the sums to
+           the `usage` table, one row per (day, subject, model).
+           top_consumers() reads that table, never the chats log.
+
+Windows are per worker, like the verify throttles. Under --workers N a
+caller can use up to N × the cap. The ledger is shared through moex.db.
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import List, Optional
+
+from backend import db
+
+log = logging.getLogger(__name__)
+
+_UPSERT_SQL = """
+INSERT INTO usage(day, subject, model, calls, prompt_tokens, completion_tokens) VALUES (?,?,?,?,?,?)
+ON CONFLICT(day, subject, model) DO UPDATE SET
+  calls = calls + excluded.calls,
+  prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+  completion_tokens = completion_tokens + excluded.completion_tokens
+"""
+
+_BUCKETS = 60  # per window
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, subject: str, used: int, limit: int, retry_after: float):
+        super().__init__(f"{subject} used {used} of {limit} tokens")
+        self.subject = subject
+        self.used = used
+        self.limit = limit
+        self.retry_after = retry_after
+
+
+def subject_for(person_id=None, ip: Optional[str] = None) -> str:
+    return f"person:{person_id}" if person_id is not None else f"ip:{ip or 'unknown'}"
+
+
+class UsageMeter:
+    def __init__(
+        self,
+        window_seconds: float = 3600.0,
+        person_limit: int = 100_000,
+        guest_limit: int = 0,
+        flush_interval: float = 10.0,
+        max_keys: int = 50_000,
+    ):
+        self.window = window_seconds
+        self.bucket = window_seconds / _BUCKETS
+        self.person_limit = person_limit
+        self.guest_limit = guest_limit
+        self.flush_interval = flush_interval
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._windows: "OrderedDict[str, deque]" = OrderedDict()  # subject -> [[bucket_start, tokens], ...]
+        self._used = {}  # subject -> tokens in the window
+        self._events: deque = deque()  # (day, subject, model, prompt, completion)
+        self._flush_lock = threading.Lock()
+        self._retry = {}  # aggregated rows a failed flush still owes the table
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.calls = 0
+        self.tokens = 0
+        self.rejections = 0
+        self.flushed_rows = 0
+        self.flush_errors = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["UsageMeter"]:
+        if os.getenv("MOEX_USAGE", "true").lower() != "true":
+            return None
+        return cls(
+            window_seconds=float(os.getenv("MOEX_QUOTA_WINDOW_S", "3600")),
+            person_limit=int(os.getenv("MOEX_QUOTA_PERSON_TOKENS", "100000")),
+            guest_limit=int(os.getenv("MOEX_QUOTA_GUEST_TOKENS", "0")),
+            flush_interval=float(os.getenv("MOEX_USAGE_FLUSH_S", "10")),
+        )
+
+    def limit_for(self, subject: str) -> int:
+        return self.person_limit if subject.startswith("person:") else self.guest_limit
+
+    # -------- Windows --------
+    def _prune(self, subject: str, now: float) -> Optional[deque]:
+        q = self._windows.get(subject)
+        if q is None:
+            return None
+        while q and q[0][0] <= now - self.window:
+            self._used[subject] -= q.popleft()[1]
+        if not q:
+            del self._windows[subject]
+            del self._used[subject]
+            return None
+        return q
+
+    def used(self, subject: str) -> int:
+        with self._lock:
+            self._prune(subject, time.monotonic())
+            return self._used.get(subject, 0)
+
+    def check(self, subject: str):
+        """Raise QuotaExceeded if `subject` has spent its window budget."""
+        limit = self.limit_for(subject)
+        if limit <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            q = self._prune(subject, now)
+            used = self._used.get(subject, 0)
+            if used >= limit:
+                self.rejections += 1
+                raise QuotaExceeded(subject, used, limit, q[0][0] + self.window - now)
+
+    def record(self, subject: str, model: str, prompt_tokens: int, completion_tokens: int):
+        n = prompt_tokens + completion_tokens
+        self._events.append((time.strftime("%Y-%m-%d", time.gmtime()), subject, model,
+                             prompt_tokens, completion_tokens))
+        now = time.monotonic()
+        start = now - now % self.bucket
+        with self._lock:
+            self.calls += 1
+            self.tokens += n
+            q = self._prune(subject, now)
+            if q is None:
+                q = self._windows[subject] = deque()
+                self._used[subject] = 0
+            if q and q[-1][0] == start:
+                q[-1][1] += n
+            else:
+                q.append([start, n])
+            self._used[subject] += n
+            self._windows.move_to_end(subject)
+            while len(self._windows) > self.max_keys:
+                old, _ = self._windows.popitem(last=False)
+                del self._used[old]
+
+    # -------- Ledger --------
+    def flush(self) -> int:
+        """Add everything recorded so far to the usage table; returns rows written."""
+        with self._flush_lock:
+            rows, self._retry = self._retry, {}
+            while True:
+                try:
+                    day, subject, model, p, c = self._events.popleft()
+                except IndexError:
+                    break
+                row = rows.setdefault((day, subject, model), [0, 0, 0])
+                row[0] += 1
+                row[1] += p
+                row[2] += c
+            if not rows:
+                return 0
+            try:
+                db.executemany(_UPSERT_SQL, [(*k, *v) for k, v in rows.items()])
+            except Exception:
+                self._retry = rows  # merged into the next flush
+                self.flush_errors += 1
+                raise
+            self.flushed_rows += len(rows)
+            return len(rows)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="moex-usage", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Write what's pending, then stop the flusher."""
+        if self.running:
+            self._stop.set()
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            stopping = self._stop.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                log.exception("usage flush failed")
+            if stopping:
+                return
+
+    def stats(self) -> dict:
+        with self._lock:
+            subjects = len(self._windows)
+        return {
+            "running": self.running,
+            "subjects": subjects,
+            "calls": self.calls,
+            "tokens": self.tokens,
+            "rejections": self.rejections,
+            "pending": len(self._events),
+            "flushed_rows": self.flushed_rows,
+            "flush_errors": self.flush_errors,
+        }
+
+
+# -------- Request binding --------
+meter: Optional[UsageMeter] = UsageMeter.from_env()
+# subject the current request's LLM calls are charged to; None outside /chat
+_subject: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("moex_usage_subject", default=None)
+
+
+def bind(subject: str):
+    _subject.set(subject)
+
+
+def record(usage, model: str):
+    """Charge an OpenAI `usage` object to the bound subject (no-op if either is missing)."""
+    subject = _subject.get()
+    if meter is None or subject is None or usage is None:
+        return
+    meter.record(subject, model, getattr(usage, "prompt_tokens", 0) or 0,
+                 getattr(usage, "completion_tokens", 0) or 0)
+
+
+# -------- Reports --------
+def top_consumers(days: int = 7, limit: int = 20, kind: Optional[str] = None) -> List[dict]:
+    """Biggest subjects by total tokens over the last `days` UTC days (today included)."""
+    since = time.strftime("%Y-%m-%d", time.gmtime(time.time() - (days - 1) * 86400))
+    where = "day >= ?"
+    if kind == "person":
+        where += " AND subject LIKE 'person:%'"
+    elif kind == "guest":
+        where += " AND subject LIKE 'ip:%'"
+    rows = db.all(
+        f"""SELECT subject, SUM(calls) AS calls, SUM(prompt_tokens) AS prompt_tokens,
+                   SUM(completion_tokens) AS completion_tokens,
+                   SUM(prompt_tokens + completion_tokens) AS total_tokens
+            FROM usage WHERE {where}
+            GROUP BY subject ORDER BY total_tokens DESC LIMIT ?""",
+        (since, limit),
+    )
+    ids = [int(r["subject"][len("person:"):]) for r in rows if r["subject"].startswith("person:")]
+    names = {}
+    if ids:
+        names = {p["id"]: p["name"] for p in db.all(
+            f"SELECT id, name FROM people WHERE id IN ({','.join('?' * len(ids))})", tuple(ids))}
+    for r in rows:
+        if r["subject"].startswith("person:"):
+            r["person_id"] = int(r["subject"][len("person:"):])
+            r["name"] = names.get(r["person_id"])
+        if meter is not None:
+            r["window_tokens"] = meter.used(r["subject"])
+    return rows
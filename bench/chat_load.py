@@ -0,0 +1,128 @@
+# bench/chat_load.py
+"""
+Concurrency benchmark for the /chat path against a local fake LLM.
+
+Compares the blocking llm.respond (run on a 40-thread pool, like Starlette's
+default) with llm.respond_async on one event loop, then drives the real app
+over HTTP while probing /health to show it stays responsive.
+
+    python -m bench.chat_load --requests 400 --latency-ms 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.fake_openai import create_app, serve_in_thread
+
+
+def _setup_env(llm_port: int):
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{llm_port}/v1"
+    os.environ["OPENAI_API_KEY"] = "fake"
+    os.environ["OPENAI_RETRIES"] = "0"
+    os.environ.setdefault("MOEX_LLM_RPM", "0")  # measure the app, not our own rate limiter
+    os.environ.setdefault("MOEX_LLM_PER_PERSON", "1000")
+    # every bench guest shares one client IP; token quotas would 429 the run
+    os.environ.setdefault("MOEX_QUOTA_GUEST_TOKENS", "0")
+    os.environ.setdefault("MOEX_QUOTA_PERSON_TOKENS", "0")
+    os.environ.setdefault("MOEX_REPLY_CACHE", "false")
+    os.environ.setdefault("MOEX_DB", os.path.join(tempfile.mkdtemp(prefix="moex-bench-"), "moex.db"))
+
+
+def bench_llm(n: int, threads: int) -> dict:
+    from backend import llm
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(lambda i: llm.respond(f"hello {i}"), range(n)))
+    sync_s = time.perf_counter() - started
+
+    async def run_async():
+        t0 = time.perf_counter()
+        await asyncio.gather(*(llm.respond_async(f"hello {i}") for i in range(n)))
+        return time.perf_counter() - t0
+
+    async_s = asyncio.run(run_async())
+    return {
+        "requests": n,
+        "sync_threads": threads,
+        "sync_seconds": round(sync_s, 3),
+        "sync_rps": round(n / sync_s, 1),
+        "async_seconds": round(async_s, 3),
+        "async_rps": round(n / async_s, 1),
+        "speedup": round(sync_s / async_s, 2),
+    }
+
+
+async def _drive_http(base: str, n: int, concurrency: int) -> dict:
+    import httpx
+
+    health_ms = []
+    done = asyncio.Event()
+    sem = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    async with httpx.AsyncClient(base_url=base, timeout=60) as client:
+        async def one_chat(i):
+            nonlocal errors
+            async with sem:
+                r = await client.post("/chat", json={"message": f"hi {i}"})
+                if r.status_code != 200:
+                    errors += 1
+
+        async def probe():
+            while not done.is_set():
+                t0 = time.perf_counter()
+                await client.get("/health")
+                health_ms.append((time.perf_counter() - t0) * 1000)
+                await asyncio.sleep(0.05)
+
+        prober = asyncio.create_task(probe())
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one_chat(i) for i in range(n)))
+        elapsed = time.perf_counter() - t0
+        done.set()
+        await prober
+
+    health_ms.sort()
+    return {
+        "requests": n,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "rps": round(n / elapsed, 1),
+        "errors": errors,
+        "health_p50_ms": round(statistics.median(health_ms), 2) if health_ms else None,
+        "health_max_ms": round(health_ms[-1], 2) if health_ms else None,
+    }
+
+
+def bench_http(n: int, concurrency: int, port: int) -> dict:
+    from backend.main import app
+
+    serve_in_thread(app, port)
+    return asyncio.run(_drive_http(f"http://127.0.0.1:{port}", n, concurrency))
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="MoeX /chat concurrency benchmark")
+    ap.add_argument("--requests", type=int, default=400)
+    ap.add_argument("--concurrency", type=int, default=200)
+    ap.add_argument("--threads", type=int, default=40)
+    ap.add_argument("--latency-ms", type=float, default=500.0)
+    ap.add_argument("--llm-port", type=int, default=8099)
+    ap.add_argument("--app-port", type=int, default=8098)
+    args = ap.parse_args()
+
+    serve_in_thread(create_app(args.latency_ms), args.llm_port)
+    _setup_env(args.llm_port)
+
+    result = {
+        "latency_ms": args.latency_ms,
+        "llm": bench_llm(args.requests, args.threads),
+        "http": bench_http(args.requests, args.concurrency, args.app_port),
+    }
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,164 @@
+# bench/fake_openai.py
+"""
+Tiny OpenAI-compatible Chat Completions server for benchmarks.
+
+Answers POST /v1/chat/completions after a configurable delay, so the backend
+can be load-tested without burning real tokens. A share of calls can fail
+with 429/5xx to exercise retries and the circuit breaker.
+
+Latency is drawn per call from --latency-dist around --latency-ms:
+fixed, uniform (±50%), exp (exponential mean), or lognormal (median, with
+--latency-sigma), which gives the long tail real providers have.
+
+    python -m bench.fake_openai --port 8099 --latency-ms 800 --latency-dist lognormal --error-rate 0.1
+    OPENAI_BASE_URL=http://127.0.0.1:8099/v1 OPENAI_API_KEY=fake uvicorn backend.main:app
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+LATENCY_DISTS = ("fixed", "uniform", "exp", "lognormal")
+
+
+def sample_latency(dist: str, mean_s: float, sigma: float = 0.5, rng: random.Random = random) -> float:
+    if mean_s <= 0 or dist == "fixed":
+        return max(0.0, mean_s)
+    if dist == "uniform":
+        return rng.uniform(0.5 * mean_s, 1.5 * mean_s)
+    if dist == "exp":
+        return rng.expovariate(1.0 / mean_s)
+    if dist == "lognormal":
+        return rng.lognormvariate(math.log(mean_s), sigma)
+    raise ValueError(f"unknown latency distribution {dist!r}; pick one of {LATENCY_DISTS}")
+
+
+def _usage(body: dict, text: str) -> dict:
+    prompt = sum(len(m.get("content", "")) // 4 for m in body.get("messages", []))
+    completion = len(text) // 4
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+
+def _stream(body: dict, text: str, first_s: float, token_s: float):
+    cid = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+    def chunk(delta: dict, finish=None, usage=None) -> str:
+        payload = {
+            "id": cid,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish}],
+        }
+        if usage:
+            payload["usage"] = usage
+        return f"data: {json.dumps(payload)}\n\n"
+
+    async def gen():
+        await asyncio.sleep(first_s)
+        yield chunk({"role": "assistant", "content": ""})
+        for word in text.split(" "):
+            yield chunk({"content": word + " "})
+            await asyncio.sleep(token_s)
+        yield chunk({}, finish="stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield chunk({}, usage=_usage(body, text))
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(gen(), media_type="text/event-stream")
+
+
+def create_app(
+    latency_ms: float = 800.0,
+    token_ms: float = 20.0,
+    error_rate: float = 0.0,
+    error_codes: tuple = (429, 500, 503),
+    latency_dist: str = "fixed",
+    latency_sigma: float = 0.5,
+    seed: int | None = None,
+) -> FastAPI:
+    if latency_dist not in LATENCY_DISTS:
+        raise ValueError(f"unknown latency distribution {latency_dist!r}")
+    app = FastAPI(title="fake-openai")
+    app.state.latency_s = latency_ms / 1000.0
+    app.state.latency_dist = latency_dist
+    app.state.latency_sigma = latency_sigma
+    app.state.rng = random.Random(seed)
+    app.state.token_s = token_ms / 1000.0
+    app.state.error_rate = error_rate
+    app.state.error_codes = error_codes
+    app.state.calls = 0
+    app.state.errors = 0
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        app.state.calls += 1
+        rng = app.state.rng
+        latency_s = sample_latency(app.state.latency_dist, app.state.latency_s, app.state.latency_sigma, rng)
+        if app.state.error_rate and rng.random() < app.state.error_rate:
+            app.state.errors += 1
+            code = rng.choice(app.state.error_codes)
+            await asyncio.sleep(app.state.latency_s / 10)
+            return JSONResponse(
+                status_code=code,
+                content={"error": {"message": f"injected {code}", "type": "fake_error"}},
+            )
+        last = (body.get("messages") or [{}])[-1].get("content", "")
+        text = f"Fake reply to: {last[:80]}"
+        if body.get("stream"):
+            # latency_ms is time-to-first-token when streaming
+            return _stream(body, text, latency_s, app.state.token_s)
+        await asyncio.sleep(latency_s)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": _usage(body, text),
+        }
+
+    return app
+
+
+def serve_in_thread(app, port: int) -> uvicorn.Server:
+    """Start `app` on 127.0.0.1:port in a daemon thread and wait until it's up."""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.time() + 10
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError(f"server on port {port} did not start")
+        time.sleep(0.02)
+    return server
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--port", type=int, default=8099)
+    ap.add_argument("--latency-ms", type=float, default=800.0)
+    ap.add_argument("--token-ms", type=float, default=20.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--latency-dist", choices=LATENCY_DISTS, default="fixed")
+    ap.add_argument("--latency-sigma", type=float, default=0.5)
+    ap.add_argument("--seed", type=int, default=None)
+    args = ap.parse_args()
+    app = create_app(
+        args.latency_ms, args.token_ms, args.error_rate,
+        latency_dist=args.latency_dist, latency_sigma=args.latency_sigma, seed=args.seed,
+    )
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
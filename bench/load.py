@@ -0,0 +1,153 @@
+# bench/load.py
+"""
+Mixed-traffic load test for backend.main against the fake OpenAI server.
+
+Starts the fake LLM and the real app in-process on a temp DB, creates
+--people people and signs each of them in. It then runs --concurrency
+closed-loop workers for --duration seconds. Each request picks one
+operation, weighted by --mix:
+
+    guest_chat   POST /chat with no session
+    auth_chat    POST /chat with a session cookie
+    verify       POST /auth/verify with the right secret (the PBKDF2 path)
+    me           GET /me with a session cookie
+
+It prints JSON with count, errors, error_rate, rps and p50/p95/p99/max in ms
+for each operation and overall. "degraded" counts 200 replies that carried
+the busy/unavailable fallback text.
+
+    python -m bench.load --duration 30 --concurrency 64 --latency-dist lognormal
+    python -m bench.load --save-baseline base.json
+    python -m bench.load --baseline base.json --tolerance 0.15
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from collections import Counter
+
+from bench.chat_load import _setup_env
+from bench.fake_openai import LATENCY_DISTS, create_app, serve_in_thread
+from bench.report import add_cli_args, finish, summarize
+
+OPS = ("guest_chat", "auth_chat", "verify", "me")
+DEFAULT_MIX = "guest_chat=4,auth_chat=3,verify=1,me=2"
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        op, _, weight = part.partition("=")
+        op = op.strip()
+        if op not in OPS:
+            raise SystemExit(f"unknown op {op!r}; pick from {', '.join(OPS)}")
+        mix[op] = float(weight or 1)
+    return {op: w for op, w in mix.items() if w > 0}
+
+
+async def _seed(client, n: int) -> list:
+    people = []
+    for i in range(n):
+        secret = f"bench-secret-{i}"
+        r = await client.post("/people", json={
+            "name": f"Bench {i}", "email": f"bench{i}@example.com", "secret_word": secret,
+        })
+        r.raise_for_status()
+        person_id = r.json()["person_id"]
+        r = await client.post("/auth/verify", json={"person_id": person_id, "secret_word": secret})
+        r.raise_for_status()
+        # the cookie is Secure, so httpx won't send it back over http; pass it by hand
+        people.append({"id": person_id, "secret": secret, "token": r.cookies.get("moex_session")})
+    return people
+
+
+async def drive(base: str, duration: float, concurrency: int, mix: dict, n_people: int, seed: int) -> dict:
+    import httpx
+    from backend.llm import BUSY_REPLY, UNAVAILABLE_REPLY
+
+    rng = random.Random(seed)
+    ops, weights = zip(*mix.items())
+    samples = {op: [] for op in ops}
+    errors: Counter = Counter()
+    degraded: Counter = Counter()
+    fallback = {BUSY_REPLY, UNAVAILABLE_REPLY}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base, timeout=120, limits=limits) as client:
+        people = await _seed(client, n_people)
+
+        async def call(op: str):
+            p = rng.choice(people)
+            cookie = {"cookie": f"moex_session={p['token']}"}
+            if op == "guest_chat":
+                return await client.post("/chat", json={"message": f"hello {rng.random():.6f}"})
+            if op == "auth_chat":
+                return await client.post("/chat", json={"message": f"status {rng.random():.6f}"}, headers=cookie)
+            if op == "verify":
+                return await client.post("/auth/verify", json={"person_id": p["id"], "secret_word": p["secret"]})
+            return await client.get("/me", headers=cookie)
+
+        async def worker(deadline: float):
+            while time.perf_counter() < deadline:
+                op = rng.choices(ops, weights)[0]
+                t0 = time.perf_counter()
+                try:
+                    r = await call(op)
+                    ok = r.status_code < 400
+                except httpx.HTTPError:
+                    r, ok = None, False
+                samples[op].append((time.perf_counter() - t0) * 1000)
+                if not ok:
+                    errors[op] += 1
+                elif op.endswith("_chat") and r.json().get("reply") in fallback:
+                    degraded[op] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(started + duration) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    per_op = {op: summarize(samples[op], errors[op], elapsed, degraded=degraded[op]) for op in ops}
+    everything = [ms for op in ops for ms in samples[op]]
+    return {
+        "seconds": round(elapsed, 3),
+        "overall": summarize(everything, sum(errors.values()), elapsed, degraded=sum(degraded.values())),
+        "ops": per_op,
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="MoeX mixed-traffic load test")
+    ap.add_argument("--duration", type=float, default=20.0)
+    ap.add_argument("--concurrency", type=int, default=64)
+    ap.add_argument("--mix", default=DEFAULT_MIX, help=f"op=weight list (default {DEFAULT_MIX})")
+    ap.add_argument("--people", type=int, default=20)
+    ap.add_argument("--latency-ms", type=float, default=500.0)
+    ap.add_argument("--latency-dist", choices=LATENCY_DISTS, default="lognormal")
+    ap.add_argument("--latency-sigma", type=float, default=0.5)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--llm-port", type=int, default=8099)
+    ap.add_argument("--app-port", type=int, default=8098)
+    add_cli_args(ap)
+    args = ap.parse_args()
+    mix = parse_mix(args.mix)
+
+    serve_in_thread(create_app(
+        args.latency_ms, error_rate=args.error_rate,
+        latency_dist=args.latency_dist, latency_sigma=args.latency_sigma, seed=args.seed,
+    ), args.llm_port)
+    _setup_env(args.llm_port)
+
+    from backend.main import app  # after _setup_env: settings are read at import
+
+    serve_in_thread(app, args.app_port)
+    result = {
+        "config": {
+            "duration_s": args.duration, "concurrency": args.concurrency, "mix": mix, "people": args.people,
+            "latency_ms": args.latency_ms, "latency_dist": args.latency_dist, "error_rate": args.error_rate,
+        },
+        **asyncio.run(drive(f"http://127.0.0.1:{args.app_port}", args.duration, args.concurrency,
+                            mix, args.people, args.seed)),
+    }
+    sys.exit(finish(result, args.out, args.baseline, args.save_baseline, args.tolerance))
@@ -0,0 +1,110 @@
+# bench/micro.py
+"""
+Microbenchmarks for hot helpers: db.*, sanitize and prompt assembly.
+
+Each case runs in-process against a temp DB. The result is the best of
+--repeat runs of --number calls each, reported as ns/op and ops/s, so runs
+can be compared with bench.report.
+
+    python -m bench.micro --number 2000
+    python -m bench.micro --baseline micro-base.json
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+from bench.report import add_cli_args, finish
+
+_REPLY = (
+    "Alright boss, here's the plan.\n"
+    "sys: internal routing note\n"
+    "1) Ship the fix today.\n\n\n\n"
+    "2) Tell the team.\n"
+    "debug: tokens=123\n"
+    + "Some ordinary sentence that looks like a real answer. " * 10
+)
+
+
+def _setup():
+    os.environ.setdefault("MOEX_DB", os.path.join(tempfile.mkdtemp(prefix="moex-micro-"), "moex.db"))
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    from backend import db
+
+    db.init_db()
+    person_id = db.execute(
+        "INSERT INTO people(name, email, tags, persona, is_enabled) VALUES (?,?,?,?,1)",
+        ("Micro Bench", "micro@example.com", "ops,bench", "Prefers short answers."),
+    )
+    db.executemany(
+        "INSERT INTO chats(person_id, role, text) VALUES (?,?,?)",
+        [(person_id, "user" if i % 2 else "assistant", f"message {i} " * 8) for i in range(2000)],
+    )
+    return person_id
+
+
+def cases(person_id: int) -> dict:
+    from backend import db, llm, prompts
+    from backend.main import sanitize
+    from backend.middleware.sanitizer import StreamSanitizer
+
+    ctx = {"id": person_id, "name": "Micro Bench", "email": "micro@example.com",
+           "tags": "ops,bench", "persona": "Prefers short answers."}
+    history = [{"role": "user" if i % 2 else "assistant", "content": f"turn {i} " * 12} for i in range(10)]
+    chunks = [_REPLY[i:i + 7] for i in range(0, len(_REPLY), 7)]
+    rows = [(person_id, "user", "bulk row") for _ in range(100)]
+
+    def stream_sanitize():
+        s = StreamSanitizer()
+        for c in chunks:
+            s.feed(c)
+        s.finish()
+
+    def checkout():
+        with db.connection():
+            pass
+
+    def prompt_cold():
+        prompts.invalidate(person_id)
+        llm._build_system_prompt(ctx)
+
+    return {
+        "db.one": lambda: db.one("SELECT * FROM people WHERE id=?", (person_id,)),
+        "db.all_page50": lambda: db.all(
+            "SELECT id, role, text FROM chats WHERE person_id=? ORDER BY id DESC LIMIT 50", (person_id,)),
+        "db.execute_insert": lambda: db.execute(
+            "INSERT INTO chats(person_id, role, text) VALUES (?,?,?)", (person_id, "user", "bench")),
+        "db.executemany_100": lambda: db.executemany(
+            "INSERT INTO chats(person_id, role, text) VALUES (?,?,?)", rows),
+        "db.connection": checkout,
+        "sanitize": lambda: sanitize(_REPLY),
+        "stream_sanitizer": stream_sanitize,
+        "build_system_prompt_warm": lambda: llm._build_system_prompt(ctx),
+        "build_system_prompt_cold": prompt_cold,
+        "build_messages_10_turns": lambda: llm._build_messages("what's next?", ctx, history),
+    }
+
+
+def run(number: int, repeat: int, only=None) -> dict:
+    person_id = _setup()
+    results = {}
+    for name, fn in cases(person_id).items():
+        if only and name not in only:
+            continue
+        n = max(1, number // 20) if name.startswith(("db.execute", "db.executemany")) else number
+        fn()  # warm caches / statement cache
+        best = min(timeit.repeat(fn, number=n, repeat=repeat)) / n
+        results[name] = {"ns_per_op": round(best * 1e9, 1), "ops_per_s": round(1 / best, 1) if best else None}
+    return results
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="MoeX microbenchmarks")
+    ap.add_argument("--number", type=int, default=2000)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--only", nargs="*", help="case names to run")
+    add_cli_args(ap)
+    args = ap.parse_args()
+    result = {"number": args.number, "repeat": args.repeat, "cases": run(args.number, args.repeat, args.only)}
+    sys.exit(finish(result, args.out, args.baseline, args.save_baseline, args.tolerance))
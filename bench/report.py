@@ -0,0 +1,122 @@
+# bench/report.py
+"""
+Shared result helpers for the bench scripts: latency summaries and
+baseline comparison.
+
+Every bench script prints a single JSON document. Save one run with
+--save-baseline, and later runs given --baseline report what moved. Any
+metric that got worse by more than --tolerance counts as a regression, and
+the script exits 1. Comparing two saved files also works:
+
+    python -m bench.report run.json baseline.json --tolerance 0.15
+"""
+import argparse
+import json
+import math
+import sys
+from typing import Dict, List, Optional
+
+# metric-name suffixes we know the direction of; anything else is informational
+_LOWER_IS_BETTER = ("_ms", "_seconds", "_ns", "ns_per_op", "error_rate", "errors", "degraded")
+_HIGHER_IS_BETTER = ("rps", "ops_per_s", "speedup")
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list (q in 0..100)."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(q / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies_ms: List[float], errors: int, seconds: float, **extra) -> dict:
+    ms = sorted(latencies_ms)
+    n = len(ms)
+    out = {
+        "count": n,
+        "errors": errors,
+        "error_rate": round(errors / n, 4) if n else 0.0,
+        "rps": round(n / seconds, 1) if seconds else 0.0,
+        "mean_ms": round(sum(ms) / n, 2) if n else None,
+    }
+    for q in (50, 95, 99):
+        v = percentile(ms, q)
+        out[f"p{q}_ms"] = round(v, 2) if v is not None else None
+    out["max_ms"] = round(ms[-1], 2) if ms else None
+    out.update(extra)
+    return out
+
+
+def flatten(doc, prefix: str = "") -> Dict[str, float]:
+    flat: Dict[str, float] = {}
+    if isinstance(doc, dict):
+        for k, v in doc.items():
+            flat.update(flatten(v, f"{prefix}{k}."))
+    elif isinstance(doc, (int, float)) and not isinstance(doc, bool):
+        flat[prefix[:-1]] = float(doc)
+    return flat
+
+
+def _direction(metric: str) -> int:
+    leaf = metric.rsplit(".", 1)[-1]
+    if leaf.endswith(_LOWER_IS_BETTER):
+        return -1
+    if leaf.endswith(_HIGHER_IS_BETTER):
+        return 1
+    return 0
+
+
+def compare(current: dict, baseline: dict, tolerance: float = 0.10) -> dict:
+    """Per-metric change vs baseline; regressions are moves the wrong way past tolerance."""
+    cur, base = flatten(current), flatten(baseline)
+    rows, regressions, improvements = [], [], []
+    for metric in sorted(cur.keys() & base.keys()):
+        direction = _direction(metric)
+        if not direction:
+            continue
+        b, c = base[metric], cur[metric]
+        if b == 0:
+            change = 0.0 if c == 0 else math.inf
+        else:
+            change = (c - b) / abs(b)
+        row = {"metric": metric, "baseline": b, "current": c, "change": round(change, 4)}
+        rows.append(row)
+        worse = change * direction < 0
+        if abs(change) > tolerance:
+            (regressions if worse else improvements).append(metric)
+    return {"tolerance": tolerance, "regressions": regressions, "improvements": improvements, "rows": rows}
+
+
+def finish(result: dict, out: Optional[str], baseline: Optional[str], save_baseline: Optional[str],
+           tolerance: float) -> int:
+    """Common tail of every bench CLI: print/save the run, compare if asked. Returns exit code."""
+    if baseline:
+        with open(baseline, "r", encoding="utf-8") as f:
+            result["comparison"] = compare(result, json.load(f), tolerance)
+    text = json.dumps(result, indent=2)
+    print(text)
+    for path in filter(None, (out, save_baseline)):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({k: v for k, v in result.items() if k != "comparison"}, f, indent=2)
+    return 1 if result.get("comparison", {}).get("regressions") else 0
+
+
+def add_cli_args(ap: argparse.ArgumentParser):
+    ap.add_argument("--out", help="write the JSON result here as well")
+    ap.add_argument("--baseline", help="stored result to compare against")
+    ap.add_argument("--save-baseline", help="store this run as a baseline")
+    ap.add_argument("--tolerance", type=float, default=0.10, help="allowed relative change (0.10 = 10%%)")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Compare two bench JSON results")
+    ap.add_argument("current")
+    ap.add_argument("baseline")
+    ap.add_argument("--tolerance", type=float, default=0.10)
+    args = ap.parse_args()
+    with open(args.current, "r", encoding="utf-8") as f:
+        current = json.load(f)
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        report = compare(current, json.load(f), args.tolerance)
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if report["regressions"] else 0)
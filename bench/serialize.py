@@ -0,0 +1,103 @@
+# bench/serialize.py
+"""
+Serialization CPU and bytes on the wire for typical API payloads.
+
+For each payload (a 200-row history page, a 500-person list, a 200-task
+list, a 1000-row export page) this compares:
+
+  default   FastAPI's path: jsonable_encoder + json.dumps
+  fast      backend.responses.dumps (orjson when installed)
+
+It also reports identity, gzip and (with brotli installed) br sizes, plus the
+time to compress.
+
+    python -m bench.serialize
+    python -m bench.serialize --baseline ser-base.json
+"""
+import argparse
+import gzip
+import json
+import sys
+import timeit
+
+from fastapi.encoders import jsonable_encoder
+
+from backend import responses
+from bench.report import add_cli_args, finish
+
+_TEXT = "Alright boss — the AR report is due Thursday; ping Finance if the MSc invoices are still open. "
+
+
+def payloads() -> dict:
+    chats = [
+        {"id": 10_000 - i, "person_id": 7, "role": "user" if i % 2 else "assistant",
+         "text": _TEXT * (1 + i % 3), "ts": f"2025-09-{1 + i % 28:02d} 10:{i % 60:02d}:00"}
+        for i in range(1000)
+    ]
+    people = [
+        {"id": i, "name": f"Person {i}", "handle": f"p{i}", "email": f"p{i}@example.com",
+         "tags": "Finance, AR, Student Billing", "persona": "Keep answers short, use bullet points.",
+         "is_enabled": 1, "created_at": "2025-09-01 09:00:00"}
+        for i in range(500)
+    ]
+    tasks = [
+        {"id": i, "person_id": 7, "title": f"Reconcile invoices batch {i}", "due_date": f"2025-10-{1 + i % 28:02d}",
+         "status": ("pending", "in_progress", "done")[i % 3]}
+        for i in range(200)
+    ]
+    return {
+        "history_page_200": {"items": chats[:200], "next_before_id": chats[199]["id"]},
+        "people_500": {"ok": True, "people": people},
+        "tasks_200": {"ok": True, "tasks": tasks},
+        "export_1000": [{"_table": "chats", **c} for c in chats],
+    }
+
+
+def _default_render(payload) -> bytes:
+    # what JSONResponse does after FastAPI's jsonable_encoder pass
+    return json.dumps(jsonable_encoder(payload), ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def _best_ns(fn, number: int, repeat: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e9
+
+
+def run(number: int, repeat: int) -> dict:
+    results = {}
+    for name, payload in payloads().items():
+        body = responses.dumps(payload)
+        default_ns = _best_ns(lambda: _default_render(payload), number, repeat)
+        fast_ns = _best_ns(lambda: responses.dumps(payload), number, repeat)
+        gz = gzip.compress(body, responses.GZIP_LEVEL)
+        row = {
+            "default_ns": round(default_ns),
+            "fast_ns": round(fast_ns),
+            "speedup": round(default_ns / fast_ns, 2),
+            "identity_bytes": len(_default_render(payload)),
+            "fast_bytes": len(body),
+            "gzip_bytes": len(gz),
+            "gzip_ratio": round(len(gz) / len(body), 4),
+            "gzip_ns": round(_best_ns(lambda: gzip.compress(body, responses.GZIP_LEVEL), number, repeat)),
+        }
+        if responses.brotli is not None:
+            br = responses.brotli.compress(body, quality=responses.BROTLI_QUALITY)
+            row["br_bytes"] = len(br)
+            row["br_ns"] = round(_best_ns(
+                lambda: responses.brotli.compress(body, quality=responses.BROTLI_QUALITY), number, repeat))
+        results[name] = row
+    return results
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="MoeX serialization/compression bench")
+    ap.add_argument("--number", type=int, default=50)
+    ap.add_argument("--repeat", type=int, default=5)
+    add_cli_args(ap)
+    args = ap.parse_args()
+    result = {
+        "orjson": responses.orjson is not None,
+        "brotli": responses.brotli is not None,
+        "cases": run(args.number, args.repeat),
+    }
+    sys.exit(finish(result, args.out, args.baseline, args.save_baseline, args.tolerance))
@@ -0,0 +1,141 @@
+# bench/startup.py
+"""
+Cold-start profile: import time of backend.main and time-to-ready of a fresh
+uvicorn process.
+
+  import   `python -X importtime -c "import backend.main"` in --repeat fresh
+           interpreters. Reports the best total, the heaviest modules by
+           self time, and any module that should stay lazy (the OpenAI SDK)
+           but was imported anyway.
+  ready    starts uvicorn --repeat times against one temp DB. Times spawn to
+           the first 200 from /healthz, and the first GET /me after that.
+           The first boot creates the schema and is reported on its own.
+
+The *_ms keys, plus lazy_errors, feed bench.report, so --baseline flags
+regressions:
+
+    python -m bench.startup --save-baseline startup-base.json
+    python -m bench.startup --baseline startup-base.json --tolerance 0.2
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench.report import add_cli_args, finish
+
+MODULE = "backend.main"
+MUST_STAY_LAZY = ("openai",)
+
+
+def _env(db_path: str) -> dict:
+    env = dict(os.environ)
+    env.update(MOEX_DB=db_path, OPENAI_API_KEY=env.get("OPENAI_API_KEY", "fake"), PYTHONPATH=os.getcwd())
+    return env
+
+
+def parse_importtime(stderr: str) -> list:
+    """[(module, self_us, cumulative_us, depth)] from -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cum_us), depth))
+    return rows
+
+
+def profile_imports(env: dict, repeat: int, top: int) -> dict:
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {MODULE}"],
+            env=env, capture_output=True, text=True, check=True,
+        )
+        rows = parse_importtime(proc.stderr)
+        total = next(cum for name, _, cum, _ in rows if name == MODULE)
+        if best is None or total < best[0]:
+            best = (total, rows)
+    total, rows = best
+    loaded = {name for name, *_ in rows}
+    lazy = sorted(m for m in MUST_STAY_LAZY if m in loaded)
+    heaviest = sorted(rows, key=lambda r: r[1], reverse=True)[:top]
+    # top-level packages (depth 1 under backend.main) ranked by cumulative cost
+    packages = sorted((r for r in rows if r[3] == 1), key=lambda r: r[2], reverse=True)[:top]
+    return {
+        "total_ms": round(total / 1000, 1),
+        "modules": len(rows),
+        "lazy_errors": len(lazy),
+        "eagerly_imported": lazy,
+        "heaviest_self": [{"module": n, "self": round(s / 1000, 2), "cumulative": round(c / 1000, 2)}
+                          for n, s, c, _ in heaviest],
+        "heaviest_direct": [{"module": n, "cumulative": round(c / 1000, 2)} for n, _, c, _ in packages],
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def boot_once(env: dict, timeout: float = 30.0) -> dict:
+    port = _free_port()
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{MODULE}:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        with httpx.Client(timeout=5.0) as client:
+            while True:
+                if proc.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited with {proc.returncode}")
+                if time.perf_counter() - started > timeout:
+                    raise RuntimeError("server not ready in time")
+                try:
+                    if client.get(base + "/healthz").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    time.sleep(0.005)
+            ready = time.perf_counter() - started
+            t = time.perf_counter()
+            client.get(base + "/me")
+            first_me = time.perf_counter() - t
+    finally:
+        proc.terminate()
+        proc.wait(10)
+    return {"ready": ready * 1000, "first_me": first_me * 1000}
+
+
+def profile_boots(env: dict, repeat: int) -> dict:
+    first = boot_once(env)  # fresh DB: schema gets applied
+    runs = [boot_once(env) for _ in range(repeat)]
+    return {
+        "first_boot_ready_ms": round(first["ready"], 1),
+        "ready_ms": round(statistics.median(r["ready"] for r in runs), 1),
+        "ready_min_ms": round(min(r["ready"] for r in runs), 1),
+        "first_me_ms": round(statistics.median(r["first_me"] for r in runs), 2),
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="MoeX cold-start profile")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--top", type=int, default=15, help="modules to list in the import report")
+    ap.add_argument("--skip-boot", action="store_true", help="import profile only")
+    add_cli_args(ap)
+    args = ap.parse_args()
+    env = _env(os.path.join(tempfile.mkdtemp(prefix="moex-startup-"), "moex.db"))
+    result = {"import": profile_imports(env, args.repeat, args.top)}
+    if not args.skip_boot:
+        result["boot"] = profile_boots(env, args.repeat)
+    sys.exit(finish(result, args.out, args.baseline, args.save_baseline, args.tolerance))